@@ -0,0 +1,291 @@
+# Transposition and time-scaling augmentation that reuses the features of the original piece
+#
+# A transposed or time-stretched variant of a piece has mostly predictable features, so an Augmenter parses the MIDI
+# file once (featureAnalysis.readMidi and extractFeatureEventsFromNotes) and derives the feature events of every
+# variant from those of the original.  transposition is in semitones; timeScale multiplies all times (2 = twice as
+# slow).  Row by row:
+#   Onset freq          transposition: unchanged; time scaling: event times x timeScale, values / timeScale
+#                       (ONSET_DENSITY: recomputed from the scaled onset times)
+#   Melodic contour     transposition: values + transposition; time scaling: recomputed from the scaled notes (the
+#                       melodic line uses an absolute 10ms overlap buffer)
+#   Loudness            unchanged values; event times x timeScale
+#   Tempo               unchanged under transposition; time scaling: event times x timeScale, values / timeScale
+#                       (the local tempo of files without a tempo map is recomputed from the scaled onset times)
+#   Harmony             transposition: unchanged (the spiral array analysis finds the transposed key, and all
+#                       distances are relative to the key); time scaling: recomputed, since the harmonic analysis
+#                       samples its piano roll at a fixed rate in seconds
+#   Dissonance          unchanged values (it only depends on intervals); event times x timeScale
+#   voice streams       recomputed from the transposed/scaled notes (under time scaling, a note that ends where
+#                       another starts can be assigned differently than in a parse of the variant file, where the
+#                       two times differ by rounding errors)
+#   harmonic features   as Harmony
+#   note features       unchanged values (sounding dissonance only depends on intervals); event times x timeScale
+# Recomputed rows only run the feature functions on the notes in memory, except for the harmony rows of time-scaled
+# variants: their harmonic analysis reads the variant's MIDI data, which variantMidi() makes by editing the tempo and
+# note messages of the original file (no music21 parse).
+#
+# augmentPredictions() runs the model on the (normalized) variant features, reusing the prediction of any earlier
+# variant with the same normalized features (e.g. transpositions, where the melodic contour only shifts).
+# verifyAugmentation() checks the derived features and predictions against the full pipeline run on the variant MIDI
+# files made by variantMidi(); run python augmentation.py to check the example MIDI files (tests/test_augmentation.py
+# runs the same check).
+#
+# Example usage:
+#   variants = augmentation.augment("midi/Brahms.mid", transpositions=range(-6, 6), timeScales=[.8, 1, 1.25])
+#   predictions = augmentation.augmentPredictions(variants, [2, 3, 3, 2, 1, 1], 3, SAMPLE_RATE, 3, .25, 5, 1, 1, True)
+#   features = variants[(2, 1.25)]   # two semitones up, 25% slower
+
+import argparse
+import io
+import os
+import sys
+import time
+import mido
+import numpy as np
+import dataProcessing
+import featureAnalysis as analysis
+import localTempo
+import noteObj
+import onsetDensity
+import tension_calculation as tc
+import tensionModel
+
+DRUM_CHANNEL = 9 # MIDI channel 10, which isn't transposed
+DEFAULT_TEMPO = 500000 # microseconds per beat (120 BPM), when a file has no tempo message at the start
+# Scaled times are rounded to this many decimals, so that a time that falls on a sample (e.g. 33.8 = 42.25 x .8) is
+# the same float as the sample time and featureAnalysis.rasterizeEvents doesn't put it one sample late
+TIME_DECIMALS = 9
+
+
+def scaleTime(times, timeScale):
+    if timeScale == 1:
+        return times
+    return np.round(times * timeScale, TIME_DECIMALS)
+
+
+# The notes of onsetsAll (dict keyed by onset time with lists of noteObjs) transposed and time-scaled
+def transformNotes(onsetsAll, transposition=0, timeScale=1):
+    transformed = {}
+    for onset, notes in onsetsAll.items():
+        newNotes = []
+        for note in notes:
+            pitch = note.pitch + transposition
+            if not 0 <= pitch <= 127:
+                raise ValueError('transposing pitch %d by %d semitones is out of the MIDI range' % (note.pitch, transposition))
+            newNotes.append(noteObj.NoteObj(scaleTime(note.onset, timeScale), scaleTime(note.endTime, timeScale), pitch,
+                                            note.velocity, note.isRest, note.isTied))
+        transformed[scaleTime(onset, timeScale)] = newNotes
+    return transformed
+
+
+# The variant of a MIDI file (a path or a tension_calculation.MidiMember) as a MidiMember: the note messages (outside
+# the drum channel) are transposed and the tempo messages scaled, so the variant has the same ticks as the original
+def variantMidi(inputFile, transposition=0, timeScale=1):
+    if isinstance(inputFile, tc.MidiMember):
+        data = inputFile.data
+    else:
+        with open(inputFile, "rb") as fp:
+            data = fp.read()
+    midiFile = mido.MidiFile(file=io.BytesIO(data))
+
+    initialTempo = False
+    for track in midiFile.tracks:
+        tick = 0
+        for message in track:
+            tick += message.time
+            if message.type == "set_tempo":
+                message.tempo = int(round(message.tempo * timeScale))
+                initialTempo = initialTempo or tick == 0
+            elif message.type in ("note_on", "note_off") and message.channel != DRUM_CHANNEL:
+                pitch = message.note + transposition
+                if not 0 <= pitch <= 127:
+                    raise ValueError('transposing pitch %d by %d semitones is out of the MIDI range' % (message.note, transposition))
+                message.note = pitch
+    if timeScale != 1 and not initialTempo:
+        midiFile.tracks[0].insert(0, mido.MetaMessage("set_tempo", tempo=int(round(DEFAULT_TEMPO * timeScale)), time=0))
+
+    output = io.BytesIO()
+    midiFile.save(file=output)
+    name = "%s_t%+d_x%g.mid" % (os.path.splitext(str(inputFile))[0], transposition, timeScale)
+    return tc.MidiMember(name, output.getvalue())
+
+
+def scaleEvents(events, timeScale, valueScale=1):
+    times, values, initVal = events
+    return scaleTime(np.asarray(times, dtype=float), timeScale), np.asarray(values, dtype=float) * valueScale, initVal * valueScale
+
+
+class Augmenter:
+    # The arguments are those of featureAnalysis.extractFeaturesMidi
+    def __init__(self, inputFile, sampleRate=10, bOnsetFreq=True, bMelodicContour=True, bLoudness=True, bTempo=True, bHarmony=True,
+                 bDissonance=True, harmonyModel=analysis.HARMONY_SPIRAL_ARRAY, voiceStreams=(), bLocalTempo=False,
+                 onsetModel=analysis.ONSET_FREQUENCY, harmonicFeatures=(), onsetWindowDur=onsetDensity.WINDOW_DUR,
+                 onsetKernel=onsetDensity.BOXCAR, noteFeatures=()):
+        self.inputFile = inputFile
+        self.sampleRate = sampleRate
+        self.options = {"bOnsetFreq": bOnsetFreq, "bMelodicContour": bMelodicContour, "bLoudness": bLoudness, "bTempo": bTempo,
+                        "bHarmony": bHarmony, "bDissonance": bDissonance, "harmonyModel": harmonyModel,
+                        "voiceStreams": tuple(voiceStreams), "bLocalTempo": bLocalTempo, "onsetModel": onsetModel,
+                        "harmonicFeatures": tuple(harmonicFeatures), "onsetWindowDur": onsetWindowDur, "onsetKernel": onsetKernel,
+                        "noteFeatures": tuple(noteFeatures)}
+        self.numRows = analysis.NUM_FEATURES + len(voiceStreams) + len(harmonicFeatures) + len(noteFeatures)
+
+        self.onsetsAll, self.tempoChanges, self.totalDuration = analysis.readMidi(inputFile)
+        self.featureEvents, self.totalSamples = analysis.extractFeatureEventsFromNotes(inputFile, self.onsetsAll, self.tempoChanges,
+                                                                                      self.totalDuration, sampleRate, **self.options)
+        self.localTempo = bTempo and bLocalTempo and not localTempo.hasTempoMap(self.tempoChanges)
+
+    def features(self):
+        return analysis.rasterizeFeatureEvents(self.featureEvents, self.numRows, self.sampleRate, self.totalSamples)
+
+    # The feature events of a variant and its number of samples (as featureAnalysis.extractFeatureEventsMidi)
+    def variantEvents(self, transposition=0, timeScale=1):
+        if transposition == 0 and timeScale == 1:
+            return dict(self.featureEvents), self.totalSamples
+        options = self.options
+        scaled = timeScale != 1
+        totalDuration = self.totalDuration * timeScale
+        totalSamples = int(totalDuration * self.sampleRate)
+        onsetsAll = transformNotes(self.onsetsAll, transposition, timeScale)
+        tempoChanges = {scaleTime(time, timeScale): [scaleTime(val[0], timeScale), val[1] / timeScale] for time, val in self.tempoChanges.items()}
+
+        # Rows that are recomputed from the transformed notes (and, for the harmony of time-scaled variants, from the
+        # variant's MIDI data)
+        density = options["onsetModel"] == analysis.ONSET_DENSITY
+        recompute = {"bOnsetFreq": options["bOnsetFreq"] and scaled and density,
+                     "bMelodicContour": options["bMelodicContour"] and scaled,
+                     "bLoudness": False,
+                     "bTempo": scaled and self.localTempo,
+                     "bHarmony": options["bHarmony"] and scaled,
+                     "bDissonance": False,
+                     "harmonicFeatures": options["harmonicFeatures"] if scaled else ()}
+        recomputeOptions = dict(options, **recompute)
+        harmonyPass = recompute["bHarmony"] or len(recompute["harmonicFeatures"]) > 0
+        inputFile = variantMidi(self.inputFile, transposition, timeScale) if harmonyPass else self.inputFile
+        events, _ = analysis.extractFeatureEventsFromNotes(inputFile, onsetsAll, tempoChanges, totalDuration, self.sampleRate,
+                                                           **recomputeOptions)
+
+        # The other rows are derived from the original events
+        for i, original in self.featureEvents.items():
+            if i in events:
+                continue
+            if i == analysis.iOnsetFreq:
+                events[i] = scaleEvents(original, timeScale, 1 / timeScale)
+            elif i == analysis.iMelodicContour:
+                times, values, initVal = original
+                events[i] = (np.asarray(times, dtype=float), np.asarray(values, dtype=float) + transposition, initVal)
+            elif i == analysis.iTempo:
+                events[i] = scaleEvents(original, timeScale, 1 / timeScale)
+            else:
+                events[i] = scaleEvents(original, timeScale)
+        return events, totalSamples
+
+    # The feature matrix of a variant (as featureAnalysis.extractFeaturesMidi)
+    def variantFeatures(self, transposition=0, timeScale=1):
+        events, totalSamples = self.variantEvents(transposition, timeScale)
+        return analysis.rasterizeFeatureEvents(events, self.numRows, self.sampleRate, totalSamples)
+
+
+# Feature matrices of all combinations of the transpositions and time scales, keyed by (transposition, timeScale)
+# (the keyword arguments are those of featureAnalysis.extractFeaturesMidi)
+def augment(inputFile, transpositions=range(-6, 6), timeScales=(1,), sampleRate=10, **options):
+    augmenter = Augmenter(inputFile, sampleRate, **options)
+    return {(transposition, timeScale): augmenter.variantFeatures(transposition, timeScale)
+            for timeScale in timeScales for transposition in transpositions}
+
+
+def normalizeFeatures(features):
+    return np.array([dataProcessing.normalize(feature) for feature in features])
+
+
+# Tension predictions of the variants (a dict of feature matrices as returned by augment), keyed the same way.  The
+# features are normalized first (as in testTensionModel.py) unless normalize is False; a variant whose normalized
+# features match those of an earlier variant (to 1e-12) gets its prediction.
+def augmentPredictions(variants, featureWeights, memoryWindowDur, sampleRate, attentionalWindowDur, windowShift, memoryWeight,
+                       initSlope, lag, sliderOnset=False, normalize=True):
+    predictions = {}
+    computed = [] # (normalized features, prediction)
+    for key, features in variants.items():
+        if normalize:
+            features = normalizeFeatures(features)
+        for previousFeatures, prediction in computed:
+            if previousFeatures.shape == features.shape and np.allclose(previousFeatures, features, rtol=0, atol=1e-12):
+                break
+        else:
+            slopeTensor = tensionModel.computeSlopeTensor(features, sampleRate, attentionalWindowDur, windowShift)
+            prediction = tensionModel.runModelFromSlopes(slopeTensor, featureWeights, memoryWindowDur, memoryWeight, initSlope,
+                                                         lag, sliderOnset)
+            computed.append((features, prediction))
+        predictions[key] = prediction
+    return predictions
+
+
+################################################################################################################################
+# Verification
+################################################################################################################################
+
+def maxDeviation(expected, actual):
+    if np.shape(expected) != np.shape(actual):
+        return np.inf
+    if np.size(expected) == 0:
+        return 0.0
+    return float(np.max(np.abs(np.asarray(expected, dtype=float) - np.asarray(actual, dtype=float))))
+
+
+# Check the derived features and predictions of every variant against extractFeaturesMidi and the model run on the
+# variant's MIDI file (variantMidi).  Returns one report per variant: a dict with the maximum feature and prediction
+# deviations, whether they are within tolerance, and the time taken by the augmenter (including the original analysis)
+# and by the full pipeline.
+# Tempo messages hold whole microseconds per beat, so the variant files are only exactly time-scaled if timeScale times
+# every tempo of the file is a whole number (as for the defaults and tempos like 500000); otherwise their times drift
+# from the exact scaling and events near sample times can move by a sample.
+# featureWeights: by default those of testTensionModel.py, with weight 1 for any voice streams, harmonic features and note features
+def verifyAugmentation(inputFile, transpositions=(-5, 0, 7), timeScales=(.8, 1, 1.25), sampleRate=10, featureWeights=None,
+                       modelParameters=None, tolerance=1e-6, **options):
+    if featureWeights is None:
+        numExtra = len(options.get("voiceStreams", ())) + len(options.get("harmonicFeatures", ())) + len(options.get("noteFeatures", ()))
+        featureWeights = [2, 3, 3, 2, 1, 1] + [1] * numExtra
+    if modelParameters is None:
+        modelParameters = {"memoryWindowDur": 3, "attentionalWindowDur": 3, "windowShift": .25, "memoryWeight": 5,
+                           "initSlope": 1, "lag": 1, "sliderOnset": True}
+    start = time.perf_counter()
+    variants = augment(inputFile, transpositions, timeScales, sampleRate, **options)
+    predictions = augmentPredictions(variants, featureWeights, sampleRate=sampleRate, **modelParameters)
+    augmentTime = time.perf_counter() - start
+
+    reports = []
+    fullTime = 0
+    for (transposition, timeScale), features in variants.items():
+        start = time.perf_counter()
+        expected = analysis.extractFeaturesMidi(variantMidi(inputFile, transposition, timeScale), sampleRate, **options)
+        expectedPrediction = augmentPredictions({0: expected}, featureWeights, sampleRate=sampleRate, **modelParameters)[0]
+        fullTime += time.perf_counter() - start
+        featureDeviation = maxDeviation(expected, features)
+        predictionDeviation = maxDeviation(expectedPrediction, predictions[(transposition, timeScale)])
+        reports.append({"transposition": transposition,
+                        "timeScale": timeScale,
+                        "featureDeviation": featureDeviation,
+                        "predictionDeviation": predictionDeviation,
+                        "passed": featureDeviation <= tolerance and predictionDeviation <= tolerance})
+    for report in reports:
+        report["augmentTime"] = augmentTime
+        report["fullTime"] = fullTime
+    return reports
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Check augmented features against the full pipeline run on the variant MIDI files")
+    parser.add_argument("files", nargs="*", default=[os.path.join(os.path.dirname(os.path.abspath(__file__)), "midi", name)
+                                                     for name in ("Brahms.mid", "Morgengruss.mid")])
+    args = parser.parse_args()
+    allPassed = True
+    print("%-16s %6s %6s %12s %12s %8s" % ("file", "trans", "scale", "feature dev", "predict dev", "result"))
+    for fileName in args.files:
+        reports = verifyAugmentation(fileName)
+        for report in reports:
+            allPassed = allPassed and report["passed"]
+            print("%-16s %6d %6g %12.3g %12.3g %8s" % (os.path.basename(fileName), report["transposition"], report["timeScale"],
+                                                       report["featureDeviation"], report["predictionDeviation"],
+                                                       "ok" if report["passed"] else "FAILED"))
+        print("%s: augmented in %.2fs, full pipeline %.2fs" % (os.path.basename(fileName), reports[0]["augmentTime"], reports[0]["fullTime"]))
+    sys.exit(0 if allPassed else 1)
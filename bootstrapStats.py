@@ -0,0 +1,171 @@
+# Bootstrap confidence intervals for the fit of tension predictions to listeners' responses
+#
+# The fit of a prediction is its Pearson correlation (and RMSE) with the mean response of the participants.  To get
+# confidence intervals, the participants (and optionally the pieces) are resampled with replacement.  Each chunk of
+# resamples is drawn as an index matrix (resamples x participants), turned into a count matrix, and the mean
+# responses of all resamples in the chunk are a single matrix product with the (participants x samples) responses.
+# The correlations and RMSEs of all rows are then computed at once from row sums, as in evaluation.lagCorrelations.
+# The chunk size bounds the memory used (chunk x samples), and the chunks can run in a pool of worker processes.
+# Every chunk has its own random stream spawned from the seed, so the result doesn't depend on the number of workers.
+#
+# Missing responses (NaN, e.g. from responseData) are left out of the mean of each sample; samples no resampled
+# participant covers are left out of the correlation.  The same participants are drawn for every piece, so the
+# responses of all pieces must have the participants in the same order (rows of a participant who didn't hear a
+# piece are all NaN).
+#
+# Example usage:
+#   results = bootstrapStats.bootstrapFit([brahmsPrediction, morgengrussPrediction], [brahmsResponses.data, morgengrussResponses.data],
+#                                         numResamples=10000, numWorkers=4, seed=1)
+#   print(results["r"], results["rInterval"], results["pieceRIntervals"])
+
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+
+DEFAULT_CHUNK_BYTES = 64 * 1024 * 1024 # memory for the resampled mean responses of one chunk
+
+
+# Count matrix (resamples x numItems) of a bootstrap index matrix: how often each item is drawn in each resample
+def bootstrapCounts(rng, numResamples, numItems):
+    indices = rng.integers(0, numItems, size=(numResamples, numItems))
+    offsets = np.arange(numResamples)[:, np.newaxis] * numItems
+    return np.bincount((indices + offsets).ravel(), minlength=numResamples * numItems).reshape(numResamples, numItems).astype(float)
+
+
+# Pearson correlation and RMSE between one prediction and every row of means, over the samples where valid is True
+def rowFit(prediction, means, valid, normalize=True):
+    n = valid.sum(axis=1).astype(float)
+    p = np.where(valid, prediction[np.newaxis, :], 0)
+    y = np.where(valid, means, 0)
+    sumP = p.sum(axis=1)
+    sumY = y.sum(axis=1)
+    sumPP = (p * p).sum(axis=1)
+    sumYY = (y * y).sum(axis=1)
+    sumPY = (p * y).sum(axis=1)
+
+    covariance = n * sumPY - sumP * sumY
+    variance = np.maximum((n * sumPP - sumP * sumP) * (n * sumYY - sumY * sumY), 0)
+    r = np.divide(covariance, np.sqrt(variance), out=np.zeros_like(covariance), where=variance > 0)
+    if normalize:
+        # RMSE of the z-scores (population standard deviations) of prediction and mean response
+        rmse = np.sqrt(np.maximum(2 - 2 * r, 0))
+    else:
+        rmse = np.sqrt(np.divide(np.maximum(sumPP + sumYY - 2 * sumPY, 0), n, out=np.full_like(n, np.nan), where=n > 0))
+    r[n < 2] = np.nan
+    rmse[n < 2] = np.nan
+    return r, rmse
+
+
+# Fit of every piece for the given participant counts (resamples x participants)
+# Return value: r and rmse matrices (resamples x pieces)
+def fitForCounts(counts, predictions, responses, masks, normalize=True):
+    numPieces = len(predictions)
+    r = np.zeros((counts.shape[0], numPieces))
+    rmse = np.zeros((counts.shape[0], numPieces))
+    for piece in range(numPieces):
+        weights = counts @ masks[piece]
+        means = np.divide(counts @ responses[piece], weights, out=np.zeros_like(weights), where=weights > 0)
+        r[:, piece], rmse[:, piece] = rowFit(predictions[piece], means, weights > 0, normalize)
+    return r, rmse
+
+
+# Mean over the pieces, each piece counted as often as it's drawn (pieceCounts: resamples x pieces, or None for all once)
+def combinePieces(values, pieceCounts):
+    if pieceCounts is None:
+        pieceCounts = np.ones(values.shape[1])
+    pieceCounts = np.where(np.isnan(values), 0, pieceCounts)
+    total = pieceCounts.sum(axis=-1)
+    return np.divide((np.nan_to_num(values) * pieceCounts).sum(axis=-1), total, out=np.full(values.shape[0], np.nan), where=total > 0)
+
+
+# Bootstrap one chunk of resamples with its own random stream
+def bootstrapChunk(seedSequence, numResamples, predictions, responses, masks, resamplePieces, normalize):
+    rng = np.random.default_rng(seedSequence)
+    counts = bootstrapCounts(rng, numResamples, responses[0].shape[0])
+    pieceCounts = bootstrapCounts(rng, numResamples, len(predictions)) if resamplePieces else None
+    r, rmse = fitForCounts(counts, predictions, responses, masks, normalize)
+    return r, rmse, combinePieces(r, pieceCounts), combinePieces(rmse, pieceCounts)
+
+
+# Each worker gets the data once, when the worker process starts
+workerData = None
+
+def initWorker(predictions, responses, masks, resamplePieces, normalize):
+    global workerData
+    workerData = (predictions, responses, masks, resamplePieces, normalize)
+
+def runChunk(chunk):
+    seedSequence, numResamples = chunk
+    return bootstrapChunk(seedSequence, numResamples, *workerData)
+
+
+# Predictions and responses as lists (one item per piece) of vectors and of (participants x samples) matrices with
+# zeros in place of missing values, plus the masks of valid responses
+def prepareData(predictions, responses):
+    if np.ndim(predictions[0]) == 0:
+        predictions = [predictions]
+        responses = [responses]
+    if len(predictions) != len(responses):
+        raise ValueError('%d predictions but responses for %d pieces' % (len(predictions), len(responses)))
+    predictions = [np.asarray(prediction, dtype=float) for prediction in predictions]
+    responses = [np.atleast_2d(np.asarray(response, dtype=float)) for response in responses]
+    numParticipants = responses[0].shape[0]
+    for piece, (prediction, response) in enumerate(zip(predictions, responses)):
+        if response.shape[0] != numParticipants:
+            raise ValueError('piece %d has %d participants instead of %d' % (piece, response.shape[0], numParticipants))
+        if response.shape[1] != len(prediction):
+            raise ValueError('piece %d: prediction length (%d) does not match response length (%d)' % (piece, len(prediction), response.shape[1]))
+    masks = [(~np.isnan(response)).astype(float) for response in responses]
+    responses = [np.nan_to_num(response) for response in responses]
+    return predictions, responses, masks
+
+
+# Bootstrap confidence intervals of the fit between predictions and mean responses
+# Arguments:
+#   predictions: one prediction vector, or a list with one per piece
+#   responses: one (participants x samples) matrix (NaN where missing), or a list with one per piece
+#   resamplePieces: also resample the pieces (the overall fit is the mean over the drawn pieces)
+#   chunkSize: resamples per chunk (by default, as many as fit in DEFAULT_CHUNK_BYTES)
+#   numWorkers: number of worker processes (1 = run in this process)
+#   normalize: RMSE between z-scores (as evaluation.evaluatePredictions) instead of the raw values
+# Return value: dict with the fit of all participants ("r", "rmse" overall and "pieceR", "pieceRmse" per piece), the
+# percentile intervals ("rInterval", "rmseInterval": [low, high]; "pieceRIntervals", "pieceRmseIntervals": pieces x 2),
+# and the resampled values ("rResamples", "rmseResamples": resamples; "pieceRResamples", "pieceRmseResamples":
+# resamples x pieces)
+def bootstrapFit(predictions, responses, numResamples=10000, confidence=.95, resamplePieces=True, chunkSize=None,
+                 numWorkers=1, seed=None, normalize=True):
+    predictions, responses, masks = prepareData(predictions, responses)
+    numParticipants = responses[0].shape[0]
+    if chunkSize is None:
+        bytesPerResample = 8 * (numParticipants + 3 * max(len(prediction) for prediction in predictions))
+        chunkSize = max(1, DEFAULT_CHUNK_BYTES // bytesPerResample)
+    chunkSizes = [min(chunkSize, numResamples - start) for start in range(0, numResamples, chunkSize)]
+    chunks = list(zip(np.random.SeedSequence(seed).spawn(len(chunkSizes)), chunkSizes))
+
+    if numWorkers > 1 and len(chunks) > 1:
+        with ProcessPoolExecutor(max_workers=min(numWorkers, len(chunks)), initializer=initWorker,
+                                 initargs=(predictions, responses, masks, resamplePieces, normalize)) as executor:
+            results = list(executor.map(runChunk, chunks))
+    else:
+        results = [bootstrapChunk(seedSequence, size, predictions, responses, masks, resamplePieces, normalize)
+                   for seedSequence, size in chunks]
+
+    pieceR = np.concatenate([result[0] for result in results])
+    pieceRmse = np.concatenate([result[1] for result in results])
+    r = np.concatenate([result[2] for result in results])
+    rmse = np.concatenate([result[3] for result in results])
+
+    # Fit with every participant (and piece) once
+    fullR, fullRmse = fitForCounts(np.ones((1, numParticipants)), predictions, responses, masks, normalize)
+    percentiles = [50 * (1 - confidence), 50 * (1 + confidence)]
+    return {"r": combinePieces(fullR, None)[0],
+            "rmse": combinePieces(fullRmse, None)[0],
+            "pieceR": fullR[0],
+            "pieceRmse": fullRmse[0],
+            "rInterval": np.nanpercentile(r, percentiles),
+            "rmseInterval": np.nanpercentile(rmse, percentiles),
+            "pieceRIntervals": np.nanpercentile(pieceR, percentiles, axis=0).T,
+            "pieceRmseIntervals": np.nanpercentile(pieceRmse, percentiles, axis=0).T,
+            "rResamples": r,
+            "rmseResamples": rmse,
+            "pieceRResamples": pieceR,
+            "pieceRmseResamples": pieceRmse}
@@ -0,0 +1,193 @@
+# Deduplication index for MIDI corpora
+#
+# Large MIDI collections contain many byte-identical files and many files with the same music but different
+# metadata (track names, text events, track order, ticks per beat).  A CorpusIndex records two hashes per file:
+#   raw:      a hash of the file's bytes
+#   content:  a hash of the note content: every note as (onset, pitch, duration, velocity, drum flag), with times in
+#             seconds rounded to TIME_RESOLUTION, sorted, plus the tempo and time signature changes (which the Tempo
+#             feature and the beat windows of the harmonic analysis depend on).  Everything else is ignored.
+# Files with the same hash form a group.  Batch runs (runDeduplicated) analyze only the first file of each group -
+# its representative - and fan the result out to the other files of the group.  Files that can't be parsed have no
+# content hash and are grouped by their raw hash.
+#
+# The index is built in one pass over the files (each file is read once, hashed and parsed with pretty_midi) in a
+# pool of worker processes; archives are indexed through midiArchive, with the member names as file names.  Indexes
+# are saved as JSON.
+#
+# Example usage:
+#   index = corpusIndex.indexCorpus("lmd_full.tar.gz", numWorkers=8)
+#   index.save("lmd_full.index.json")
+#   print(index.numFiles(), len(index.representatives()))
+#   features = corpusIndex.runDeduplicated(index, midiArchive.extractFeatures, numWorkers=8, archivePath="lmd_full.tar.gz")
+
+import hashlib
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import midiArchive
+import tension_calculation as tc
+
+RAW = "raw"
+CONTENT = "content"
+TIME_RESOLUTION = .001 # seconds
+
+
+class CorpusIndex:
+    # entries: dict keyed by file name; each item is [raw hash, content hash (None if the file can't be parsed)]
+    def __init__(self, entries):
+        self.entries = entries
+
+    def numFiles(self):
+        return len(self.entries)
+
+    def fileNames(self):
+        return list(self.entries.keys())
+
+    # The hash of each file: the raw hash, or the content hash where there is one
+    def hashes(self, key=CONTENT):
+        if key == RAW:
+            return {name: entry[0] for name, entry in self.entries.items()}
+        elif key == CONTENT:
+            return {name: entry[1] if entry[1] is not None else entry[0] for name, entry in self.entries.items()}
+        raise ValueError('unknown hash key %s' % key)
+
+    # Lists of file names with the same hash, keyed by the hash (in index order)
+    def groups(self, key=CONTENT):
+        groups = {}
+        for name, fileHash in self.hashes(key).items():
+            groups.setdefault(fileHash, []).append(name)
+        return groups
+
+    # The first file of each group
+    def representatives(self, key=CONTENT):
+        return [names[0] for names in self.groups(key).values()]
+
+    # The representative of every file
+    def representativeOf(self, key=CONTENT):
+        return {name: names[0] for names in self.groups(key).values() for name in names}
+
+    # The other files of each group with more than one file, keyed by the representative
+    def duplicates(self, key=CONTENT):
+        return {names[0]: names[1:] for names in self.groups(key).values() if len(names) > 1}
+
+    # Results for every file from results keyed by representative (files whose representative has no result are left out)
+    def fanOut(self, results, key=CONTENT):
+        return {name: results[representative] for name, representative in self.representativeOf(key).items()
+                if representative in results}
+
+    def save(self, path):
+        with open(path, "w") as fp:
+            json.dump(self.entries, fp)
+
+
+def openIndex(path):
+    with open(path) as fp:
+        return CorpusIndex(json.load(fp))
+
+
+################################################################################################################################
+# Hashing
+################################################################################################################################
+
+def rawHash(data):
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+
+def toTicks(seconds):
+    return np.round(np.asarray(seconds, dtype=float) / TIME_RESOLUTION).astype(np.int64)
+
+
+# Hash of the note content of a pretty_midi.PrettyMIDI object (see the top of the file)
+def contentHash(pm):
+    rows = [np.zeros((0, 5), dtype=np.int64)]
+    for instrument in pm.instruments:
+        if len(instrument.notes) == 0:
+            continue
+        starts = np.array([note.start for note in instrument.notes])
+        ends = np.array([note.end for note in instrument.notes])
+        rows.append(np.column_stack((toTicks(starts), [note.pitch for note in instrument.notes], toTicks(ends) - toTicks(starts),
+                                     [note.velocity for note in instrument.notes], np.full(len(starts), int(instrument.is_drum)))))
+    notes = np.concatenate(rows).astype(np.int64)
+    notes = notes[np.lexsort(notes.T[::-1])]
+
+    tempoTimes, tempos = pm.get_tempo_changes()
+    tempoChanges = np.column_stack((toTicks(tempoTimes), np.round(np.asarray(tempos) * 1000).astype(np.int64)))
+    timeSignatures = np.array([[toTicks(change.time), change.numerator, change.denominator] for change in pm.time_signature_changes],
+                              dtype=np.int64).reshape(-1, 3)
+
+    digest = hashlib.blake2b(digest_size=16)
+    for table in (notes, tempoChanges, timeSignatures):
+        digest.update(np.int64(table.shape[0]).tobytes())
+        digest.update(np.ascontiguousarray(table).tobytes())
+    return digest.hexdigest()
+
+
+# [raw hash, content hash] of a file given as a path or a tension_calculation.MidiMember
+def hashMidi(fileName):
+    if isinstance(fileName, tc.MidiMember):
+        data = fileName.data
+    else:
+        with open(fileName, "rb") as fp:
+            data = fp.read()
+    try:
+        content = contentHash(tc.read_midi(tc.MidiMember(str(fileName), data)))
+    except Exception as e:
+        print('Unexpected error in ' + fileName + ':\n', e)
+        content = None
+    return [rawHash(data), content]
+
+
+################################################################################################################################
+# Building the index
+################################################################################################################################
+
+# Index of a list of MIDI files
+def indexFiles(fileNames, numWorkers=1, chunkSize=64):
+    fileNames = list(fileNames)
+    if numWorkers > 1 and len(fileNames) > 1:
+        with ProcessPoolExecutor(max_workers=numWorkers) as executor:
+            entries = list(executor.map(hashMidi, fileNames, chunksize=chunkSize))
+    else:
+        entries = [hashMidi(fileName) for fileName in fileNames]
+    return CorpusIndex(dict(zip(fileNames, entries)))
+
+
+# Index of the MIDI members of a zip or tar archive (see midiArchive.py)
+def indexArchive(archivePath, numWorkers=1):
+    return CorpusIndex(dict(midiArchive.iterArchive(archivePath, hashMidi, numWorkers)))
+
+
+# Index of all the MIDI files in a folder (see tension_calculation.walk) or of an archive
+def indexCorpus(path, numWorkers=1):
+    if os.path.isdir(path):
+        return indexFiles(sorted(tc.walk(path)), numWorkers)
+    return indexArchive(path, numWorkers)
+
+
+################################################################################################################################
+# Batch runs
+################################################################################################################################
+
+def runFile(fileName, function):
+    try:
+        return function(fileName)
+    except Exception as e:
+        print('Unexpected error in ' + fileName + ':\n', e)
+        return None
+
+
+# Run function on one representative of each group and return the results of all files, keyed by file name.  With
+# archivePath, the files are members of that archive and function gets them as tension_calculation.MidiMembers (see
+# midiArchive.iterArchive); otherwise it gets the file names.  function must be picklable when numWorkers > 1.
+# Files whose representative can't be processed get None.
+def runDeduplicated(index, function, key=CONTENT, numWorkers=1, archivePath=None):
+    representatives = index.representatives(key)
+    if archivePath is not None:
+        results = dict(midiArchive.iterArchive(archivePath, function, numWorkers, representatives))
+    elif numWorkers > 1 and len(representatives) > 1:
+        with ProcessPoolExecutor(max_workers=numWorkers) as executor:
+            results = dict(zip(representatives, executor.map(runFile, representatives, [function] * len(representatives))))
+    else:
+        results = {name: runFile(name, function) for name in representatives}
+    return index.fanOut(results, key)
@@ -0,0 +1,478 @@
+# Equivalence harness: checks optimized engines against golden outputs of the reference implementation
+#
+# Three stages of the analysis are checked separately:
+#   features:      featureAnalysis.extractFeaturesMidi (MIDI file -> feature matrix)
+#   prediction:    the trend-salience model (normalized features -> tension prediction)
+#   tonalTension:  tension_calculation.cal_tension (MIDI file -> tensile strain, diameters and centroid differences),
+#                  with 2 beat windows; tonalKeyChange adds key change detection, tonalDownbeats uses bar windows
+# The reference engine of each stage is a frozen copy of the plain Python implementation the published results were
+# produced with: referenceRunModel below (the original np.polyfit loop of tensionModel.runModel) for the model, and the
+# copies of the original extractFeaturesMidi and cal_tension in referenceAnalysis.py for the other two stages.  None of
+# them call the live modules, so optimizing those can't change the reference.  writeGolden() runs the reference engines
+# on midi/Brahms.mid, midi/Morgengruss.mid and a seeded synthetic corpus (one piece of which modulates, so that a key
+# change is detected) and stores their outputs in GOLDEN_DIR (the synthetic MIDI files are stored there too, so the
+# inputs never change).  It refuses to replace golden outputs or synthetic files that the reference no longer
+# reproduces (within the stage tolerances) unless forced, so drift is reported rather than stored.
+#
+# checkEngine() runs an engine on every golden case and reports the maximum absolute deviation from the golden output
+# (against the tolerance of the stage) and its speedup over the reference engine.  The prediction engines get the
+# golden features as input, so a deviation in the feature stage doesn't show up as a deviation in the model.  The
+# engines in NAN_ENGINES are also run on the golden features with NaN samples, against the reference on the same input.
+# New engines are added to ENGINES.
+#
+# Example usage:
+#   python equivalence.py                  (check every engine against the stored golden outputs)
+#   python equivalence.py --write-golden   (regenerate the golden outputs from the reference engines)
+#   python equivalence.py --write-golden --force   (also replace golden outputs the reference no longer reproduces)
+#   reports = equivalence.checkEngine("prediction", "slopeTensor")
+
+import argparse
+import functools
+import math
+import os
+import shutil
+import tempfile
+import time
+import numpy as np
+import pretty_midi
+import dataProcessing
+import featureAnalysis as analysis
+import featureRuns
+import helperFunctions as hf
+import referenceAnalysis
+import tensionModel
+import tension_calculation as tc
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+GOLDEN_DIR = os.path.join(REPO_DIR, "golden")
+MIDI_FILES = [os.path.join(REPO_DIR, "midi", "Brahms.mid"), os.path.join(REPO_DIR, "midi", "Morgengruss.mid")]
+# Synthetic golden cases: name -> (seed, number of bars, modulation in semitones halfway)
+SYNTHETIC_CASES = {"synthetic1": (1, 16, 0), "synthetic2": (2, 16, 0), "synthetic3": (3, 16, 0), "modulating": (7, 48, 6)}
+REFERENCE = "reference"
+
+# Parameters of every stage (those of testTensionModel.py)
+SAMPLE_RATE = 10
+FEATURE_WEIGHTS = [2, 3, 3, 2, 1, 1]
+MODEL_PARAMETERS = {"memoryWindowDur": 3, "attentionalWindowDur": 3, "windowShift": .25, "memoryWeight": 5,
+                    "initSlope": 1, "lag": 1, "sliderOnset": True}
+TONAL_WINDOW_SIZE = 2
+TONAL_END_RATIO = .5
+# (window size, key change detection) of each tonal tension stage
+TONAL_STAGES = {"tonalTension": (TONAL_WINDOW_SIZE, False),
+                "tonalKeyChange": (TONAL_WINDOW_SIZE, True),
+                "tonalDownbeats": (-1, False)}
+TONAL_OUTPUTS = ["total_tension", "diameters", "centroid_diff"]
+
+# Largest absolute deviation from the golden outputs accepted for each stage
+STAGE_TOLERANCES = {"features": 1e-9,
+                    "prediction": 1e-6,
+                    "tonalTension": 1e-9,
+                    "tonalKeyChange": 1e-9,
+                    "tonalDownbeats": 1e-9}
+
+# Prediction engines that are also checked on features with a NaN sample (see checkNanSamples), and the sample that
+# is replaced by NaN
+NAN_ENGINES = ["slopeTensor"]
+NAN_SAMPLE = 50
+
+# Golden arrays produced by each stage (those of the other tonal stages are prefixed with the stage name)
+STAGE_OUTPUTS = {"features": ["features"],
+                 "prediction": ["prediction"],
+                 "tonalTension": TONAL_OUTPUTS,
+                 "tonalKeyChange": ["tonalKeyChange_" + name for name in TONAL_OUTPUTS],
+                 "tonalDownbeats": ["tonalDownbeats_" + name for name in TONAL_OUTPUTS]}
+
+
+################################################################################################################################
+# Reference implementation of the model
+################################################################################################################################
+
+# The original runModel loop (without the argument checks and figures), which fits a line with np.polyfit to every
+# attentional and memory window.  Don't optimize this: it is what the other engines are checked against.
+def referenceRunModel(features, featureWeights, memoryWindowDur, sampleRate, attentionalWindowDur, windowShift, memoryWeight,
+                      initSlope, lag, sliderOnset=False):
+    features = np.array(features)
+    numPoints = len(features[0])
+    numFeatures = len(featureWeights)
+
+    samplesPerAttentionalWindow = hf.normal_round(sampleRate * attentionalWindowDur)
+    samplesPerMemoryWindow = hf.normal_round(memoryWindowDur * sampleRate)
+
+    prediction = []
+    endReached = False
+    shift = hf.normal_round(windowShift * sampleRate)
+    if shift == 0:
+        shift = 1
+
+    startWindowDur = 2 * sampleRate
+    prevSlope = initSlope
+
+    absoluteValsofWeights = [int(math.fabs(ele)) for ele in featureWeights]
+    scaleWeightFactor = sum(absoluteValsofWeights)
+    weights = np.array(featureWeights)/scaleWeightFactor
+    initialSliderMovementSlope = .25/scaleWeightFactor
+    memoryMultiplier = memoryWeight
+    memoryWindowActive = False
+
+    for i in range(-samplesPerAttentionalWindow+2, numPoints, shift):
+        startpt = i
+        endpt = samplesPerAttentionalWindow + i - 1
+        x = np.array(range(0, samplesPerAttentionalWindow))
+        if numPoints - endpt <= 0:
+            endpt = numPoints - 1
+            x = np.array(range(0, endpt - startpt + 1))
+        elif startpt < 0:
+            startpt = 0
+            endpt = samplesPerAttentionalWindow + i - 1
+            if endpt < 1:
+                endpt = 1
+            x = np.array(range(0, endpt - startpt + 1))
+
+        if memoryWindowDur > 0:
+            memEnd = startpt - 1
+            memStart = memEnd - samplesPerMemoryWindow + 1
+            if memStart < 0:
+                memStart = 0
+            memoryWindowActive = memEnd >= 3
+
+        if not endReached and endpt > startpt:
+            currFeatures = features[:, startpt:endpt+1]
+
+            slopes = np.zeros(numFeatures)
+            for j in range(0, numFeatures):
+                p = np.polyfit(x, currFeatures[j], 1)
+                slopes[j] = p[0]
+                if np.isnan(slopes[j]):
+                    slopes[j] = 0
+
+            if memoryWindowDur > 0 and memoryWindowActive:
+                currMemoryWindowSamples = memEnd - memStart + 1
+                xMem = range(0, currMemoryWindowSamples)
+                p1 = np.polyfit(xMem, prediction[memStart:memEnd+1], 1)
+                prevSlope = p1[0]
+                if np.isnan(prevSlope):
+                    prevSlope = 0
+
+            if sliderOnset and i < startWindowDur:
+                slopeTotal = initialSliderMovementSlope
+            else:
+                slopeTotal = sum(weights * slopes)
+
+            epsilon = .0001
+            decay = .001
+
+            if memoryWindowDur > 0 and memoryWindowActive:
+                if slopeTotal < epsilon and slopeTotal > -epsilon and prevSlope < epsilon and prevSlope > -epsilon:
+                    slopeTotal = slopeTotal - decay
+                elif (slopeTotal > 0 and prevSlope > 0) or (slopeTotal < 0 and prevSlope < 0):
+                    slopeTotal = slopeTotal * memoryMultiplier
+
+            y = slopeTotal * x
+
+            if startpt == 0:
+                prediction = y
+            else:
+                start = prediction[0:startpt]
+                originalStartMergeVal = prediction[startpt]
+                middle = np.array(y[0:len(prediction)-startpt] + prediction[startpt:])/2
+
+                if middle.size > 0:
+                    offset1 = originalStartMergeVal - middle[0]
+                    middle = middle + offset1
+
+                endChunk = y[len(middle):]
+                if endChunk.size > 0 and middle.size > 0:
+                    offset2 = middle[-1] - endChunk[0]
+                    endChunk = endChunk + offset2
+
+                prediction = np.concatenate((start, middle, endChunk), axis=0)
+
+        if endpt == numPoints - 1:
+            endReached = True
+
+    prediction = (prediction - np.mean(prediction))/np.std(prediction, ddof=1)
+
+    lagOffset = int(lag * sampleRate)
+    if lagOffset > 0:
+        trim = np.zeros(lagOffset)
+        trim[:] = prediction[0]
+        prediction = np.concatenate((trim, prediction[0:-lagOffset]), axis=0)
+
+    return prediction
+
+
+################################################################################################################################
+# Engines: each takes the input of its stage (a MIDI file name, or the normalized features for the prediction stage)
+# and returns a dict with the arrays in STAGE_OUTPUTS
+################################################################################################################################
+
+def featuresReference(inputFile):
+    return {"features": referenceAnalysis.extractFeaturesMidi(inputFile, SAMPLE_RATE)}
+
+
+def featuresDense(inputFile):
+    return {"features": analysis.extractFeaturesMidi(inputFile, SAMPLE_RATE)}
+
+
+def featuresRuns(inputFile):
+    runs, totalSamples = featureRuns.extractFeatureRunsMidi(inputFile, SAMPLE_RATE)
+    return {"features": np.array([featureRun.toDense() for featureRun in runs]).reshape(len(runs), totalSamples)}
+
+
+def predictionReference(features):
+    return {"prediction": referenceRunModel(features, FEATURE_WEIGHTS, sampleRate=SAMPLE_RATE, **MODEL_PARAMETERS)}
+
+
+def predictionSlopeTensor(features):
+    return {"prediction": tensionModel.runModel(features, [], analysis.featureList, FEATURE_WEIGHTS, MODEL_PARAMETERS["memoryWindowDur"],
+                                                SAMPLE_RATE, MODEL_PARAMETERS["attentionalWindowDur"], MODEL_PARAMETERS["windowShift"], "",
+                                                MODEL_PARAMETERS["memoryWeight"], MODEL_PARAMETERS["initSlope"], MODEL_PARAMETERS["lag"],
+                                                MODEL_PARAMETERS["sliderOnset"])}
+
+
+def predictionRuns(features):
+    runs = [featureRuns.runsFromDense(feature) for feature in features]
+    return {"prediction": featureRuns.runModelRuns(runs, FEATURE_WEIGHTS, MODEL_PARAMETERS["memoryWindowDur"], SAMPLE_RATE,
+                                                   MODEL_PARAMETERS["attentionalWindowDur"], MODEL_PARAMETERS["windowShift"],
+                                                   MODEL_PARAMETERS["memoryWeight"], MODEL_PARAMETERS["initSlope"],
+                                                   MODEL_PARAMETERS["lag"], MODEL_PARAMETERS["sliderOnset"], normalize=False)}
+
+
+# The tonal tension engines take the stage, whose window size and key change detection are in TONAL_STAGES
+def tonalOutputs(stage, total_tension, diameters, centroid_diff):
+    return dict(zip(STAGE_OUTPUTS[stage], [total_tension, diameters, centroid_diff]))
+
+
+def tonalTensionReference(inputFile, stage="tonalTension"):
+    windowSize, keyChanged = TONAL_STAGES[stage]
+    retvals = referenceAnalysis.calTensionFile(inputFile, windowSize, TONAL_END_RATIO, keyChanged)
+    return tonalOutputs(stage, *retvals[:3])
+
+
+def tonalTensionCalTension(inputFile, stage="tonalTension"):
+    windowSize, keyChanged = TONAL_STAGES[stage]
+    pm, piano_roll, sixteenth_time, beat_time, down_beat_time, beat_indices, down_beat_indices = tc.extract_notes(inputFile, 0)
+    retvals = tc.cal_tension(inputFile, piano_roll, sixteenth_time, beat_time, beat_indices, down_beat_time, down_beat_indices,
+                             pm, os.path.dirname(inputFile), "output", windowSize, tc.all_key_names, TONAL_END_RATIO, keyChanged)
+    return tonalOutputs(stage, *retvals[:3])
+
+
+def tonalTensionContext(inputFile, stage="tonalTension"):
+    windowSize, keyChanged = TONAL_STAGES[stage]
+    context = tc.AnalysisContext(window_size=windowSize, end_ratio=TONAL_END_RATIO, key_changed=keyChanged)
+    result = context.analyze_file(inputFile)
+    return tonalOutputs(stage, result.total_tension, result.diameters, result.centroid_diff)
+
+
+ENGINES = {"features": {REFERENCE: featuresReference, "dense": featuresDense, "runs": featuresRuns},
+           "prediction": {REFERENCE: predictionReference, "slopeTensor": predictionSlopeTensor, "runs": predictionRuns}}
+for tonalStage in TONAL_STAGES:
+    ENGINES[tonalStage] = {REFERENCE: functools.partial(tonalTensionReference, stage=tonalStage),
+                           "calTension": functools.partial(tonalTensionCalTension, stage=tonalStage),
+                           "context": functools.partial(tonalTensionContext, stage=tonalStage)}
+
+
+################################################################################################################################
+# Golden cases
+################################################################################################################################
+
+# A random but reproducible piece: block chords in a random key with a melody above them and a tempo change halfway
+# (where the key also changes by modulation semitones)
+def syntheticMidi(seed, outputFile, numBars=16, modulation=0):
+    rng = np.random.default_rng(seed)
+    tempo = float(rng.integers(60, 160))
+    pm = pretty_midi.PrettyMIDI(initial_tempo=tempo)
+    chords = pretty_midi.Instrument(program=0)
+    melody = pretty_midi.Instrument(program=0)
+
+    tonic = 48 + int(rng.integers(0, 12))
+    scale = [0, 2, 4, 5, 7, 9, 11]
+    beat = 60 / tempo
+    t = 0
+    for bar in range(numBars):
+        if bar == numBars // 2:
+            beat = 60 / float(rng.integers(60, 160))
+            tonic += modulation
+        degree = int(rng.integers(0, 7))
+        chordPitches = [tonic + scale[(degree + step) % 7] + 12 * ((degree + step) // 7) for step in (0, 2, 4)]
+        velocity = int(rng.integers(40, 110))
+        for pitch in chordPitches:
+            chords.notes.append(pretty_midi.Note(velocity, pitch, t, t + 4 * beat))
+        # Melody of eighths and quarters
+        m = t
+        while m < t + 4 * beat - 1e-9:
+            duration = beat * (.5 if rng.random() < .5 else 1)
+            pitch = tonic + 12 + scale[int(rng.integers(0, 7))] + 12 * int(rng.integers(0, 2))
+            melody.notes.append(pretty_midi.Note(int(rng.integers(50, 127)), pitch, m, min(m + duration, t + 4 * beat)))
+            m += duration
+        t += 4 * beat
+
+    pm.instruments = [melody, chords]
+    if numBars > 1:
+        # pretty_midi writes tempo changes from _tick_scales; put the second tempo at the middle bar
+        ticks = pm.time_to_tick(numBars // 2 * 4 * 60 / tempo)
+        pm._tick_scales.append((ticks, beat / pm.resolution))
+        pm._update_tick_to_time(pm.time_to_tick(t) + 1)
+    pm.write(outputFile)
+
+
+# (case name, MIDI file) of every golden case; the synthetic files have to be written by writeGolden() first (or, for
+# writeGolden, by syntheticMidi into syntheticDir)
+def goldenCases(goldenDir=GOLDEN_DIR, syntheticDir=None):
+    cases = [(os.path.splitext(os.path.basename(fileName))[0], fileName) for fileName in MIDI_FILES]
+    cases += [(caseName, os.path.join(syntheticDir or goldenDir, caseName + ".mid")) for caseName in SYNTHETIC_CASES]
+    return cases
+
+
+def goldenFile(caseName, goldenDir=GOLDEN_DIR):
+    return os.path.join(goldenDir, caseName + ".npz")
+
+
+# Run the reference engines on every case and store their outputs.  The synthetic MIDI files are made in a temporary
+# directory first.  Existing golden outputs are only replaced if the reference reproduces them within the stage
+# tolerances (or with force), and only then are the synthetic files copied to goldenDir; otherwise nothing is written
+# and the stages that changed are reported (outputs that aren't in the golden files yet, e.g. of a new stage or case,
+# are added).  Returns True if the golden outputs were written.
+def writeGolden(goldenDir=GOLDEN_DIR, force=False):
+    with tempfile.TemporaryDirectory() as syntheticDir:
+        for caseName, (seed, numBars, modulation) in SYNTHETIC_CASES.items():
+            syntheticMidi(seed, os.path.join(syntheticDir, caseName + ".mid"), numBars, modulation)
+
+        allOutputs = {}
+        changed = []
+        for caseName, inputFile in goldenCases(goldenDir, syntheticDir):
+            outputs = {}
+            for stage, engines in ENGINES.items():
+                stageInput = normalizeFeatures(outputs["features"]) if stage == "prediction" else inputFile
+                outputs.update(engines[REFERENCE](stageInput))
+            allOutputs[caseName] = outputs
+            if os.path.exists(goldenFile(caseName, goldenDir)):
+                golden = np.load(goldenFile(caseName, goldenDir))
+                for stage, names in STAGE_OUTPUTS.items():
+                    deviations = [maxDeviation(golden[name], outputs[name]) for name in names if name in golden]
+                    if len(deviations) > 0 and max(deviations) > STAGE_TOLERANCES[stage]:
+                        changed.append((caseName, stage, max(deviations)))
+
+        if len(changed) > 0 and not force:
+            for caseName, stage, deviation in changed:
+                print("%s: the %s stage of the reference deviates from the golden output by %g" % (caseName, stage, deviation))
+            print("The golden outputs were not written; use --force to replace them")
+            return False
+        os.makedirs(goldenDir, exist_ok=True)
+        for caseName in SYNTHETIC_CASES:
+            shutil.copyfile(os.path.join(syntheticDir, caseName + ".mid"), os.path.join(goldenDir, caseName + ".mid"))
+    for caseName, outputs in allOutputs.items():
+        np.savez(goldenFile(caseName, goldenDir), **outputs)
+    return True
+
+
+def normalizeFeatures(features):
+    return np.array([dataProcessing.normalize(feature) for feature in features])
+
+
+################################################################################################################################
+# Checking engines
+################################################################################################################################
+
+def maxDeviation(expected, actual):
+    expected = np.asarray(expected, dtype=float)
+    actual = np.asarray(actual, dtype=float)
+    if expected.shape != actual.shape:
+        return np.inf
+    if expected.size == 0:
+        return 0.0
+    return float(np.max(np.abs(expected - actual)))
+
+
+def timeEngine(engine, stageInput):
+    start = time.perf_counter()
+    outputs = engine(stageInput)
+    return outputs, time.perf_counter() - start
+
+
+# Check one engine of a stage against the golden outputs.  Returns one report per case: a dict with the case name,
+# the maximum deviation over the stage's outputs, the tolerance, whether it passed, both run times and the speedup.
+def checkEngine(stage, engineName, goldenDir=GOLDEN_DIR, tolerance=None):
+    if tolerance is None:
+        tolerance = STAGE_TOLERANCES[stage]
+    engine = ENGINES[stage][engineName]
+    reference = ENGINES[stage][REFERENCE]
+
+    reports = []
+    for caseName, inputFile in goldenCases(goldenDir):
+        golden = np.load(goldenFile(caseName, goldenDir))
+        stageInput = normalizeFeatures(golden["features"]) if stage == "prediction" else inputFile
+
+        outputs, engineTime = timeEngine(engine, stageInput)
+        referenceOutputs, referenceTime = timeEngine(reference, stageInput)
+        deviation = max(maxDeviation(golden[name], outputs[name]) for name in STAGE_OUTPUTS[stage])
+        # The reference itself has to reproduce the golden outputs, or the golden outputs are stale
+        referenceDeviation = max(maxDeviation(golden[name], referenceOutputs[name]) for name in STAGE_OUTPUTS[stage])
+        reports.append({"case": caseName,
+                        "maxDeviation": deviation,
+                        "referenceDeviation": referenceDeviation,
+                        "tolerance": tolerance,
+                        "passed": deviation <= tolerance,
+                        "engineTime": engineTime,
+                        "referenceTime": referenceTime,
+                        "speedup": referenceTime / engineTime if engineTime > 0 else np.inf})
+    return reports
+
+
+# Check a prediction engine on golden features with a NaN sample in every feature against the reference, run on the
+# same input (the reference zeroes the slope of every attentional window that contains a NaN, and only those).
+# Returns one report per case, like checkEngine.
+def checkNanSamples(engineName, goldenDir=GOLDEN_DIR, tolerance=None):
+    if tolerance is None:
+        tolerance = STAGE_TOLERANCES["prediction"]
+    engine = ENGINES["prediction"][engineName]
+    reference = ENGINES["prediction"][REFERENCE]
+
+    reports = []
+    for caseName, inputFile in goldenCases(goldenDir):
+        features = normalizeFeatures(np.load(goldenFile(caseName, goldenDir))["features"])
+        features[:, NAN_SAMPLE] = np.nan
+
+        outputs, engineTime = timeEngine(engine, features)
+        referenceOutputs, referenceTime = timeEngine(reference, features)
+        deviation = maxDeviation(referenceOutputs["prediction"], outputs["prediction"])
+        reports.append({"case": caseName + "+nan",
+                        "maxDeviation": deviation,
+                        "referenceDeviation": 0.0,
+                        "tolerance": tolerance,
+                        "passed": deviation <= tolerance,
+                        "engineTime": engineTime,
+                        "referenceTime": referenceTime,
+                        "speedup": referenceTime / engineTime if engineTime > 0 else np.inf})
+    return reports
+
+
+# Check every engine (other than the references) and print a report; returns True if all of them passed
+def checkAll(goldenDir=GOLDEN_DIR):
+    allPassed = True
+    print("%-14s %-12s %-16s %12s %10s %8s" % ("stage", "engine", "case", "max dev", "speedup", "result"))
+    for stage, engines in ENGINES.items():
+        for engineName in engines:
+            if engineName == REFERENCE:
+                continue
+            reports = checkEngine(stage, engineName, goldenDir)
+            if stage == "prediction" and engineName in NAN_ENGINES:
+                reports += checkNanSamples(engineName, goldenDir)
+            for report in reports:
+                allPassed = allPassed and report["passed"]
+                print("%-14s %-12s %-16s %12.3g %9.1fx %8s" % (stage, engineName, report["case"], report["maxDeviation"],
+                                                              report["speedup"], "ok" if report["passed"] else "FAILED"))
+                if report["referenceDeviation"] > 0:
+                    print("WARNING: the reference deviates from the golden output by %g" % report["referenceDeviation"])
+    return allPassed
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Check optimized engines against golden reference outputs")
+    parser.add_argument("--write-golden", action="store_true", help="regenerate the golden outputs from the reference engines")
+    parser.add_argument("--force", action="store_true", help="with --write-golden, replace golden outputs that changed")
+    args = parser.parse_args()
+    if args.write_golden:
+        raise SystemExit(0 if writeGolden(force=args.force) else 1)
+    else:
+        raise SystemExit(0 if checkAll() else 1)
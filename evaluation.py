@@ -0,0 +1,139 @@
+# Quantitative comparison of tension predictions with empirical tension data (e.g., mean continuous responses)
+#
+# All functions work on batches: predictions and targets are 2D matrices with one prediction/target pair per row
+# (a single vector is treated as a batch of one, and a single prediction is compared with every target row).
+# The lag convention is the same as in tensionModel.runModel: a positive lag means the target trails the prediction,
+# i.e. prediction[t - lag] is compared with target[t].
+#
+# Example usage:
+#   results = evaluation.evaluatePredictions(predictions, targets, SAMPLE_RATE, maxLag=3)
+#   print(results["bestLag"], results["r"], results["rmse"])
+
+import numpy as np
+
+# Arguments: predictions and targets are vectors or matrices with one series per row; all series must have the same length
+def prepareBatch(predictions, targets, normalize=True):
+    predictions = np.atleast_2d(np.asarray(predictions, dtype=float))
+    targets = np.atleast_2d(np.asarray(targets, dtype=float))
+    if predictions.shape[1] != targets.shape[1]:
+        raise ValueError('prediction length (%d) does not match target length (%d)' % (predictions.shape[1], targets.shape[1]))
+    predictions, targets = np.broadcast_arrays(predictions, targets)
+
+    if normalize:
+        predictions = zScores(predictions)
+        targets = zScores(targets)
+    return np.array(predictions), np.array(targets)
+
+
+# Z-scores of each row (rows with no variance become zeros, as in dataProcessing.normalize)
+def zScores(data):
+    stdev = np.std(data, axis=1, keepdims=True)
+    centred = data - np.mean(data, axis=1, keepdims=True)
+    return np.divide(centred, stdev, out=np.zeros_like(centred), where=stdev != 0)
+
+
+# Lags (in samples) between minLag and maxLag (in seconds)
+def getLagRange(minLag, maxLag, sampleRate, numPoints):
+    minLagSamples = int(round(minLag * sampleRate))
+    maxLagSamples = int(round(maxLag * sampleRate))
+    # leave at least 2 overlapping samples for the correlation
+    minLagSamples = max(minLagSamples, -(numPoints - 2))
+    maxLagSamples = min(maxLagSamples, numPoints - 2)
+    if maxLagSamples < minLagSamples:
+        raise ValueError('no valid lags between %g and %g seconds' % (minLag, maxLag))
+    return np.arange(minLagSamples, maxLagSamples + 1)
+
+
+# Sum of prediction[t - lag] * target[t] over the overlapping samples, for every row and lag, computed via FFT
+def crossProducts(predictions, targets, lags):
+    numPoints = predictions.shape[1]
+    fftLen = 1 << int(np.ceil(np.log2(2 * numPoints)))
+    spectrum = np.conj(np.fft.rfft(predictions, fftLen, axis=1)) * np.fft.rfft(targets, fftLen, axis=1)
+    crossCorrelation = np.fft.irfft(spectrum, fftLen, axis=1)
+    # negative lags wrap around to the end of the circular cross-correlation
+    return crossCorrelation[:, lags % fftLen]
+
+
+# Sums of x and x^2 over the overlapping samples of each row, for every lag.  For lag >= 0 the overlap of the
+# prediction is [0, N - lag) and that of the target is [lag, N); for negative lags it is the other way around.
+def overlapSums(data, lags, leading):
+    numPoints = data.shape[1]
+    zeros = np.zeros((data.shape[0], 1))
+    cumX = np.concatenate((zeros, np.cumsum(data, axis=1)), axis=1)
+    cumXX = np.concatenate((zeros, np.cumsum(data * data, axis=1)), axis=1)
+    if leading:
+        start = np.maximum(-lags, 0)
+        end = numPoints - np.maximum(lags, 0)
+    else:
+        start = np.maximum(lags, 0)
+        end = numPoints + np.minimum(lags, 0)
+    return cumX[:, end] - cumX[:, start], cumXX[:, end] - cumXX[:, start]
+
+
+# Pearson correlation and RMSE between predictions and targets for every lag in the range
+# Return value: lags (in samples), r (rows x lags), rmse (rows x lags)
+def lagCorrelations(predictions, targets, sampleRate, minLag=0, maxLag=5, normalize=True):
+    predictions, targets = prepareBatch(predictions, targets, normalize)
+    numPoints = predictions.shape[1]
+    lags = getLagRange(minLag, maxLag, sampleRate, numPoints)
+
+    overlap = (numPoints - np.abs(lags)).astype(float)
+    sumPQ = crossProducts(predictions, targets, lags)
+    sumP, sumPP = overlapSums(predictions, lags, leading=True)
+    sumQ, sumQQ = overlapSums(targets, lags, leading=False)
+
+    covariance = overlap * sumPQ - sumP * sumQ
+    variance = (overlap * sumPP - sumP * sumP) * (overlap * sumQQ - sumQ * sumQ)
+    # guard against tiny negative values from rounding
+    variance = np.maximum(variance, 0)
+    r = np.divide(covariance, np.sqrt(variance), out=np.zeros_like(covariance), where=variance > 0)
+    rmse = np.sqrt(np.maximum(sumPP + sumQQ - 2 * sumPQ, 0) / overlap)
+    return lags, r, rmse
+
+
+# Best lag and fit statistics for each prediction/target pair
+# Return value: dict of vectors (one value per row)
+#   bestLag: lag in seconds with the highest correlation (bestLagSamples: the same in samples)
+#   r, rmse: Pearson correlation and root-mean-square error at the best lag
+#   rZeroLag, rmseZeroLag: the same without any lag (if lag 0 is in the range, otherwise NaN)
+#   meanAbsError: mean absolute difference at the best lag
+#   trendAgreement: proportion of samples at the best lag where prediction and target move in the same direction
+def evaluatePredictions(predictions, targets, sampleRate, minLag=0, maxLag=5, normalize=True):
+    predictions, targets = prepareBatch(predictions, targets, normalize)
+    lags, r, rmse = lagCorrelations(predictions, targets, sampleRate, minLag, maxLag, normalize=False)
+    numRows, numPoints = predictions.shape
+    rows = np.arange(numRows)
+
+    best = np.argmax(r, axis=1)
+    bestLagSamples = lags[best]
+
+    zeroLag = np.flatnonzero(lags == 0)
+    if zeroLag.size > 0:
+        rZeroLag = r[:, zeroLag[0]]
+        rmseZeroLag = rmse[:, zeroLag[0]]
+    else:
+        rZeroLag = np.full(numRows, np.nan)
+        rmseZeroLag = np.full(numRows, np.nan)
+
+    # Align each pair at its best lag: target sample t is compared with prediction sample t - lag
+    t = np.arange(numPoints)
+    predictionIndex = t[np.newaxis, :] - bestLagSamples[:, np.newaxis]
+    valid = (predictionIndex >= 0) & (predictionIndex < numPoints)
+    aligned = predictions[rows[:, np.newaxis], np.clip(predictionIndex, 0, numPoints - 1)]
+    overlap = valid.sum(axis=1)
+
+    absError = np.where(valid, np.abs(aligned - targets), 0)
+    meanAbsError = absError.sum(axis=1) / overlap
+
+    bothValid = valid[:, 1:] & valid[:, :-1]
+    sameDirection = np.sign(np.diff(aligned, axis=1)) == np.sign(np.diff(targets, axis=1))
+    trendAgreement = np.where(bothValid, sameDirection, False).sum(axis=1) / np.maximum(bothValid.sum(axis=1), 1)
+
+    return {"bestLag": bestLagSamples / sampleRate,
+            "bestLagSamples": bestLagSamples,
+            "r": r[rows, best],
+            "rmse": rmse[rows, best],
+            "rZeroLag": rZeroLag,
+            "rmseZeroLag": rmseZeroLag,
+            "meanAbsError": meanAbsError,
+            "trendAgreement": trendAgreement}
@@ -3,6 +3,11 @@ import music21
 import numpy as np 
 import noteObj
 import tonalTension
+import tension_calculation as tc
+import lerdahlTension
+import voiceSeparation
+import localTempo
+import onsetDensity
 
 # Indices for each feature
 iOnsetFreq = 0
@@ -14,37 +19,74 @@ iDissonance = 5
 NUM_FEATURES = 6 # This can change in the future, but it's the max for now
 featureList = ["Onset freq", "Melodic contour", "Loudness", "Tempo", "Harmony", "Dissonance"]
 
+# Optional harmonic features from the spiral array pass of the Harmony feature (harmonicFeatures argument of extractFeaturesMidi)
+HARMONIC_SPREAD = "spread" # diameter of the notes of each window in the spiral array
+HARMONIC_MOTION = "motion" # distance between the centroids of consecutive windows
+harmonicFeatureNames = {HARMONIC_SPREAD: "Harmonic spread", HARMONIC_MOTION: "Harmonic motion"}
+
+# Optional features of all notes sounding at each time, held notes included (noteFeatures argument of extractFeaturesMidi)
+SOUNDING_DISSONANCE = "sounding dissonance" # dissonance of all pairs of sounding notes
+TEXTURE_DENSITY = "texture density" # number of sounding notes
+SUSTAINED_LOUDNESS = "sustained loudness" # loudest sounding velocity plus the others scaled down, as in the Loudness feature
+noteFeatureNames = {SOUNDING_DISSONANCE: "Sounding dissonance", TEXTURE_DENSITY: "Texture density", SUSTAINED_LOUDNESS: "Sustained loudness"}
+
+# Names of the features, including optional voice streams, harmonic features and note features
+def getFeatureList(voiceStreams=(), harmonicFeatures=(), noteFeatures=()):
+    return (featureList + [name.capitalize() + " voice" for name in voiceStreams] + [harmonicFeatureNames[name] for name in harmonicFeatures]
+            + [noteFeatureNames[name] for name in noteFeatures])
+
+HARMONY_WINDOW_SIZE = 2 # harmonic tension is calculated every 2 beats
+HARMONY_END_RATIO = 1 # the key is found using the whole piece
+
+# Models for the Harmony feature (harmonyModel argument of extractFeaturesMidi)
+HARMONY_SPIRAL_ARRAY = "spiral" # Chew's spiral array, via tonalTension
+HARMONY_LERDAHL = "lerdahl" # Lerdahl's tonal pitch space, via lerdahlTension
+HARMONY_CHORD = "chord" # spiral array distance of each window's triad from the key, via tension_calculation.SpiralArray
+
+# Models for the Onset freq feature (onsetModel argument of extractFeaturesMidi)
+ONSET_FREQUENCY = "frequency" # 1/(time since the previous onset)
+ONSET_DENSITY = "density" # onsets per second in a sliding window, via onsetDensity
+
 
 # Get the tension profile for music in MIDI file format
-def extractFeaturesMidi(inputFile, sampleRate=10, bOnsetFreq=True, bMelodicContour=True, bLoudness=True, bTempo=True, bHarmony=True, bDissonance=True):
+def extractFeaturesMidi(inputFile, sampleRate=10, bOnsetFreq=True, bMelodicContour=True, bLoudness=True, bTempo=True, bHarmony=True, bDissonance=True, harmonyModel=HARMONY_SPIRAL_ARRAY, voiceStreams=(), bLocalTempo=False, onsetModel=ONSET_FREQUENCY, harmonicFeatures=(), onsetWindowDur=onsetDensity.WINDOW_DUR, onsetKernel=onsetDensity.BOXCAR, noteFeatures=()):
+
+    featureEvents, totalSamples = extractFeatureEventsMidi(inputFile, sampleRate, bOnsetFreq, bMelodicContour, bLoudness, bTempo, bHarmony, bDissonance, harmonyModel, voiceStreams, bLocalTempo, onsetModel, harmonicFeatures, onsetWindowDur, onsetKernel, noteFeatures)
+    return rasterizeFeatureEvents(featureEvents, NUM_FEATURES + len(voiceStreams) + len(harmonicFeatures) + len(noteFeatures), sampleRate, totalSamples)
+
+
+# The feature matrix (numRows x totalSamples) of the feature events returned by extractFeatureEventsMidi
+def rasterizeFeatureEvents(featureEvents, numRows, sampleRate, totalSamples):
+    features = np.zeros((numRows,totalSamples))
+    for i, events in featureEvents.items():
+        features[i,:] = rasterizeEvents(*events, sampleRate, totalSamples)
+    if iMelodicContour in featureEvents:
+        fillLeadingZeros(features[iMelodicContour,:])
+
+    return features
+
+
+# The features of a MIDI file as step functions: a dict keyed by feature index with the events of each extracted feature
+# as (event times, event values, value before the first event); also returns the total number of samples
+# voiceStreams: optional names of voice streams (see voiceSeparation.voiceNames, e.g. ["top", "bass"]) whose contours
+# are added as extra features after the NUM_FEATURES standard ones, in the given order
+# bLocalTempo: if the file has no tempo map (at most one tempo), the Tempo feature is the local tempo estimated from the
+# note onsets (see localTempo.py) instead of a constant
+# onsetModel: ONSET_DENSITY replaces the onset frequency by the onset density (see onsetDensity.py), over a perceptual
+# window of onsetWindowDur seconds with onsetKernel (onsetDensity.BOXCAR or onsetDensity.EXPONENTIAL)
+# harmonicFeatures: optional names of harmonic features (HARMONIC_SPREAD, HARMONIC_MOTION) added after the voice streams,
+# in the given order
+# noteFeatures: optional names of features of the sounding notes (SOUNDING_DISSONANCE, TEXTURE_DENSITY, SUSTAINED_LOUDNESS)
+# added after the harmonic features, in the given order; they change at every note start and end
+def extractFeatureEventsMidi(inputFile, sampleRate=10, bOnsetFreq=True, bMelodicContour=True, bLoudness=True, bTempo=True, bHarmony=True, bDissonance=True, harmonyModel=HARMONY_SPIRAL_ARRAY, voiceStreams=(), bLocalTempo=False, onsetModel=ONSET_FREQUENCY, harmonicFeatures=(), onsetWindowDur=onsetDensity.WINDOW_DUR, onsetKernel=onsetDensity.BOXCAR, noteFeatures=()):
     
-    # Read MIDI file
-    # TO-DO: THIS NEEDS TO BE RECONSIDERED - quantization is not the solution to perceptual issues
-    #score = music21.converter.parse(inputFile, forceSource=True, quantizePost=False)
-    score = music21.converter.parse(inputFile, quarterLengthDivisors=[256]) 
-    flatScore = score.flatten()
+    onsetsAll, tempoChanges, totalDuration = readMidi(inputFile)
+    return extractFeatureEventsFromNotes(inputFile, onsetsAll, tempoChanges, totalDuration, sampleRate, bOnsetFreq, bMelodicContour, bLoudness, bTempo, bHarmony, bDissonance, harmonyModel, voiceStreams, bLocalTempo, onsetModel, harmonicFeatures, onsetWindowDur, onsetKernel, noteFeatures)
 
-    onsetsAll = {} # Dictionary of all notes (as the form of noteObjs) keyed by onset time
-    tempoChanges = {0 : [0, 120]} # Initalized to default MIDI tempo value 
 
-    # Go through the entire score. Get all the notes and their respective onset times, durations, pitches, and MIDI velocity values;
-    # and get tempo changes
-    prevPitch = 0
-    for ele in flatScore.secondsMap:
-        element = ele['element']
-        offsetSeconds = ele['offsetSeconds']
-        if isinstance(element, music21.note.Note) or isinstance(element, music21.chord.Chord):
-            if offsetSeconds in onsetsAll.keys():
-                # NoteObj contains onset, pitch, endTime, velocity
-                onsetsAll[offsetSeconds].extend(noteObj.returnNotes(offsetSeconds, element))
-            else:
-                onsetsAll[offsetSeconds] = noteObj.returnNotes(offsetSeconds, element)
-            #for note in onsetsAll[offsetSeconds]:
-            #    note.print()
-            #print("-----")
-        # Get tempo change messages
-        elif isinstance(element, music21.tempo.MetronomeMark):
-            tempoChanges[offsetSeconds] = [offsetSeconds, element.number]
+# The same as extractFeatureEventsMidi, given the notes, tempo changes and duration read from inputFile by readMidi (the
+# harmonic analysis still reads inputFile itself)
+def extractFeatureEventsFromNotes(inputFile, onsetsAll, tempoChanges, totalDuration, sampleRate=10, bOnsetFreq=True, bMelodicContour=True, bLoudness=True, bTempo=True, bHarmony=True, bDissonance=True, harmonyModel=HARMONY_SPIRAL_ARRAY, voiceStreams=(), bLocalTempo=False, onsetModel=ONSET_FREQUENCY, harmonicFeatures=(), onsetWindowDur=onsetDensity.WINDOW_DUR, onsetKernel=onsetDensity.BOXCAR, noteFeatures=()):
 
     ################################################################################################################################
     ################################################################################################################################
@@ -52,14 +94,8 @@ def extractFeaturesMidi(inputFile, sampleRate=10, bOnsetFreq=True, bMelodicConto
     ################################################################################################################################
     ################################################################################################################################
     
-    # Sometimes music21 has a NAN value for this (sigh)
-    totalDuration = flatScore.seconds
-    if np.isnan(totalDuration):
-        lastNote = flatScore.secondsMap[-1]
-        totalDuration = lastNote["endTimeSeconds"]
-
     totalSamples = int(totalDuration * sampleRate)
-    features = np.zeros((NUM_FEATURES,totalSamples))
+    featureEvents = {}
 
     #print("Total dur: ", "{:.2f}".format(totalDuration), "sec; Total samples: ", totalSamples)
 
@@ -67,30 +103,13 @@ def extractFeaturesMidi(inputFile, sampleRate=10, bOnsetFreq=True, bMelodicConto
     # Onset frequency
     ################################################################################################################################
 
-    # Create onset frequency graph at the given sample rate
-    if bOnsetFreq:
-        onsetTimes = np.array([])
-        for onset, noteList in onsetsAll.items():
-            onsetTimes = np.append(onsetTimes, onset)
-
-        onsetFreq = np.diff(onsetTimes)
-        onsetFreq = 1/onsetFreq
-        onsetFreq = np.concatenate([[0], onsetFreq])  
-
-        numOnsets = len(onsetTimes)
-        sampleIndex = 0
-        for j in range(1,numOnsets): # start at the second onset val because the values will be filled in with the previous onset val
-            currSampleTime = int(sampleIndex/sampleRate * 100000)  
-            nextOnsetTime = int(onsetTimes[j] * 100000)
-            while currSampleTime < nextOnsetTime:
-                features[iOnsetFreq,sampleIndex] = onsetFreq[j-1]                       
-                sampleIndex = sampleIndex + 1
-                currSampleTime = int(sampleIndex/sampleRate * 100000)
-
-        while sampleIndex <= totalSamples - 1:
-            features[iOnsetFreq,sampleIndex] = onsetFreq[numOnsets-1]
-            sampleIndex = sampleIndex + 1
-
+    # Create onset frequency graph at the given sample rate; or, with onsetModel = ONSET_DENSITY, the number of onsets per
+    # second in a sliding window (smooth where onsets are very close together)
+    if bOnsetFreq and onsetModel == ONSET_DENSITY:
+        featureEvents[iOnsetFreq] = onsetDensity.getOnsetDensityEvents(list(onsetsAll.keys()), sampleRate, totalSamples, onsetWindowDur,
+                                                                   onsetKernel)
+    elif bOnsetFreq:
+        featureEvents[iOnsetFreq] = getOnsetFreqEvents(onsetsAll)
     
     ################################################################################################################################
     # Melodic contour: 
@@ -101,36 +120,7 @@ def extractFeaturesMidi(inputFile, sampleRate=10, bOnsetFreq=True, bMelodicConto
 
     # Extract a melodic contour
     if bMelodicContour:
-        highestPitches = noteObj.getMelodicLine(onsetsAll)
-
-        numNotesInMelodyLine = len(highestPitches)
-        sampleIndex = 0
-        prevVal = 0
-        for key, val in highestPitches.items():
-            currSampleTime = int(sampleIndex/sampleRate * 100000)  
-            nextNoteTime = int(key * 100000)
-            while currSampleTime < nextNoteTime:
-                features[iMelodicContour,sampleIndex] = prevVal                       
-                sampleIndex = sampleIndex + 1
-                currSampleTime = int(sampleIndex/sampleRate * 100000)
-            prevVal = val    
-
-        while sampleIndex <= totalSamples - 1:
-            features[iMelodicContour,sampleIndex] = val
-            sampleIndex = sampleIndex + 1
-
-        # If there are zeros at the beginning of the melodic contour vector, make them the same value as the first non-zero MIDI value
-        currIndex = 0
-        currMidiPitch = features[iMelodicContour,currIndex]
-        while currIndex < totalSamples - 1 and currMidiPitch == 0:
-            currIndex += 1
-            currMidiPitch = features[iMelodicContour,currIndex]
-
-        # If the whole vector isn't zero (should never be the case, but error checking here)
-        if currIndex != totalSamples - 1:
-            for i in range(0,currIndex):
-                features[iMelodicContour, i] = currMidiPitch
- 
+        featureEvents[iMelodicContour] = getMelodicContourEvents(onsetsAll)
     
     ################################################################################################################################
     # Loudness:
@@ -139,48 +129,19 @@ def extractFeaturesMidi(inputFile, sampleRate=10, bOnsetFreq=True, bMelodicConto
     ################################################################################################################################
 
     if bLoudness:
-        loudness = noteObj.getLoudness(onsetsAll)
-
-        numLoudnessVals = len(loudness)
-        sampleIndex = 0
-        prevVal = 0
-        for key, val in loudness.items():
-            currSampleTime = int(sampleIndex/sampleRate * 100000)  
-            nextVal = int(key * 100000)
-            while currSampleTime < nextVal:
-                features[iLoudness,sampleIndex] = prevVal                       
-                sampleIndex = sampleIndex + 1
-                currSampleTime = int(sampleIndex/sampleRate * 100000)
-            prevVal = val    
-
-        while sampleIndex <= totalSamples - 1:
-            features[iLoudness,sampleIndex] = val
-            sampleIndex = sampleIndex + 1   
-
+        featureEvents[iLoudness] = dictToEvents(noteObj.getLoudness(onsetsAll))
 
     ################################################################################################################################
     # Tempo:
     # Tempo changes are determined by MIDI tempo messages.  If the MIDI file is screwy, the tempo changes might not make
-    # much sense.
-    ################################################################################################################################
-
-    if bTempo:
-        numTempoChanges = len(tempoChanges)
-        sampleIndex = 0
-        prevVal = 0
-        for key, val in tempoChanges.items():
-            currSampleTime = int(sampleIndex/sampleRate * 100000)  
-            nextTempoTime = int(val[0] * 100000)
-            while currSampleTime < nextTempoTime:
-                features[iTempo,sampleIndex] = prevVal                       
-                sampleIndex = sampleIndex + 1
-                currSampleTime = int(sampleIndex/sampleRate * 100000)
-            prevVal = val[1]    
-
-        while sampleIndex <= totalSamples - 1:
-            features[iTempo,sampleIndex] = val[1]
-            sampleIndex = sampleIndex + 1
+    # much sense.  Optionally (bLocalTempo), files without a tempo map (e.g. recorded performances) get a continuous local
+    # tempo estimated from the inter-onset intervals instead; see localTempo.py
+    ################################################################################################################################
 
+    if bTempo and bLocalTempo and not localTempo.hasTempoMap(tempoChanges):
+        featureEvents[iTempo] = localTempo.getLocalTempoEvents(list(onsetsAll.keys()), sampleRate, totalSamples)
+    elif bTempo:
+        featureEvents[iTempo] = getTempoEvents(tempoChanges)
     
     ################################################################################################################################
     # Harmonic tension:
@@ -190,55 +151,178 @@ def extractFeaturesMidi(inputFile, sampleRate=10, bOnsetFreq=True, bMelodicConto
     # Guo R, Simpson I, Magnusson T, Kiefer C., Herremans D. 2020. A variational autoencoder for music generation 
     # controlled by tonal tension. Joint Conference on AI Music Creativity (CSMC + MuMe).
     #
-    # Ideally, a version of Lerdahl's (2001) tonal tension model should be another option. 
+    # Alternatively (harmonyModel = HARMONY_LERDAHL), harmonic tension is based on Lerdahl's (2001) tonal pitch space;
+    # see lerdahlTension.py
+    # or (harmonyModel = HARMONY_CHORD) it is the spiral array distance between the triad recognized in each window and the
+    # key; see tension_calculation.AnalysisContext.cal_chords
     ################################################################################################################################
 
-    if bHarmony:
+    spiralComponents = None # (diameters, centroid differences, window times) of the spiral array pass
+    if bHarmony and harmonyModel == HARMONY_LERDAHL:
+        harmonicTension, times = lerdahlTension.analyzeLerdahlTension(inputFile, HARMONY_WINDOW_SIZE)
+        featureEvents[iHarmony] = getHarmonyEvents(harmonicTension, times)
+    elif bHarmony and harmonyModel == HARMONY_CHORD:
+        result = tc.AnalysisContext(window_size=HARMONY_WINDOW_SIZE, end_ratio=HARMONY_END_RATIO).analyze_file(inputFile)
+        featureEvents[iHarmony] = getHarmonyEvents(result.chord_key_distance, result.times)
+        spiralComponents = result.diameters, result.centroid_diff, result.times
+    elif bHarmony:
         outputDir = "output" # if empty, no data files are saved
-        windowSize = 2  # 1 = every beat; 2 = every 2 beats; -1 = every downbeat
-        endRatio = 1
+        windowSize = HARMONY_WINDOW_SIZE  # 1 = every beat; 2 = every 2 beats; -1 = every downbeat
+        endRatio = HARMONY_END_RATIO
         keyChanged=False
         keyName=''
         
-        harmonicTension, times = tonalTension.analyzeTonalTension(inputFile, outputDir, windowSize, endRatio, keyChanged, keyName)
+        harmonicTension, diameters, centroidDiff, times = tonalTension.analyzeTonalTensionComponents(inputFile, outputDir, windowSize, endRatio, keyChanged, keyName)
+        featureEvents[iHarmony] = getHarmonyEvents(harmonicTension, times)
+        spiralComponents = diameters, centroidDiff, times
 
-        numPoints = len(harmonicTension)
-        sampleIndex = 0
-        for j in range(1,numPoints): 
-            currSampleTime = int(sampleIndex/sampleRate * 100000)  
-            nextVal = int(times[j] * 100000)
-            while currSampleTime < nextVal:
-                features[iHarmony,sampleIndex] = harmonicTension[j-1]                       
-                sampleIndex = sampleIndex + 1
-                currSampleTime = int(sampleIndex/sampleRate * 100000)
-
-        while sampleIndex <= totalSamples - 1:
-            features[iHarmony,sampleIndex] = harmonicTension[numPoints-1]
-            sampleIndex = sampleIndex + 1
+    ################################################################################################################################
+    # Harmonic spread and motion (optional):
+    # The diameter of each window's notes and the distance between consecutive window centroids in the spiral array,
+    # which the Harmony feature's spiral array pass computes anyway.  The pass only runs for them alone if the Harmony
+    # feature doesn't use the spiral array (HARMONY_LERDAHL) or isn't extracted.
+    ################################################################################################################################
 
+    if len(harmonicFeatures) > 0:
+        if spiralComponents is None:
+            result = tc.AnalysisContext(window_size=HARMONY_WINDOW_SIZE, end_ratio=HARMONY_END_RATIO).analyze_file(inputFile)
+            spiralComponents = result.diameters, result.centroid_diff, result.times
+        diameters, centroidDiff, times = spiralComponents
+        for j, name in enumerate(harmonicFeatures):
+            if name == HARMONIC_SPREAD:
+                featureEvents[NUM_FEATURES + len(voiceStreams) + j] = getHarmonyEvents(diameters, times)
+            elif name == HARMONIC_MOTION:
+                featureEvents[NUM_FEATURES + len(voiceStreams) + j] = getHarmonyEvents(centroidDiff, times)
+            else:
+                raise ValueError('unknown harmonic feature %s' % name)
 
     ################################################################################################################################
     # Dissonance
     ################################################################################################################################
 
     if bDissonance:
-        dissonanceVals = noteObj.getDissonance(onsetsAll)
+        featureEvents[iDissonance] = dictToEvents(noteObj.getDissonance(onsetsAll))
 
-        sampleIndex = 0
-        prevVal = 0
-        for key, val in dissonanceVals.items():
-            currSampleTime = int(sampleIndex/sampleRate * 100000)  
-            nextOnsetTime = int(key * 100000)
+    ################################################################################################################################
+    # Voice streams (optional):
+    # Contours of the top, inner and bass voices from a sweep over all note starts and ends; see voiceSeparation.py
+    ################################################################################################################################
 
-            while currSampleTime < nextOnsetTime:
-                features[iDissonance,sampleIndex] = prevVal                       
-                sampleIndex = sampleIndex + 1
-                currSampleTime = int(sampleIndex/sampleRate * 100000)
-            prevVal = val
+    if len(voiceStreams) > 0:
+        streams = voiceSeparation.separateVoices(*voiceSeparation.notesFromOnsets(onsetsAll), voiceSeparation.numInnerVoices(voiceStreams))
+        for j, name in enumerate(voiceStreams):
+            featureEvents[NUM_FEATURES + j] = streams[name]
 
-        while sampleIndex <= totalSamples - 1:
-            features[iDissonance,sampleIndex] = val
-            sampleIndex = sampleIndex + 1
+    ################################################################################################################################
+    # Note features (optional):
+    # Dissonance, number and loudness of all notes sounding at each time, including notes held from earlier onsets,
+    # which the Dissonance and Loudness features ignore; see noteObj.NoteIndex
+    ################################################################################################################################
 
-    return features
+    if len(noteFeatures) > 0:
+        index = noteObj.buildNoteIndex(onsetsAll)
+        states = {SOUNDING_DISSONANCE: index.dissonanceAfter, TEXTURE_DENSITY: index.countAfter, SUSTAINED_LOUDNESS: index.loudnessAfter}
+        for j, name in enumerate(noteFeatures):
+            if name not in states:
+                raise ValueError('unknown note feature %s' % name)
+            featureEvents[NUM_FEATURES + len(voiceStreams) + len(harmonicFeatures) + j] = index.stateEvents(states[name])
+
+    return featureEvents, totalSamples
+
+
+# Read a MIDI file into a dictionary of all notes (as lists of noteObjs) keyed by onset time in seconds and a dictionary
+# of tempo changes keyed by time in seconds; also returns the total duration in seconds
+# inputFile can also be a tension_calculation.MidiMember (e.g. from midiArchive), which is parsed from its bytes
+def readMidi(inputFile):
+
+    # Read MIDI file
+    # TO-DO: THIS NEEDS TO BE RECONSIDERED - quantization is not the solution to perceptual issues
+    #score = music21.converter.parse(inputFile, forceSource=True, quantizePost=False)
+    if isinstance(inputFile, tc.MidiMember):
+        score = music21.converter.parseData(inputFile.data, format='midi', quarterLengthDivisors=[256])
+    else:
+        score = music21.converter.parse(inputFile, quarterLengthDivisors=[256]) 
+    flatScore = score.flatten()
+
+    onsetsAll = {} # Dictionary of all notes (as the form of noteObjs) keyed by onset time
+    tempoChanges = {0 : [0, 120]} # Initalized to default MIDI tempo value 
+
+    # Go through the entire score. Get all the notes and their respective onset times, durations, pitches, and MIDI velocity values;
+    # and get tempo changes
+    for ele in flatScore.secondsMap:
+        element = ele['element']
+        offsetSeconds = ele['offsetSeconds']
+        if isinstance(element, music21.note.Note) or isinstance(element, music21.chord.Chord):
+            if offsetSeconds in onsetsAll.keys():
+                # NoteObj contains onset, pitch, endTime, velocity
+                onsetsAll[offsetSeconds].extend(noteObj.returnNotes(offsetSeconds, element))
+            else:
+                onsetsAll[offsetSeconds] = noteObj.returnNotes(offsetSeconds, element)
+            #for note in onsetsAll[offsetSeconds]:
+            #    note.print()
+            #print("-----")
+        # Get tempo change messages
+        elif isinstance(element, music21.tempo.MetronomeMark):
+            tempoChanges[offsetSeconds] = [offsetSeconds, element.number]
+
+    # Sometimes music21 has a NAN value for this (sigh)
+    totalDuration = flatScore.seconds
+    if np.isnan(totalDuration):
+        lastNote = flatScore.secondsMap[-1]
+        totalDuration = lastNote["endTimeSeconds"]
 
+    return onsetsAll, tempoChanges, totalDuration
+
+
+################################################################################################################################
+# Each feature is a step function: it holds a value from one event (onset, tempo change, harmonic window) until the next.
+# The functions below return the events of each feature as (event times, event values, value before the first event).
+################################################################################################################################
+
+def dictToEvents(valsByTime, initVal=0):
+    return np.array(list(valsByTime.keys()), dtype=float), np.array(list(valsByTime.values()), dtype=float), initVal
+
+def getOnsetFreqEvents(onsetsAll):
+    onsetTimes = np.array(list(onsetsAll.keys()), dtype=float)
+    onsetFreq = np.diff(onsetTimes)
+    onsetFreq = 1/onsetFreq
+    onsetFreq = np.concatenate([[0], onsetFreq])
+    # The first onset has no onset frequency, so the value before the second onset is 0
+    return onsetTimes[1:], onsetFreq[1:], onsetFreq[0]
+
+def getMelodicContourEvents(onsetsAll):
+    return dictToEvents(noteObj.getMelodicLine(onsetsAll))
+
+def getTempoEvents(tempoChanges):
+    times = np.array([val[0] for val in tempoChanges.values()], dtype=float)
+    tempos = np.array([val[1] for val in tempoChanges.values()], dtype=float)
+    return times, tempos, 0
+
+# No events (and 0) if there are no harmonic windows, e.g. for a piece shorter than one window
+def getHarmonyEvents(harmonicTension, times):
+    harmonicTension = np.asarray(harmonicTension, dtype=float)
+    numPoints = len(harmonicTension)
+    if numPoints == 0:
+        return np.zeros(0), np.zeros(0), 0
+    return np.asarray(times[1:numPoints], dtype=float), harmonicTension[1:], harmonicTension[0]
+
+
+# Sample a step function given by its events at the given sample rate.  Event and sample times are compared at a
+# resolution of 10 microseconds.  startSample and endSample optionally select a range of the samples.
+def rasterizeEvents(eventTimes, eventValues, initVal, sampleRate, totalSamples, startSample=0, endSample=None):
+    if endSample is None:
+        endSample = totalSamples
+    sampleTimes = (np.arange(startSample, endSample)/sampleRate * 100000).astype(int)
+    eventTimes = (np.asarray(eventTimes, dtype=float) * 100000).astype(int)
+    eventValues = np.concatenate([[initVal], np.asarray(eventValues, dtype=float)])
+    # index of the last event at or before each sample time (0 is the value before the first event)
+    return eventValues[np.searchsorted(eventTimes, sampleTimes, side='right')]
+
+
+# If there are zeros at the beginning of the melodic contour vector, make them the same value as the first non-zero MIDI value
+def fillLeadingZeros(contour):
+    # If the whole vector is zero (should never be the case, but error checking here), leave it
+    nonZero = np.flatnonzero(contour[:-1] != 0)
+    if nonZero.size > 0:
+        contour[0:nonZero[0]] = contour[nonZero[0]]
+    return contour
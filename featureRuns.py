@@ -0,0 +1,159 @@
+# Change-point (run-length) representation of features
+#
+# Every feature extracted from MIDI is a step function: it holds a value from one event (onset, tempo change,
+# harmonic window) until the next.  Instead of expanding it to one value per sample, a FeatureRuns keeps the sample
+# index where each run of equal values starts and the value of the run.  The sums the model's regressions need (of
+# the values and of sample index * value over any range of samples) are computed analytically from running sums over
+# the runs, so the window slopes cost O(runs + windows) instead of O(samples).  The number of attentional windows only
+# depends on the duration and the window shift, so this matters most for sparse pieces at high sample rates.
+#
+# The runs are sampled exactly like featureAnalysis.rasterizeEvents, so runModelRuns gives the same prediction as
+# normalizing the dense features and calling tensionModel.runModel (up to floating point rounding).
+#
+# Example usage:
+#   featureRuns, totalSamples = featureRuns.extractFeatureRunsMidi("midi/Brahms.mid", 1000, bDissonance=False)
+#   prediction = featureRuns.runModelRuns(featureRuns, [2, 3, 3, 2, 1, 1], 3, 1000, 3, .25, 5, 1, 1, sliderOnset=True)
+
+import numpy as np
+import featureAnalysis as analysis
+import onsetDensity
+import tensionModel
+
+
+class FeatureRuns:
+    # starts: sample index where each run starts (sorted, the first is 0); values: the value of each run
+    def __init__(self, starts, values, numPoints):
+        self.starts = np.asarray(starts, dtype=int)
+        self.values = np.asarray(values, dtype=float)
+        self.numPoints = numPoints
+
+        ends = np.append(self.starts[1:], numPoints)
+        self.lengths = ends - self.starts
+        # Running sums of the values and of sample index * values at the start of each run (plus the total at the end)
+        zero = np.zeros(1)
+        self.cumY = np.concatenate((zero, np.cumsum(self.values * self.lengths)))
+        self.cumKY = np.concatenate((zero, np.cumsum(self.values * (self.starts + ends - 1) * self.lengths / 2)))
+
+    def numRuns(self):
+        return len(self.starts)
+
+    def toDense(self):
+        return np.repeat(self.values, self.lengths)
+
+    # Sums of the values and of sample index * value over the samples [0, position) for each position
+    def prefixSums(self, positions):
+        positions = np.asarray(positions, dtype=int)
+        run = np.maximum(np.searchsorted(self.starts, positions - 1, side='right') - 1, 0)
+        partial = np.maximum(positions - self.starts[run], 0)
+        cumY = self.cumY[run] + self.values[run] * partial
+        cumKY = self.cumKY[run] + self.values[run] * (2 * self.starts[run] + partial - 1) * partial / 2
+        return cumY, cumKY
+
+    def mean(self):
+        if self.numPoints == 0:
+            return 0
+        return self.cumY[-1] / self.numPoints
+
+    def std(self):
+        if self.numPoints == 0:
+            return 0
+        return np.sqrt(np.sum(self.lengths * (self.values - self.mean())**2) / self.numPoints)
+
+    # Z-scores (all zeros if there's no variance), as dataProcessing.normalize
+    def normalized(self):
+        stdev = self.std()
+        if stdev != 0:
+            return FeatureRuns(self.starts, (self.values - self.mean()) / stdev, self.numPoints)
+        return FeatureRuns([0], [0], self.numPoints)
+
+
+# Runs of a step function given by its events (see featureAnalysis.rasterizeEvents, which samples them densely)
+def runsFromEvents(eventTimes, eventValues, initVal, sampleRate, totalSamples):
+    eventTimes = (np.asarray(eventTimes, dtype=float) * 100000).astype(int)
+    eventValues = np.asarray(eventValues, dtype=float)
+
+    # An event takes effect at the first sample whose time (at 10 microsecond resolution) is at or after it
+    def sampleTime(k):
+        return (k/sampleRate * 100000).astype(int)
+    starts = np.maximum(np.ceil(eventTimes * sampleRate / 100000).astype(int) - 1, 0)
+    late = sampleTime(starts) < eventTimes
+    while late.any():
+        starts[late] += 1
+        late = sampleTime(starts) < eventTimes
+
+    starts = np.concatenate(([0], starts))
+    values = np.concatenate(([initVal], eventValues))
+    inRange = starts < totalSamples
+    starts = starts[inRange]
+    values = values[inRange]
+    # Of several events at the same sample, the last one holds
+    last = np.append(starts[1:] != starts[:-1], True)
+    return FeatureRuns(starts[last], values[last], totalSamples)
+
+
+# Runs of a dense feature vector
+def runsFromDense(data):
+    data = np.asarray(data, dtype=float)
+    if data.size == 0:
+        return FeatureRuns(np.zeros(0, dtype=int), np.zeros(0), 0)
+    starts = np.concatenate(([0], np.flatnonzero(np.diff(data)) + 1))
+    return FeatureRuns(starts, data[starts], len(data))
+
+
+# As featureAnalysis.fillLeadingZeros: leading zeros take the first non-zero value (judged on all but the last sample)
+def fillLeadingZerosRuns(runs):
+    nonZero = np.flatnonzero((runs.values != 0) & (runs.starts < runs.numPoints - 1))
+    if nonZero.size == 0 or nonZero[0] == 0:
+        return runs
+    first = nonZero[0]
+    return FeatureRuns(np.concatenate(([0], runs.starts[first:])), np.concatenate(([runs.values[first]], runs.values[first:])), runs.numPoints)
+
+
+# The features of a MIDI file as a list of FeatureRuns (one per feature, in featureAnalysis order including any voice
+# streams and harmonic features; features that aren't extracted are all zeros), and the total number of samples
+def extractFeatureRunsMidi(inputFile, sampleRate=10, bOnsetFreq=True, bMelodicContour=True, bLoudness=True, bTempo=True, bHarmony=True, bDissonance=True, harmonyModel=analysis.HARMONY_SPIRAL_ARRAY, voiceStreams=(), bLocalTempo=False, onsetModel=analysis.ONSET_FREQUENCY, harmonicFeatures=(), onsetWindowDur=onsetDensity.WINDOW_DUR, onsetKernel=onsetDensity.BOXCAR, noteFeatures=()):
+    featureEvents, totalSamples = analysis.extractFeatureEventsMidi(inputFile, sampleRate, bOnsetFreq, bMelodicContour, bLoudness, bTempo, bHarmony, bDissonance, harmonyModel, voiceStreams, bLocalTempo, onsetModel, harmonicFeatures, onsetWindowDur, onsetKernel, noteFeatures)
+    featureRuns = []
+    for i in range(analysis.NUM_FEATURES + len(voiceStreams) + len(harmonicFeatures) + len(noteFeatures)):
+        if i in featureEvents:
+            featureRuns.append(runsFromEvents(*featureEvents[i], sampleRate, totalSamples))
+        else:
+            featureRuns.append(FeatureRuns([0], [0], totalSamples))
+    if analysis.iMelodicContour in featureEvents:
+        featureRuns[analysis.iMelodicContour] = fillLeadingZerosRuns(featureRuns[analysis.iMelodicContour])
+    return featureRuns, totalSamples
+
+
+# tensionModel.SlopeTensor of the features given as runs (all features must have the same number of samples)
+def computeSlopeTensorFromRuns(featureRuns, sampleRate, attentionalWindowDur, windowShift):
+    numPoints = featureRuns[0].numPoints
+    windowIndices, startpts, endpts = tensionModel.getWindowGeometry(numPoints, sampleRate, attentionalWindowDur, windowShift)
+
+    slopes = np.zeros((len(featureRuns), len(startpts)))
+    for i, runs in enumerate(featureRuns):
+        if runs.numPoints != numPoints:
+            raise ValueError('feature %d has %d samples instead of %d' % (i, runs.numPoints, numPoints))
+        # As in tensionModel.computeSlopeTensor, centre the feature first to keep the sums small
+        centred = FeatureRuns(runs.starts, runs.values - runs.mean(), numPoints)
+        startY, startKY = centred.prefixSums(startpts)
+        endY, endKY = centred.prefixSums(endpts + 1)
+        slopes[i] = tensionModel.slopesFromSums(endY - startY, endKY - startKY, startpts, endpts)
+
+    if np.isnan(slopes).any():
+        slopes[np.isnan(slopes)] = 0
+        print("WARNING: NAN in data!!")
+
+    return tensionModel.SlopeTensor(slopes, windowIndices, startpts, endpts, numPoints, sampleRate)
+
+
+# The tension prediction for features given as runs; the features are normalized first unless normalize is False
+def runModelRuns(featureRuns, featureWeights, memoryWindowDur, sampleRate, attentionalWindowDur, windowShift, memoryWeight,
+                 initSlope, lag, sliderOnset=False, normalize=True, memoryHalfLife=None):
+    if len(featureWeights) != len(featureRuns):
+        print('ERROR: featureWeights length does not match number of feature graphs\n')
+        return []
+    if normalize:
+        featureRuns = [runs.normalized() for runs in featureRuns]
+    slopeTensor = computeSlopeTensorFromRuns(featureRuns, sampleRate, attentionalWindowDur, windowShift)
+    return tensionModel.runModelFromSlopes(slopeTensor, featureWeights, memoryWindowDur, memoryWeight, initSlope, lag, sliderOnset,
+                                           memoryHalfLife)
@@ -0,0 +1,163 @@
+# Feature store for running the tension model over many pieces in multiple processes
+#
+# Packs the feature matrices of many pieces into a single block of memory - either a memory-mapped file on disk
+# or a multiprocessing.shared_memory block - together with an offset index keyed by piece id.  Worker processes
+# attach to the block once and get zero-copy, read-only NumPy views of each piece's features, so the work
+# descriptors sent to the workers only need to carry piece ids and model parameters.
+#
+# Example usage:
+#   store = featureStore.createFeatureStore({"brahms": brahmsFeatures, "morgengruss": morgengrussFeatures})
+#   tasks = [featureStore.ModelTask("brahms", {"featureWeights": [2, 3, 3, 2, 1, 1], ...}), ...]
+#   predictions = featureStore.runModelTasks(store, tasks, numWorkers=4)
+#   store.close()
+# or, closing the store at the end of the block:
+#   with featureStore.createFeatureStore(featureDict) as store:
+#       predictions = featureStore.runModelTasks(store, tasks, numWorkers=4)
+
+import json
+import os
+import weakref
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+import tensionModel
+
+FEATURE_DTYPE = np.float64
+INDEX_SUFFIX = ".index.json"
+
+class FeatureStore:
+    # index: dict keyed by piece id; each item is [offset (in elements), numFeatures, numPoints]
+    # buffer: the memory block holding all of the packed feature matrices
+    def __init__(self, index, buffer, path=None, sharedMemory=None, owner=False):
+        self.index = index
+        self.path = path
+        self.sharedMemory = sharedMemory
+        self.owner = owner
+        if sharedMemory is not None:
+            self.data = np.frombuffer(buffer, dtype=FEATURE_DTYPE)
+            # The views from get() keep the mapping open (it can't be closed while they exist), so it is closed when
+            # the memoryview under self.data and all the views is released, whether that is in close() or later
+            closer = weakref.finalize(self.data.base, sharedMemory.close)
+            closer.atexit = False
+        else:
+            self.data = buffer
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, excType, excValue, traceback):
+        self.close()
+
+    def pieceIds(self):
+        return list(self.index.keys())
+
+    # Return a zero-copy, read-only view of the feature matrix (numFeatures x numPoints) for the given piece
+    def get(self, pieceId):
+        offset, numFeatures, numPoints = self.index[str(pieceId)]
+        view = self.data[offset:offset + numFeatures * numPoints].reshape(numFeatures, numPoints)
+        view.flags.writeable = False
+        return view
+
+    # A small picklable description of where the store lives, so that worker processes can attach to it
+    def reference(self):
+        if self.sharedMemory is not None:
+            return {"sharedMemory": self.sharedMemory.name, "index": self.index}
+        return {"path": self.path}
+
+    # Release the store.  A shared memory block is unlinked (by the store that created it) right away; its mapping is
+    # closed once no view returned by get() is left, so views that are still in use stay valid until they are dropped.
+    def close(self):
+        self.data = None
+        if self.sharedMemory is not None:
+            if self.owner:
+                self.sharedMemory.unlink()
+            self.sharedMemory = None
+
+
+# Pack the feature matrices in featureDict (keyed by piece id) into one block.  If path is given, the block is
+# written to a memory-mapped file (plus a JSON offset index next to it); otherwise a shared memory block is created.
+def createFeatureStore(featureDict, path=None):
+    index = {}
+    totalSize = 0
+    for pieceId, features in featureDict.items():
+        features = np.asarray(features)
+        if features.ndim != 2:
+            raise ValueError("features for piece %s must be a 2D matrix with rows containing feature graphs" % pieceId)
+        index[str(pieceId)] = [totalSize, features.shape[0], features.shape[1]]
+        totalSize += features.size
+
+    itemSize = np.dtype(FEATURE_DTYPE).itemsize
+    if path is not None:
+        # np.memmap can't map an empty file
+        data = np.memmap(path, dtype=FEATURE_DTYPE, mode="w+", shape=(max(totalSize, 1),))
+        store = FeatureStore(index, data, path=path)
+    else:
+        block = shared_memory.SharedMemory(create=True, size=max(totalSize, 1) * itemSize)
+        store = FeatureStore(index, block.buf, sharedMemory=block, owner=True)
+
+    for pieceId, features in featureDict.items():
+        offset, numFeatures, numPoints = index[str(pieceId)]
+        store.data[offset:offset + numFeatures * numPoints] = np.asarray(features, dtype=FEATURE_DTYPE).ravel()
+
+    if path is not None:
+        store.data.flush()
+        with open(path + INDEX_SUFFIX, "w") as fp:
+            json.dump(index, fp)
+        # Reopen read-only so that views handed out by this store can't modify the file
+        store.data = np.memmap(path, dtype=FEATURE_DTYPE, mode="r")
+
+    return store
+
+
+# Open an existing memory-mapped feature store written by createFeatureStore()
+def openFeatureStore(path):
+    with open(path + INDEX_SUFFIX) as fp:
+        index = json.load(fp)
+    data = np.memmap(path, dtype=FEATURE_DTYPE, mode="r")
+    return FeatureStore(index, data, path=path)
+
+
+# Attach to a feature store given the result of FeatureStore.reference()
+def attachFeatureStore(reference):
+    if "sharedMemory" in reference:
+        # Attaching also registers the block with the resource tracker of this process (which can't be turned off
+        # before Python 3.13); only the store that created the block unlinks it
+        block = shared_memory.SharedMemory(name=reference["sharedMemory"])
+        return FeatureStore(reference["index"], block.buf, sharedMemory=block)
+    return openFeatureStore(reference["path"])
+
+
+################################################################################################################################
+# Running the model in worker processes
+################################################################################################################################
+
+# A work descriptor: the piece id plus the keyword arguments for tensionModel.runModel (everything except the features).
+# featureList and target are optional; featureList defaults to generic names and target defaults to no empirical data.
+class ModelTask:
+    def __init__(self, pieceId, params):
+        self.pieceId = pieceId
+        self.params = params
+
+
+# Each worker attaches to the store once, when the worker process starts
+workerStore = None
+
+def initWorker(reference):
+    global workerStore
+    workerStore = attachFeatureStore(reference)
+
+def runModelTask(task):
+    features = workerStore.get(task.pieceId)
+    params = dict(task.params)
+    params.setdefault("target", [])
+    params.setdefault("featureList", ["Feature %d" % (i + 1) for i in range(len(features))])
+    params.setdefault("name", task.pieceId)
+    return tensionModel.runModel(features, **params)
+
+
+# Run tensionModel.runModel for each ModelTask using a pool of worker processes; returns the predictions in task order
+def runModelTasks(store, tasks, numWorkers=None):
+    if numWorkers is None:
+        numWorkers = os.cpu_count()
+    with ProcessPoolExecutor(max_workers=numWorkers, initializer=initWorker, initargs=(store.reference(),)) as executor:
+        return list(executor.map(runModelTask, tasks))
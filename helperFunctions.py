@@ -1,4 +1,5 @@
 # Some helper functions
+import numpy as np
 
 def normal_round(num, ndigits=0):
     """
@@ -10,4 +11,65 @@ def normal_round(num, ndigits=0):
         return int(num + 0.5)
     else:
         digit_value = 10 ** ndigits
-        return int(num * digit_value + 0.5) / digit_value
\ No newline at end of file
+        return int(num * digit_value + 0.5) / digit_value
+
+def linearSlope(y):
+    """
+    Slope of the least-squares line through y, with x = 0, 1, 2, ... (same as np.polyfit(x, y, 1)[0]).
+    y: vector with at least 2 values
+    """
+    y = np.asarray(y, dtype=float)
+    x = np.arange(len(y)) - (len(y) - 1) / 2
+    return np.dot(x, y) / np.dot(x, x)
+
+class ExponentialSlope:
+    """
+    Exponentially weighted least-squares slope of a growing sequence, with x = 0, 1, 2, ... and the weight of each
+    value halved every halfLife values.  The weighted means and (co)variances are kept instead of the values, so
+    adding n values costs O(n) and the slope O(1), however long the sequence gets.
+    halfLife: number of values after which a value's weight is halved (> 0)
+    """
+    def __init__(self, halfLife):
+        self.decay = 0.5 ** (1 / halfLife)
+        self.count = 0
+        self.weight = 0.0 # sum of the weights
+        self.meanX = 0.0 # weighted mean of x, relative to the newest value (x = 0)
+        self.meanY = 0.0
+        self.varX = 0.0 # weighted sums of squared deviations and of products of deviations
+        self.covXY = 0.0
+
+    def update(self, y):
+        """
+        Append the values y (in order) to the sequence.
+        """
+        y = np.asarray(y, dtype=float)
+        n = len(y)
+        if n == 0:
+            return
+        # Statistics of the new values alone, with x relative to the last of them
+        x = np.arange(1 - n, 1, dtype=float)
+        w = self.decay ** -x
+        weight = w.sum()
+        meanX = w @ x / weight
+        meanY = w @ y / weight
+        varX = w @ (x - meanX)**2
+        covXY = w @ ((x - meanX) * (y - meanY))
+        # Move the old statistics to the new origin, decay them and merge the two sets (Chan et al.)
+        oldWeight = self.weight * self.decay**n
+        total = oldWeight + weight
+        dX = meanX - (self.meanX - n)
+        dY = meanY - self.meanY
+        self.varX = self.varX * self.decay**n + varX + dX * dX * oldWeight * weight / total
+        self.covXY = self.covXY * self.decay**n + covXY + dX * dY * oldWeight * weight / total
+        self.meanX = self.meanX - n + dX * weight / total
+        self.meanY = self.meanY + dY * weight / total
+        self.weight = total
+        self.count += n
+
+    def slope(self):
+        """
+        Slope of the weighted least-squares line (0 with fewer than 2 values).
+        """
+        if self.count < 2 or self.varX <= 0:
+            return 0.0
+        return self.covXY / self.varX
@@ -0,0 +1,461 @@
+# Incremental re-analysis of an edited MIDI file, e.g. for showing tension in a notation/composition tool
+#
+# An AnalysisSession reads a MIDI file once and keeps the note table, the rasterized features, the harmonic tension
+# intermediates (piano roll, key, centroids and merged windows) and the model's slope tensor.  Note-level edits
+# (insert, delete, modify) are applied to the note table, and update() only recomputes what the edits affect: the
+# per-onset values of the edited onsets, the samples of each feature whose value changed, the piano roll columns and
+# harmonic windows that contain the edit, and the slopes of the attentional windows that overlap the changed
+# samples.  The model's merging/memory stage is then rerun on the updated slope tensor (it is cheap).
+#
+# The result is the same as extracting the features from the edited note table, normalizing them and running
+# tensionModel.runModel from scratch; fromScratch() does exactly that and can be used to check a session.
+# (The predictions agree to floating point precision, since the slopes are computed in a different order.)  The edits
+# are also applied to the pretty_midi object of the file, and writeMidi() writes the edited piece; after an edit, the
+# length of the features is that featureAnalysis.readMidi gives the written file (the end of the bar of the last
+# note), so extractFeaturesMidi on it gives the same features wherever music21 parses the written file into the same
+# notes (see tests/test_incrementalAnalysis.py).
+#
+# Example usage:
+#   session = incrementalAnalysis.AnalysisSession("midi/Brahms.mid", [2, 3, 3, 2, 1, 1], bDissonance=False)
+#   session.insertNote(12.5, 13.0, 72, 80)
+#   session.modifyNote(14.0, 60, newVelocity=100)
+#   features, prediction = session.update()
+
+import os
+import numpy as np
+import pretty_midi
+import featureAnalysis as analysis
+import noteObj
+import tensionModel
+import dataProcessing
+import tension_calculation as tc
+
+
+class AnalysisSession:
+    def __init__(self, inputFile, featureWeights, sampleRate=10, bOnsetFreq=True, bMelodicContour=True, bLoudness=True,
+                 bTempo=True, bHarmony=True, bDissonance=True, memoryWindowDur=3, attentionalWindowDur=3, windowShift=.25,
+                 memoryWeight=5, initSlope=1, lag=1, sliderOnset=True, timeTolerance=.01):
+        self.inputFile = inputFile
+        self.featureWeights = featureWeights
+        self.sampleRate = sampleRate
+        self.flags = [bOnsetFreq, bMelodicContour, bLoudness, bTempo, bHarmony, bDissonance]
+        self.memoryWindowDur = memoryWindowDur
+        self.attentionalWindowDur = attentionalWindowDur
+        self.windowShift = windowShift
+        self.memoryWeight = memoryWeight
+        self.initSlope = initSlope
+        self.lag = lag
+        self.sliderOnset = sliderOnset
+        # Edits within this many seconds of an existing onset are treated as being at that onset
+        self.timeTolerance = timeTolerance
+
+        self.onsetsAll, self.tempoChanges, self.totalDuration = analysis.readMidi(inputFile)
+        # The edits are applied to the pretty_midi object as well, for the harmony and for writeMidi()
+        if bHarmony:
+            result = tc.extract_notes(inputFile, 0)
+            if result is None:
+                raise ValueError('cannot read %s for the harmonic tension analysis' % inputFile)
+            self.pm = result[0]
+            # (key name, key position, key shift) of every key, and the spiral array position of each pitch class
+            self.keyCandidates = [(name,) + tuple(tc.key_position_and_shift(name)) for name in tc.all_key_names]
+            self.pitchClassPositions = np.array([tc.pitch_index_to_position(tc.note_index_to_pitch_index[i]) for i in range(12)])
+        else:
+            self.pm = tc.read_midi(inputFile)
+
+        self.dirtyOnsets = set()
+        self.harmonyDirty = False
+        self.rebuild()
+
+    ################################################################################################################################
+    # Edits
+    ################################################################################################################################
+
+    # Existing onset time (key of onsetsAll) within timeTolerance of the given time, or None
+    def findOnset(self, onset):
+        onsets = np.array(list(self.onsetsAll.keys()))
+        if onsets.size == 0:
+            return None
+        nearest = np.argmin(np.abs(onsets - onset))
+        if abs(onsets[nearest] - onset) <= self.timeTolerance:
+            return onsets[nearest].item()
+        return None
+
+    def findPmNote(self, onset, pitch, instrument):
+        for index, note in enumerate(self.pm.instruments[instrument].notes):
+            if note.pitch == pitch and abs(note.start - onset) <= self.timeTolerance:
+                return index
+        raise ValueError('no note with pitch %d at %.3f seconds in instrument %d' % (pitch, onset, instrument))
+
+    def findNote(self, onset, pitch):
+        key = self.findOnset(onset)
+        if key is not None:
+            for index, note in enumerate(self.onsetsAll[key]):
+                if note.pitch == pitch:
+                    return key, index
+        raise ValueError('no note with pitch %d at %.3f seconds' % (pitch, onset))
+
+    def insertNote(self, onset, endTime, pitch, velocity, instrument=0):
+        key = self.findOnset(onset)
+        if key is None:
+            key = onset
+            self.onsetsAll[key] = []
+            self.onsetsAll = dict(sorted(self.onsetsAll.items()))
+        self.onsetsAll[key].append(noteObj.NoteObj(key, endTime, pitch, velocity))
+        self.dirtyOnsets.add(key)
+
+        # The note starts at the (snapped) onset in both the note table and the piano roll
+        self.pm.instruments[instrument].notes.append(pretty_midi.Note(velocity=int(velocity), pitch=int(pitch), start=key, end=endTime))
+        self.harmonyDirty = self.flags[analysis.iHarmony]
+        self.totalDuration = self.scoreDuration()
+
+    def deleteNote(self, onset, pitch, instrument=0):
+        key, index = self.findNote(onset, pitch)
+        self.pm.instruments[instrument].notes.pop(self.findPmNote(key, pitch, instrument))
+        self.harmonyDirty = self.flags[analysis.iHarmony]
+
+        self.onsetsAll[key].pop(index)
+        if len(self.onsetsAll[key]) == 0:
+            del self.onsetsAll[key]
+        self.dirtyOnsets.add(key)
+        self.totalDuration = self.scoreDuration()
+
+    # Change the pitch, end time and/or velocity of a note in place, or move it to a new onset
+    def modifyNote(self, onset, pitch, newOnset=None, newEndTime=None, newPitch=None, newVelocity=None, instrument=0):
+        key, index = self.findNote(onset, pitch)
+        note = self.onsetsAll[key][index]
+        newEndTime = note.endTime if newEndTime is None else newEndTime
+        newPitch = note.pitch if newPitch is None else newPitch
+        newVelocity = note.velocity if newVelocity is None else newVelocity
+
+        if newOnset is not None and self.findOnset(newOnset) != key:
+            self.deleteNote(onset, pitch, instrument)
+            self.insertNote(newOnset, newEndTime, newPitch, newVelocity, instrument)
+            return
+
+        pmNote = self.pm.instruments[instrument].notes[self.findPmNote(key, pitch, instrument)]
+        pmNote.pitch = int(newPitch)
+        pmNote.velocity = int(newVelocity)
+        pmNote.end = pmNote.start + (newEndTime - key)
+        self.harmonyDirty = self.flags[analysis.iHarmony]
+
+        # Keep the note's position within the onset (the first note of an onset counts fully towards the loudness)
+        note.pitch = newPitch
+        note.velocity = newVelocity
+        noteObj.updateEndTime(note, newEndTime)
+        self.dirtyOnsets.add(key)
+        self.totalDuration = self.scoreDuration()
+
+    # Length of the edited piece as featureAnalysis.readMidi gives it for the edited file: music21 fills the last bar
+    # with rests, so the piece ends at the end of the bar in which the last note ends
+    def scoreDuration(self):
+        return barEndTime(self.pm, lastEndTime(self.onsetsAll))
+
+    # Write the edited piece to a MIDI file (featureAnalysis.extractFeaturesMidi on it gives the features of update())
+    def writeMidi(self, outputFile):
+        self.pm.write(outputFile)
+
+    ################################################################################################################################
+    # Analysis
+    ################################################################################################################################
+
+    # Analyze the whole note table
+    def rebuild(self):
+        self.totalSamples = int(self.totalDuration * self.sampleRate)
+        self.loudness = noteObj.getLoudness(self.onsetsAll)
+        self.dissonance = noteObj.getDissonance(self.onsetsAll)
+        if self.flags[analysis.iHarmony]:
+            self.rebuildHarmony()
+
+        self.events = [None] * analysis.NUM_FEATURES
+        self.features = np.zeros((analysis.NUM_FEATURES, self.totalSamples))
+        for row in range(analysis.NUM_FEATURES):
+            if self.flags[row]:
+                self.events[row] = self.featureEvents(row)
+                self.features[row,:] = analysis.rasterizeEvents(*self.events[row], self.sampleRate, self.totalSamples)
+        self.rawContour = self.features[analysis.iMelodicContour,:].copy()
+        analysis.fillLeadingZeros(self.features[analysis.iMelodicContour,:])
+
+        self.slopeTensor = tensionModel.computeSlopeTensor(self.features, self.sampleRate, self.attentionalWindowDur, self.windowShift)
+        self.stds = np.std(self.features, axis=1)
+        self.prediction = self.predict()
+        self.dirtyOnsets = set()
+        self.harmonyDirty = False
+
+    # Recompute what the edits since the last update affect; returns the features and the tension prediction
+    def update(self):
+        if len(self.dirtyOnsets) == 0 and not self.harmonyDirty:
+            return self.features, self.prediction
+
+        # A longer or shorter piece changes the length of all the features
+        if int(self.totalDuration * self.sampleRate) != self.totalSamples:
+            self.rebuild()
+            return self.features, self.prediction
+
+        for key in self.dirtyOnsets:
+            if key in self.onsetsAll:
+                self.loudness[key] = noteObj.getLoudness({key: self.onsetsAll[key]})[key]
+                self.dissonance[key] = noteObj.getDissonance({key: self.onsetsAll[key]})[key]
+        # keep the per-onset values in onset order
+        self.loudness = {key: self.loudness[key] for key in self.onsetsAll}
+        self.dissonance = {key: self.dissonance[key] for key in self.onsetsAll}
+
+        if self.flags[analysis.iHarmony] and self.harmonyDirty:
+            self.updateHarmony()
+
+        for row in range(analysis.NUM_FEATURES):
+            if not self.flags[row]:
+                continue
+            newEvents = self.featureEvents(row)
+            span = changedSampleSpan(self.events[row], newEvents, self.sampleRate, self.totalSamples)
+            self.events[row] = newEvents
+            if span is None:
+                continue
+            startSample, endSample = span
+            newValues = analysis.rasterizeEvents(*newEvents, self.sampleRate, self.totalSamples, startSample, endSample)
+
+            if row == analysis.iMelodicContour:
+                # filling in the leading zeros can change the beginning of the contour as well
+                self.rawContour[startSample:endSample] = newValues
+                newRow = analysis.fillLeadingZeros(self.rawContour.copy())
+                changed = np.flatnonzero(newRow != self.features[row,:])
+                self.features[row,:] = newRow
+                if changed.size == 0:
+                    continue
+                startSample, endSample = changed[0], changed[-1] + 1
+            else:
+                self.features[row, startSample:endSample] = newValues
+
+            self.stds[row] = np.std(self.features[row,:])
+            self.updateSlopes(row, startSample, endSample)
+
+        self.prediction = self.predict()
+        self.dirtyOnsets = set()
+        self.harmonyDirty = False
+        return self.features, self.prediction
+
+    # Events (times, values, value before the first event) of the given feature row
+    def featureEvents(self, row):
+        if row == analysis.iOnsetFreq:
+            return analysis.getOnsetFreqEvents(self.onsetsAll)
+        elif row == analysis.iMelodicContour:
+            return analysis.getMelodicContourEvents(self.onsetsAll)
+        elif row == analysis.iLoudness:
+            return analysis.dictToEvents(self.loudness)
+        elif row == analysis.iTempo:
+            return analysis.getTempoEvents(self.tempoChanges)
+        elif row == analysis.iHarmony:
+            return analysis.getHarmonyEvents(self.harmonicTension, self.harmonyTimes)
+        elif row == analysis.iDissonance:
+            return analysis.dictToEvents(self.dissonance)
+
+    # Recompute the slopes of the attentional windows that overlap the changed samples of a feature
+    def updateSlopes(self, row, startSample, endSample):
+        slopeTensor = self.slopeTensor
+        affected = np.flatnonzero((slopeTensor.endpts >= startSample) & (slopeTensor.startpts < endSample))
+        if affected.size == 0:
+            return
+        first = slopeTensor.startpts[affected].min()
+        last = slopeTensor.endpts[affected].max()
+        segment = self.features[row, first:last+1]
+        cumY, cumKY = tensionModel.cumulativeStats(segment - np.mean(segment))
+        slopes = tensionModel.windowSlopes(cumY, cumKY, slopeTensor.startpts[affected] - first, slopeTensor.endpts[affected] - first)[0]
+        slopes[np.isnan(slopes)] = 0
+        slopeTensor.slopes[row, affected] = slopes
+
+    # runModel on the normalized features: normalizing a feature divides its slopes by its standard deviation
+    def predict(self):
+        scale = np.divide(1, self.stds, out=np.zeros_like(self.stds), where=self.stds != 0)
+        slopeTensor = self.slopeTensor
+        normalized = tensionModel.SlopeTensor(slopeTensor.slopes * scale[:, np.newaxis], slopeTensor.windowIndices,
+                                              slopeTensor.startpts, slopeTensor.endpts, slopeTensor.numPoints, slopeTensor.sampleRate)
+        return tensionModel.runModelFromSlopes(normalized, self.featureWeights, self.memoryWindowDur, self.memoryWeight,
+                                               self.initSlope, self.lag, self.sliderOnset)
+
+    ################################################################################################################################
+    # Harmonic tension (the same steps as tension_calculation.cal_tension without key change detection)
+    ################################################################################################################################
+
+    def rebuildHarmony(self):
+        self.sixteenthTime, self.beatTime, self.downBeatTime, self.beatIndices, self.downBeatIndices = tc.get_beat_time(self.pm, beat_division=4)
+        self.pmEndTime = self.pm.get_end_time()
+        self.pianoRoll = tc.get_piano_roll(self.pm, self.sixteenthTime)
+        self.pitchClassCounts = pitchClassCounts(self.pianoRoll)
+        self.keyName, self.keyPos, self.noteShift = tc.cal_key(self.pianoRoll, tc.all_key_names, end_ratio=analysis.HARMONY_END_RATIO)
+        self.rebuildCentroids()
+
+    def rebuildCentroids(self):
+        windowSize = analysis.HARMONY_WINDOW_SIZE
+        self.centroids = np.array(tc.cal_centroid(self.pianoRoll, self.noteShift, -1, -1)).reshape(-1, 3)
+        self.mergedCentroids = tc.merge_tension(self.centroids, self.beatIndices, self.downBeatIndices, window_size=windowSize)
+        self.harmonicTension = self.windowTension(np.arange(len(self.mergedCentroids)))
+        self.harmonyTimes = self.beatTime[::windowSize][:len(self.harmonicTension)]
+        # first and last+1 piano roll column of each merged window
+        beatIndices = np.array(self.beatIndices)
+        self.windowStarts = beatIndices[0:len(beatIndices) - windowSize:windowSize]
+        self.windowEnds = beatIndices[windowSize::windowSize][:len(self.windowStarts)]
+
+    # Distance from the key of the merged centroids of the given windows (0 for silent windows)
+    def windowTension(self, windows):
+        merged = self.mergedCentroids[windows]
+        if len(merged) == 0:
+            return np.zeros(0)
+        keyDiff = np.linalg.norm(merged - self.keyPos, axis=-1)
+        keyDiff[np.linalg.norm(merged, axis=-1) < 0.1] = 0
+        return keyDiff
+
+    def updateHarmony(self):
+        # The beat grid extends to the end of the last note
+        if self.pm.get_end_time() != self.pmEndTime:
+            self.rebuildHarmony()
+            return
+
+        pianoRoll = tc.get_piano_roll(self.pm, self.sixteenthTime)
+        changedColumns = np.flatnonzero((pianoRoll != self.pianoRoll).any(axis=0))
+        self.pianoRoll = pianoRoll
+        if changedColumns.size == 0:
+            return
+        self.pitchClassCounts[:, changedColumns] = pitchClassCounts(pianoRoll[:, changedColumns])
+
+        keyName = self.findKey()
+        if keyName != self.keyName:
+            self.keyName, self.keyPos, self.noteShift = [candidate for candidate in self.keyCandidates if candidate[0] == keyName][0]
+            self.rebuildCentroids()
+            return
+
+        for column in changedColumns:
+            self.centroids[column] = tc.notes_to_ce(pianoRoll[:, column], self.noteShift)
+
+        windows = np.searchsorted(self.windowStarts, changedColumns, side='right') - 1
+        valid = windows >= 0
+        windows = windows[valid]
+        windows = np.unique(windows[changedColumns[valid] < self.windowEnds[windows]])
+        for window in windows:
+            self.mergedCentroids[window] = np.mean(self.centroids[self.windowStarts[window]:self.windowEnds[window]], axis=0)
+        # a new array, since the harmony row's current events refer to the old one
+        self.harmonicTension = self.harmonicTension.copy()
+        self.harmonicTension[windows] = self.windowTension(windows)
+
+    # Same result as tension_calculation.cal_key, computed from the cached pitch class counts of the piano roll
+    def findKey(self):
+        end = int(self.pianoRoll.shape[1] * analysis.HARMONY_END_RATIO)
+        counts = self.pitchClassCounts[:, :end].sum(axis=1)
+        if counts.sum() == 0:
+            return tc.cal_key(self.pianoRoll, tc.all_key_names, end_ratio=analysis.HARMONY_END_RATIO)[0]
+
+        distances = np.zeros(len(self.keyCandidates))
+        for i, (name, keyPos, shift) in enumerate(self.keyCandidates):
+            positions = self.pitchClassPositions[(np.arange(12) - shift) % 12]
+            ce = counts @ positions / counts.sum()
+            distances[i] = np.linalg.norm(ce - keyPos)
+
+        # The running sums are added up in a different order than in cal_key, so near-ties are decided by cal_key itself
+        ordered = np.sort(distances)
+        if ordered[1] - ordered[0] < 1e-9:
+            return tc.cal_key(self.pianoRoll, tc.all_key_names, end_ratio=analysis.HARMONY_END_RATIO)[0]
+        return self.keyCandidates[int(np.argmin(distances))][0]
+
+    ################################################################################################################################
+    # Reference
+    ################################################################################################################################
+
+    # Features and prediction computed from scratch from the current note table
+    def fromScratch(self):
+        totalSamples = int(self.totalDuration * self.sampleRate)
+        features = np.zeros((analysis.NUM_FEATURES, totalSamples))
+        events = [analysis.getOnsetFreqEvents(self.onsetsAll),
+                  analysis.getMelodicContourEvents(self.onsetsAll),
+                  analysis.dictToEvents(noteObj.getLoudness(self.onsetsAll)),
+                  analysis.getTempoEvents(self.tempoChanges),
+                  None,
+                  analysis.dictToEvents(noteObj.getDissonance(self.onsetsAll))]
+
+        if self.flags[analysis.iHarmony]:
+            sixteenthTime, beatTime, downBeatTime, beatIndices, downBeatIndices = tc.get_beat_time(self.pm, beat_division=4)
+            pianoRoll = tc.get_piano_roll(self.pm, sixteenthTime)
+            inputFolder = os.path.dirname(self.inputFile) or '.'
+            result = tc.cal_tension(self.inputFile, pianoRoll, sixteenthTime, beatTime, beatIndices, downBeatTime, downBeatIndices,
+                                    self.pm, inputFolder, "output", analysis.HARMONY_WINDOW_SIZE, tc.all_key_names,
+                                    analysis.HARMONY_END_RATIO, False)
+            events[analysis.iHarmony] = analysis.getHarmonyEvents(result[0], result[8])
+
+        for row in range(analysis.NUM_FEATURES):
+            if self.flags[row]:
+                features[row,:] = analysis.rasterizeEvents(*events[row], self.sampleRate, totalSamples)
+        analysis.fillLeadingZeros(features[analysis.iMelodicContour,:])
+
+        normalized = np.array([dataProcessing.normalize(row) for row in features]).reshape(features.shape)
+        prediction = tensionModel.runModel(normalized, [], analysis.featureList, self.featureWeights, self.memoryWindowDur,
+                                           self.sampleRate, self.attentionalWindowDur, self.windowShift, self.inputFile,
+                                           self.memoryWeight, self.initSlope, self.lag, self.sliderOnset)
+        return features, prediction
+
+
+# End of the last note of a note table (the length featureAnalysis.readMidi gives a file written from it)
+def lastEndTime(onsetsAll):
+    return max((note.endTime for notes in onsetsAll.values() for note in notes), default=0)
+
+
+# End time of the bar of a pretty_midi object in which the given time falls (the time itself if it is on a bar line)
+def barEndTime(pm, time):
+    if time <= 0:
+        return 0
+    tick = pm.time_to_tick(time)
+    signatures = [signature for signature in pm.time_signature_changes if pm.time_to_tick(signature.time) <= tick]
+    numerator, denominator, signatureTick = 4, 4, 0
+    if len(signatures) > 0:
+        numerator, denominator, signatureTick = signatures[-1].numerator, signatures[-1].denominator, pm.time_to_tick(signatures[-1].time)
+    barTicks = numerator * pm.resolution * 4 // denominator
+    endTick = signatureTick + -(-(tick - signatureTick) // barTicks) * barTicks
+
+    # the bar can end after the last event, where pm.tick_to_time doesn't reach; go through the tempo changes instead
+    endTime = 0
+    for index, (scaleTick, secondsPerTick) in enumerate(pm._tick_scales):
+        nextTick = pm._tick_scales[index + 1][0] if index + 1 < len(pm._tick_scales) else endTick
+        endTime += (min(nextTick, endTick) - scaleTick) * secondsPerTick
+        if nextTick >= endTick:
+            break
+    return endTime
+
+
+# Number of sounding notes of each pitch class in each column of a piano roll (12 x columns)
+def pitchClassCounts(pianoRoll):
+    padded = np.zeros((132, pianoRoll.shape[1]))
+    padded[:pianoRoll.shape[0]] = pianoRoll > 0
+    return padded.reshape(11, 12, pianoRoll.shape[1]).sum(axis=0)
+
+
+# First sample whose time (at the 10 microsecond resolution used by featureAnalysis.rasterizeEvents) is >= eventTime
+def firstSampleAtOrAfter(eventTime, sampleRate):
+    sampleIndex = max(int(eventTime / 100000 * sampleRate) - 1, 0)
+    while int(sampleIndex/sampleRate * 100000) < eventTime:
+        sampleIndex += 1
+    return sampleIndex
+
+
+# Range of samples [start, end) where two step functions (given as events) differ, or None if they are the same
+def changedSampleSpan(oldEvents, newEvents, sampleRate, totalSamples):
+    oldTimes, oldValues, oldInit = oldEvents
+    newTimes, newValues, newInit = newEvents
+    oldTimes = (np.asarray(oldTimes, dtype=float) * 100000).astype(int)
+    newTimes = (np.asarray(newTimes, dtype=float) * 100000).astype(int)
+    changePoints = np.union1d(oldTimes, newTimes)
+
+    oldAt = np.concatenate([[oldInit], oldValues])[np.searchsorted(oldTimes, changePoints, side='right')]
+    newAt = np.concatenate([[newInit], newValues])[np.searchsorted(newTimes, changePoints, side='right')]
+    differs = np.flatnonzero((oldAt != newAt) & ~(np.isnan(oldAt) & np.isnan(newAt)))
+    initDiffers = oldInit != newInit
+
+    if differs.size == 0 and not initDiffers:
+        return None
+
+    startSample = 0 if initDiffers else firstSampleAtOrAfter(changePoints[differs[0]], sampleRate)
+    # the functions differ until the next change point after the last difference
+    nextPoint = differs[-1] + 1 if differs.size > 0 else 0
+    if nextPoint < changePoints.size:
+        endSample = min(firstSampleAtOrAfter(changePoints[nextPoint], sampleRate), totalSamples)
+    else:
+        endSample = totalSamples
+
+    if startSample >= endSample:
+        return None
+    return startSample, endSample
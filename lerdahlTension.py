@@ -0,0 +1,197 @@
+# Harmonic tension based on Lerdahl's (2001) tonal pitch space (TPS), as an alternative to the spiral array
+# harmonic tension in tonalTension/tension_calculation.  Reference:
+# Lerdahl, F. 2001. Tonal Pitch Space. New York: Oxford University Press.
+#
+# The chord distance rule is delta(x -> y) = i + j + k, where
+#   i: the distance between the regions (keys) of x and y on the chart of regions, i.e. the number of steps between
+#      fifth-related, relative and parallel keys
+#   j: the number of steps on the circle of fifths between the chord roots
+#   k: the number of pitch classes in the basic space of y (root, fifth, triad, diatonic and chromatic levels) that
+#      aren't in the basic space of x at the same level
+# Without a prolongational analysis, the tension of a chord is its distance from the tonic chord of the piece's key
+# (taking the chord in the closest region that contains it), which is precomputed for all 24 keys x 24 triads.
+#
+# Chords are recognized per harmonic window (every windowSize beats, or every downbeat for windowSize = -1, as in
+# tension_calculation.cal_tension) from the sixteenth-step piano roll of tension_calculation.extract_notes, by matching
+# the pitch classes against triad templates.
+#
+# Example usage:
+#   tension, times = lerdahlTension.analyzeLerdahlTension("midi/Brahms.mid", 2)
+
+from collections import Counter
+import numpy as np
+import tonalTension
+import tension_calculation as tc
+
+NUM_KEYS = 24 # 0-11: major keys on tonics C..B; 12-23: minor keys
+NUM_CHORDS = 24 # 0-11: major triads on roots C..B; 12-23: minor triads
+
+MAJOR_SCALE = [0, 2, 4, 5, 7, 9, 11]
+MINOR_SCALE = [0, 2, 3, 5, 7, 8, 11] # harmonic minor, so that V is a major triad
+
+# Chord template weights for the root, third and fifth, and for pitch classes outside the triad
+ROOT_WEIGHT = 1
+THIRD_WEIGHT = 1
+FIFTH_WEIGHT = .8
+NON_CHORD_WEIGHT = -.6
+
+
+def keyTonic(key):
+    return key % 12
+
+def isMinor(index):
+    return index >= 12
+
+def scale(key):
+    steps = MINOR_SCALE if isMinor(key) else MAJOR_SCALE
+    return frozenset((keyTonic(key) + step) % 12 for step in steps)
+
+def chordRoot(chord):
+    return chord % 12
+
+def chordPitchClasses(chord):
+    root = chordRoot(chord)
+    third = 3 if isMinor(chord) else 4
+    return [root, (root + third) % 12, (root + 7) % 12]
+
+def tonicChord(key):
+    return key # the tonic triad of a key has the same index as the key
+
+
+# Region distances: shortest path on the chart of regions, where each key is one step from its dominant,
+# subdominant, relative and parallel keys
+def regionDistances():
+    neighbours = []
+    for key in range(NUM_KEYS):
+        tonic = keyTonic(key)
+        mode = 12 if isMinor(key) else 0
+        related = [mode + (tonic + 7) % 12, mode + (tonic + 5) % 12]
+        if isMinor(key):
+            related += [(tonic + 3) % 12, tonic] # relative major, parallel major
+        else:
+            related += [12 + (tonic + 9) % 12, 12 + tonic] # relative minor, parallel minor
+        neighbours.append(related)
+
+    distances = np.full((NUM_KEYS, NUM_KEYS), -1, dtype=int)
+    for start in range(NUM_KEYS):
+        distances[start, start] = 0
+        frontier = [start]
+        while frontier:
+            nextFrontier = []
+            for key in frontier:
+                for neighbour in neighbours[key]:
+                    if distances[start, neighbour] < 0:
+                        distances[start, neighbour] = distances[start, key] + 1
+                        nextFrontier.append(neighbour)
+            frontier = nextFrontier
+    return distances
+
+
+# Steps on the circle of fifths between two roots
+def rootDistance(root1, root2):
+    steps = (7 * (root2 - root1)) % 12
+    return min(steps, 12 - steps)
+
+
+# The levels of the basic space of a chord in a region: root, fifth, triad and diatonic (the chromatic level is the
+# same for every chord, so it never adds to the distance)
+def basicSpace(chord, key):
+    root, third, fifth = chordPitchClasses(chord)
+    return [frozenset([root]), frozenset([root, fifth]), frozenset([root, third, fifth]), scale(key)]
+
+
+def chordDistance(chord1, key1, chord2, key2, regions):
+    space1 = basicSpace(chord1, key1)
+    space2 = basicSpace(chord2, key2)
+    k = sum(len(level2 - level1) for level1, level2 in zip(space1, space2))
+    return regions[key1, key2] + rootDistance(chordRoot(chord1), chordRoot(chord2)) + k
+
+
+# Tension of every triad in every key: the distance from the tonic chord of the key to the triad, in the region
+# closest to the key that contains the triad
+def tensionTable():
+    regions = regionDistances()
+    table = np.zeros((NUM_KEYS, NUM_CHORDS))
+    for key in range(NUM_KEYS):
+        for chord in range(NUM_CHORDS):
+            pitchClasses = set(chordPitchClasses(chord))
+            table[key, chord] = min(chordDistance(tonicChord(key), key, chord, region, regions)
+                                    for region in range(NUM_KEYS) if pitchClasses <= scale(region))
+    return table
+
+
+def chordTemplates():
+    templates = np.full((NUM_CHORDS, 12), float(NON_CHORD_WEIGHT))
+    for chord in range(NUM_CHORDS):
+        root, third, fifth = chordPitchClasses(chord)
+        templates[chord, root] = ROOT_WEIGHT
+        templates[chord, third] = THIRD_WEIGHT
+        templates[chord, fifth] = FIFTH_WEIGHT
+    return templates
+
+
+TENSION_TABLE = tensionTable()
+CHORD_TEMPLATES = chordTemplates()
+
+
+# Pitch-class content of a piano roll (pitches x time steps): 12 x time steps
+def pitchClassRoll(piano_roll):
+    numPitches, numSteps = piano_roll.shape
+    padded = np.zeros((-(-numPitches // 12) * 12, numSteps))
+    padded[:numPitches] = piano_roll > 0
+    return padded.reshape(-1, 12, numSteps).sum(axis=0)
+
+
+# Key of the whole piece (index 0-23) by a vote of the key profiles in tonalTension
+def estimateKey(piano_roll):
+    histogram = tonalTension.pitch_class_histogram(piano_roll)
+    votes = [int(np.argmax(tonalTension.key_profile_correlations(histogram, profileMatrix)))
+             for profileMatrix in tonalTension.key_profile_matrices.values()]
+    return Counter(votes).most_common(1)[0][0]
+
+
+# Lerdahl tension per harmonic window (windowSize beats, or every downbeat for windowSize = -1, as in
+# tension_calculation.cal_tension).  Return values: tension, chord index per window (-1 for silent windows, whose
+# tension is 0), key index, and window start times
+def calLerdahlTension(piano_roll, beat_indices, beat_time, windowSize=2, down_beat_indices=(), down_beat_time=()):
+    key = estimateKey(piano_roll)
+
+    # Window boundaries as in tension_calculation.merge_tension
+    if windowSize == -1:
+        bounds = np.array(down_beat_indices, dtype=int)
+        windowTimes = np.asarray(down_beat_time, dtype=float)
+    else:
+        bounds = np.array(beat_indices[::windowSize], dtype=int)
+        windowTimes = np.asarray(beat_time[::windowSize], dtype=float)
+    if len(bounds) < 2:
+        return np.zeros(0), np.zeros(0, dtype=int), key, np.zeros(0)
+
+    # Pitch classes summed over each window, from cumulative sums over the time steps
+    pitchClasses = pitchClassRoll(piano_roll[:, :bounds[-1]])
+    cumulative = np.concatenate((np.zeros((12, 1)), np.cumsum(pitchClasses, axis=1)), axis=1)
+    windowPitchClasses = cumulative[:, bounds[1:]] - cumulative[:, bounds[:-1]]
+
+    # Each window's pitch classes are scaled to a maximum of 1 before matching the templates
+    peaks = windowPitchClasses.max(axis=0)
+    silent = peaks == 0
+    scores = CHORD_TEMPLATES @ (windowPitchClasses / np.where(silent, 1, peaks))
+    chords = np.argmax(scores, axis=0)
+
+    tension = TENSION_TABLE[key, chords]
+    tension[silent] = 0
+    chords[silent] = -1
+    times = windowTimes[:len(tension)]
+    return tension, chords, key, times
+
+
+# Lerdahl tension and window start times of a MIDI file; raises tension_calculation.MidiReadError if the notes can't
+# be read (e.g. a file with only drum tracks)
+def analyzeLerdahlTension(fileName, windowSize, trackNum=0):
+    # trackNum = 0 default means use all tracks
+    result = tc.extract_notes(fileName, trackNum)
+    if result is None:
+        raise tc.MidiReadError('cannot read the notes of %s for the Lerdahl tension' % fileName)
+    pm, piano_roll, sixteenth_time, beat_time, down_beat_time, beat_indices, down_beat_indices = result
+    tension, chords, key, times = calLerdahlTension(piano_roll, beat_indices, beat_time, windowSize, down_beat_indices,
+                                                    down_beat_time)
+    return tension, times
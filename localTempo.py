@@ -0,0 +1,110 @@
+# Local tempo estimated from the note onsets, for MIDI files without a tempo map (e.g. recorded performances, whose
+# timing is in the onsets rather than in tempo messages)
+#
+# Every onset is paired with the next few onsets (up to MAX_IOI_ORDER), and each of these inter-onset intervals (IOIs)
+# is folded by octaves (factors of 2) into one octave of beat periods around the reference tempo, so that
+# subdivisions and multiples of the beat all count towards the beat period.  The folded IOIs are counted in a
+# histogram over log-period bins for each sample, and a sliding window of windowDur seconds sums the histograms with
+# a cumulative sum over the samples.  The local beat period is found at the peak of the window's histogram (smoothed
+# over neighbouring bins, which wrap around at the ends of the octave) and refined to the weighted mean of the folded
+# IOIs in the peak bin and its two neighbours, so a steady tempo comes out exactly.  All of this is
+# O(onsets + samples x bins).
+#
+# The result is a continuous tempo curve in BPM with one value per sample.  Windows without any IOIs keep the previous
+# tempo.  Note that the octave of the tempo is fixed by the reference tempo: tempos are reported between
+# referenceTempo/sqrt(2) and referenceTempo*sqrt(2).
+#
+# Example usage:
+#   tempo = localTempo.estimateLocalTempo(onsetTimes, SAMPLE_RATE, totalSamples)
+
+import numpy as np
+
+REFERENCE_TEMPO = 120 # BPM; also the tempo when there are no onsets (the default MIDI tempo)
+MAX_IOI_ORDER = 4 # each onset is paired with up to this many following onsets
+MIN_IOI = .05 # seconds; shorter IOIs (e.g. spread chords) are ignored
+MAX_IOI = 2.5 # seconds; longer IOIs (e.g. rests) are ignored
+NUM_BINS = 48 # log-period bins per octave
+
+
+# Fold periods by factors of 2 into the octave [lowPeriod, 2*lowPeriod); returns the position in the octave in [0, 1)
+def foldPeriods(periods, lowPeriod):
+    octaves = np.log2(periods / lowPeriod)
+    return octaves - np.floor(octaves)
+
+
+# Local tempo curve (BPM, one value per sample) from the onset times in seconds
+def estimateLocalTempo(onsetTimes, sampleRate, totalSamples, windowDur=4, referenceTempo=REFERENCE_TEMPO, maxOrder=MAX_IOI_ORDER,
+                       numBins=NUM_BINS, smoothingBins=1.5):
+    onsetTimes = np.unique(np.asarray(onsetTimes, dtype=float))
+    lowPeriod = 60 / referenceTempo / np.sqrt(2)
+
+    # IOIs of every order, each placed at the midpoint between its two onsets and weighted by 1/order
+    ordersUsed = [order for order in range(1, maxOrder + 1) if order < len(onsetTimes)]
+    starts = np.concatenate([onsetTimes[:-order] for order in ordersUsed] + [np.zeros(0)])
+    ends = np.concatenate([onsetTimes[order:] for order in ordersUsed] + [np.zeros(0)])
+    orders = np.concatenate([np.full(len(onsetTimes) - order, order) for order in ordersUsed] + [np.ones(0)])
+    iois = ends - starts
+    keep = (iois >= MIN_IOI) & (iois <= MAX_IOI)
+    iois, midpoints, weights = iois[keep], ((starts + ends) / 2)[keep], 1 / orders[keep]
+
+    if iois.size == 0 or totalSamples <= 0:
+        return np.full(max(totalSamples, 0), float(referenceTempo))
+
+    # Histograms of the folded IOIs at each sample (their weights, and their weighted positions within the bins), then
+    # summed over the sliding window with cumulative sums
+    positions = foldPeriods(iois, lowPeriod) * numBins
+    bins = np.minimum(positions.astype(int), numBins - 1)
+    samples = np.clip((midpoints * sampleRate).astype(int), 0, totalSamples - 1)
+    k = np.arange(totalSamples)
+    halfWindow = int(round(windowDur * sampleRate / 2))
+
+    def windowSums(values):
+        histogram = np.bincount(samples * numBins + bins, weights=values, minlength=totalSamples * numBins).reshape(totalSamples, numBins)
+        cumulative = np.concatenate((np.zeros((1, numBins)), np.cumsum(histogram, axis=0)))
+        return cumulative[np.minimum(k + halfWindow + 1, totalSamples)] - cumulative[np.maximum(k - halfWindow, 0)]
+
+    windowed = windowSums(weights)
+    windowedOffsets = windowSums(weights * (positions - bins))
+
+    # Smooth over the (circular) bins with a Gaussian kernel
+    offsets = np.arange(-int(np.ceil(3 * smoothingBins)), int(np.ceil(3 * smoothingBins)) + 1)
+    kernel = np.exp(-.5 * (offsets / smoothingBins)**2)
+    smoothed = sum(weight * np.roll(windowed, offset, axis=1) for offset, weight in zip(offsets, kernel))
+
+    # Peak bin, refined to the weighted mean position of the folded IOIs in the peak bin and its neighbours (positions
+    # relative to the peak bin, so the mean wraps around the ends of the octave), which makes a steady tempo exact
+    peak = np.argmax(smoothed, axis=1)
+    rows = np.arange(totalSamples)
+    peakBins = (peak[:, np.newaxis] + np.arange(-1, 2)) % numBins
+    peakWeights = windowed[rows[:, np.newaxis], peakBins]
+    peakPositions = windowedOffsets[rows[:, np.newaxis], peakBins] + np.arange(-1, 2) * peakWeights
+    totalWeights = peakWeights.sum(axis=1)
+    # Without IOIs near the peak of the smoothed histogram, a parabola through the peak and its neighbours
+    left = smoothed[rows, (peak - 1) % numBins]
+    centre = smoothed[rows, peak]
+    right = smoothed[rows, (peak + 1) % numBins]
+    curvature = left - 2 * centre + right
+    shift = np.divide(left - right, 2 * curvature, out=np.zeros(totalSamples), where=curvature < 0) + .5
+    shift = np.divide(peakPositions.sum(axis=1), totalWeights, out=shift, where=totalWeights > 0)
+    position = ((peak + shift) / numBins) % 1
+    tempo = 60 / (lowPeriod * 2**position)
+
+    # Windows without IOIs keep the previous tempo (or take the first estimated one)
+    hasData = windowed.sum(axis=1) > 0
+    source = np.maximum.accumulate(np.where(hasData, rows, -1))
+    source[source < 0] = np.argmax(hasData)
+    return tempo[source]
+
+
+# Whether the tempo changes read from the MIDI file (as in featureAnalysis.readMidi) amount to a tempo map, i.e. more
+# than one tempo
+def hasTempoMap(tempoChanges):
+    return len(set(val[1] for val in tempoChanges.values())) > 1
+
+
+# The local tempo as step function events at every sample time (see featureAnalysis.getTempoEvents)
+def getLocalTempoEvents(onsetTimes, sampleRate, totalSamples, windowDur=4, referenceTempo=REFERENCE_TEMPO):
+    tempo = estimateLocalTempo(onsetTimes, sampleRate, totalSamples, windowDur, referenceTempo)
+    if tempo.size == 0:
+        return np.zeros(0), np.zeros(0), referenceTempo
+    return np.arange(1, totalSamples) / sampleRate, tempo[1:], tempo[0]
@@ -0,0 +1,148 @@
+# Reading MIDI corpora directly from zip and tar (.tar, .tar.gz, .tar.bz2, .tar.xz) archives, without extracting them
+#
+# listMidiMembers() enumerates the .mid/.midi members of an archive (in archive order), and MidiArchive.readMembers()
+# yields them as tension_calculation.MidiMember objects: strings holding the member name, with the bytes of the file
+# in .data.  The parsers (featureAnalysis.readMidi, tension_calculation.read_midi, and so everything built on them)
+# read a MidiMember from its bytes, so it can be passed wherever a MIDI file name is expected.
+#
+# iterArchive() runs a function on every MIDI member in a pool of worker processes.  The member list is split into
+# contiguous shards; the workers are sent only the archive path and the member names of a shard and each opens the
+# archive itself, so no file data goes through the pool.  Zip members are read directly; a tar archive is read
+# sequentially (the only way to read a compressed one), up to the last member of the shard.
+#
+# Example usage:
+#   for name, features in midiArchive.iterArchive("lmd_full.tar.gz", midiArchive.extractFeatures, numWorkers=8):
+#       ...
+#   results = midiArchive.processArchive("corpus.zip", functools.partial(midiArchive.analyzeTension, windowSize=2, endRatio=1))
+#
+#   with midiArchive.MidiArchive("corpus.zip") as archive:
+#       for member in archive.readMembers(archive.midiMembers()[:10]):
+#           features = featureAnalysis.extractFeaturesMidi(member, SAMPLE_RATE)
+
+import os
+import tarfile
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+import featureAnalysis as analysis
+import tension_calculation as tc
+
+MIDI_EXTENSIONS = (".mid", ".midi")
+
+
+def isMidiName(name):
+    return name.lower().endswith(MIDI_EXTENSIONS)
+
+
+def isArchive(path):
+    return os.path.isfile(path) and (zipfile.is_zipfile(path) or tarfile.is_tarfile(path))
+
+
+# A zip archive stays open; a tar archive is opened for every pass over it, since going back in a compressed tar
+# archive means decompressing it from the start again
+class MidiArchive:
+    def __init__(self, path):
+        self.path = path
+        if zipfile.is_zipfile(path):
+            self.zipFile = zipfile.ZipFile(path)
+        elif tarfile.is_tarfile(path):
+            self.zipFile = None
+        else:
+            raise ValueError('%s is not a zip or tar archive' % path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        if self.zipFile is not None:
+            self.zipFile.close()
+
+    # Names of the MIDI members, in archive order
+    def midiMembers(self):
+        if self.zipFile is not None:
+            return [info.filename for info in self.zipFile.infolist() if not info.is_dir() and isMidiName(info.filename)]
+        with tarfile.open(self.path, mode="r:*") as tarFile:
+            return [member.name for member in tarFile if member.isfile() and isMidiName(member.name)]
+
+    # Yield the given members as tension_calculation.MidiMembers, in archive order for tar archives (which are read
+    # sequentially, stopping after the last one of names) and in the given order for zip archives
+    def readMembers(self, names):
+        if self.zipFile is not None:
+            for name in names:
+                yield tc.MidiMember(name, self.zipFile.read(name))
+            return
+        remaining = set(names)
+        with tarfile.open(self.path, mode="r:*") as tarFile:
+            for member in tarFile:
+                if len(remaining) == 0:
+                    break
+                if member.name in remaining:
+                    remaining.discard(member.name)
+                    yield tc.MidiMember(member.name, tarFile.extractfile(member).read())
+
+
+def listMidiMembers(path):
+    with MidiArchive(path) as archive:
+        return archive.midiMembers()
+
+
+# Split names into numShards contiguous shards of (nearly) equal size
+def shardMembers(names, numShards):
+    numShards = max(min(numShards, len(names)), 1)
+    bounds = [len(names) * k // numShards for k in range(numShards + 1)]
+    return [names[bounds[k]:bounds[k + 1]] for k in range(numShards)]
+
+
+# Run function on every member of one shard, in the worker; a member that can't be processed gets None
+def processShard(path, names, function):
+    results = []
+    with MidiArchive(path) as archive:
+        for member in archive.readMembers(names):
+            try:
+                results.append((str(member), function(member)))
+            except Exception as e:
+                print('Unexpected error in ' + member + ':\n', e)
+                results.append((str(member), None))
+    return results
+
+
+# Yield (member name, function(member)) for the MIDI members of the archive at path (all of them by default).
+# function must be picklable (a module-level function or a functools.partial of one) when numWorkers > 1.  Results
+# come in shard order; numShards defaults to one shard per worker, so a compressed tar archive is read at most
+# numWorkers times.
+def iterArchive(path, function, numWorkers=1, members=None, numShards=None):
+    if members is None:
+        members = listMidiMembers(path)
+    if numShards is None:
+        numShards = numWorkers
+    shards = shardMembers(list(members), numShards)
+    if numWorkers > 1 and len(shards) > 1:
+        with ProcessPoolExecutor(max_workers=min(numWorkers, len(shards))) as executor:
+            futures = [executor.submit(processShard, path, shard, function) for shard in shards]
+            for future in futures:
+                yield from future.result()
+    else:
+        for shard in shards:
+            yield from processShard(path, shard, function)
+
+
+# The results of iterArchive as a dict keyed by member name
+def processArchive(path, function, numWorkers=1, members=None, numShards=None):
+    return dict(iterArchive(path, function, numWorkers, members, numShards))
+
+
+################################################################################################################################
+# Functions to run on archive members
+################################################################################################################################
+
+# The feature matrix of a member (see featureAnalysis.extractFeaturesMidi; options are passed on)
+def extractFeatures(member, sampleRate=10, **options):
+    return analysis.extractFeaturesMidi(member, sampleRate, **options)
+
+
+# The spiral array tension analysis of a member as a tension_calculation.TensionResult
+def analyzeTension(member, windowSize=-1, endRatio=.5, keyChanged=False, verticalStep=0.4, keyName=''):
+    context = tc.AnalysisContext(vertical_step=verticalStep, window_size=windowSize, end_ratio=endRatio, key_changed=keyChanged)
+    return context.analyze_file(member, keyName)
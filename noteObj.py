@@ -2,6 +2,7 @@
 # symbolic/MIDI music data in a more easier and more intuitive way
 
 import music21
+import numpy as np
 import dissonance as diss
 
 SIXTEENTH = .25
@@ -179,3 +180,144 @@ def getDissonance(onsetsAll):
     return dissonanceVals
 
     
+
+
+################################################################################################################################
+# Interval index of sounding notes
+################################################################################################################################
+
+LOUDNESS_SCALE_FACTOR = .1 # as in getLoudness: notes other than the loudest one are scaled down
+SWEEP_CHUNK = 1024 # events per block of the sweep (each block holds events x 128 count matrices)
+
+# Interval class (0-11, as in dissonance.calculateChordDissonance12tet) of every pair of MIDI pitches, and the
+# dissonance of each class
+pitchPairClasses = np.abs(np.subtract.outer(np.arange(128), np.arange(128))) % 12
+intervalClassDissonance = np.array([diss.intervalDissonance[interval] for interval in range(12)])
+
+# An index of the time intervals during which each note sounds (onset <= t < endTime), for answering "what is sounding
+# at time t" for many times at once.  The note start and end events are sorted once and swept in order, recording the
+# number of sounding notes, the dissonance of all sounding pitches and the sustained loudness after each event; a
+# batch of query times is then answered with a binary search in the event times, so the cost is O((n + q) log n).
+class NoteIndex:
+    def __init__(self, onsets, endTimes, pitches, velocities):
+        self.onsets = np.asarray(onsets, dtype=float)
+        self.endTimes = np.asarray(endTimes, dtype=float)
+        self.pitches = np.asarray(pitches, dtype=int)
+        self.velocities = np.asarray(velocities, dtype=int)
+
+        # Events sorted by time; at the same time note ends come first, except for the ends of notes with no duration
+        numNotes = len(self.onsets)
+        times = np.concatenate((self.endTimes, self.onsets))
+        eventOrder = np.concatenate((np.where(self.endTimes > self.onsets, 0, 2), np.ones(numNotes, dtype=int)))
+        order = np.lexsort((eventOrder, times))
+        self.eventTimes = times[order]
+        self.eventIsStart = eventOrder[order] == 1
+        self.eventNotes = order % numNotes if numNotes > 0 else order
+
+        self.sweep()
+
+    # State of the sounding notes after each event.  The counts of each pitch and velocity after each event are running
+    # sums of +-1 steps, built a block of events at a time (with a column for each pitch and velocity that occurs).  The
+    # dissonance comes from the number of sounding pairs in each interval class, which is also an integer running sum
+    # (a note start or end adds or removes its pairs with the other sounding notes), so it doesn't drift over long pieces.
+    def sweep(self):
+        numEvents = len(self.eventTimes)
+        steps = np.where(self.eventIsStart, 1, -1)
+        usedPitches, eventPitches = np.unique(self.pitches[self.eventNotes], return_inverse=True)
+        usedVelocities, eventVelocities = np.unique(self.velocities[self.eventNotes], return_inverse=True)
+        pairClasses = pitchPairClasses[np.ix_(usedPitches, usedPitches)]
+        self.countAfter = np.cumsum(steps)
+        self.dissonanceAfter = np.zeros(numEvents)
+        self.loudnessAfter = np.zeros(numEvents)
+
+        pitchCounts = np.zeros(len(usedPitches), dtype=np.int32)
+        velocityCounts = np.zeros(len(usedVelocities), dtype=np.int32)
+        pairCounts = np.zeros(12, dtype=int)
+        for first in range(0, numEvents, SWEEP_CHUNK):
+            last = min(first + SWEEP_CHUNK, numEvents)
+            rows = np.arange(last - first)
+            blockSteps = steps[first:last]
+            blockPitches = eventPitches[first:last]
+
+            pitchSteps = np.zeros((last - first, len(usedPitches)), dtype=np.int32)
+            pitchSteps[rows, blockPitches] = blockSteps
+            pitchCountsAfter = pitchCounts + np.cumsum(pitchSteps, axis=0, dtype=np.int32)
+            # The other sounding notes: those after an end event, those before a start event
+            others = pitchCountsAfter - np.maximum(pitchSteps, 0)
+            # Pairs of the event's note with the others, by interval class
+            pairBins = (rows[:, None] * 12 + pairClasses[blockPitches]).ravel()
+            pairs = np.bincount(pairBins, weights=others.ravel(), minlength=(last - first) * 12).reshape(-1, 12)
+            pairCountsAfter = pairCounts + np.cumsum(pairs.astype(int) * blockSteps[:, None], axis=0)
+            self.dissonanceAfter[first:last] = pairCountsAfter @ intervalClassDissonance
+
+            velocitySteps = np.zeros((last - first, len(usedVelocities)), dtype=np.int32)
+            velocitySteps[rows, eventVelocities[first:last]] = blockSteps
+            velocityCountsAfter = velocityCounts + np.cumsum(velocitySteps, axis=0, dtype=np.int32)
+            # The loudest velocity is the highest one with a non-zero count (0 if nothing sounds)
+            sounding = velocityCountsAfter > 0
+            loudestColumn = len(usedVelocities) - 1 - np.argmax(sounding[:, ::-1], axis=1)
+            loudest = np.where(sounding.any(axis=1), usedVelocities[loudestColumn], 0)
+            velocitySum = velocityCountsAfter @ usedVelocities
+            self.loudnessAfter[first:last] = loudest + LOUDNESS_SCALE_FACTOR * (velocitySum - loudest)
+
+            pitchCounts = pitchCountsAfter[-1]
+            velocityCounts = velocityCountsAfter[-1]
+            pairCounts = pairCountsAfter[-1]
+
+    # Index of the last event at or before each query time (-1 before the first event)
+    def lastEvent(self, times):
+        return np.searchsorted(self.eventTimes, np.asarray(times, dtype=float), side='right') - 1
+
+    def stateAt(self, stateAfter, times):
+        lastEvent = self.lastEvent(times)
+        return np.where(lastEvent >= 0, stateAfter[np.maximum(lastEvent, 0)], 0)
+
+    # A state as a step function, in the (event times, event values, value before the first event) form of
+    # featureAnalysis.rasterizeEvents: the state after the last event at each distinct event time
+    def stateEvents(self, stateAfter):
+        times = np.unique(self.eventTimes)
+        return times, self.stateAt(stateAfter, times).astype(float), 0
+
+    # Number of notes sounding at each time (texture density)
+    def textureDensity(self, times):
+        return self.stateAt(self.countAfter, times)
+
+    # Dissonance of all notes sounding at each time, including held notes
+    def soundingDissonance(self, times):
+        return self.stateAt(self.dissonanceAfter, times)
+
+    # Loudness of all notes sounding at each time: the loudest velocity plus the other velocities scaled down
+    def sustainedLoudness(self, times):
+        return self.stateAt(self.loudnessAfter, times)
+
+    # The notes sounding at each of the query times, as (offsets, note indices): the notes sounding at times[i] are
+    # noteIndices[offsets[i]:offsets[i+1]] (indices into the arrays the index was built from)
+    def soundingNotes(self, times):
+        times = np.asarray(times, dtype=float)
+        queryOrder = np.argsort(times, kind='stable')
+        lastEvent = self.lastEvent(times[queryOrder])
+
+        sounding = {}
+        notesPerQuery = [None] * len(times)
+        e = 0
+        for q, last in zip(queryOrder, lastEvent):
+            while e <= last:
+                note = self.eventNotes[e]
+                if self.eventIsStart[e]:
+                    sounding[note] = True
+                else:
+                    del sounding[note]
+                e += 1
+            notesPerQuery[q] = list(sounding)
+
+        counts = np.array([len(notes) for notes in notesPerQuery], dtype=int)
+        offsets = np.concatenate(([0], np.cumsum(counts)))
+        noteIndices = np.array([note for notes in notesPerQuery for note in notes], dtype=int)
+        return offsets, noteIndices
+
+
+# NoteIndex of all notes in onsetsAll (dict keyed by onset time; the items are a list of noteObjs)
+def buildNoteIndex(onsetsAll):
+    notes = [note for noteList in onsetsAll.values() for note in noteList]
+    return NoteIndex([note.onset for note in notes], [note.endTime for note in notes],
+                     [note.pitch for note in notes], [note.velocity for note in notes])
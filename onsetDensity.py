@@ -0,0 +1,57 @@
+# Onset density: a smooth onsets-per-second curve, as an alternative to the onset frequency feature
+#
+# The onset frequency feature is 1/(time to the previous onset), held until the next onset, so it spikes when two
+# onsets are very close together (e.g. the notes of a spread chord a few milliseconds apart).  Instead, the onsets are
+# counted on the sample grid with np.bincount (onsets closer together than chordTolerance count once) and the counts
+# are convolved with a perceptual window that looks back in time:
+#   boxcar:       the number of onsets in the last windowDur seconds, divided by windowDur (a cumulative sum)
+#   exponential:  onsets weighted by exp(-age/windowDur), scaled so that a steady rate gives that rate (a first order
+#                 recursive filter)
+# Both are O(samples + onsets) and give onsets per second.
+#
+# Example usage:
+#   density = onsetDensity.getOnsetDensity(onsetTimes, SAMPLE_RATE, totalSamples, windowDur=2, kernel=onsetDensity.EXPONENTIAL)
+
+import numpy as np
+from scipy import signal
+
+BOXCAR = "boxcar"
+EXPONENTIAL = "exponential"
+WINDOW_DUR = 1 # seconds
+CHORD_TOLERANCE = .03 # seconds; onsets closer together than this count as one onset
+
+
+# Onset times without the onsets that are less than tolerance after the previous onset (so a spread chord counts once)
+def mergeOnsets(onsetTimes, tolerance=CHORD_TOLERANCE):
+    onsetTimes = np.unique(np.asarray(onsetTimes, dtype=float))
+    keep = np.concatenate(([True], np.diff(onsetTimes) >= tolerance))
+    return onsetTimes[keep[:onsetTimes.size]]
+
+
+# Onsets per second at every sample
+def getOnsetDensity(onsetTimes, sampleRate, totalSamples, windowDur=WINDOW_DUR, kernel=BOXCAR, chordTolerance=CHORD_TOLERANCE):
+    if totalSamples <= 0:
+        return np.zeros(0)
+    onsetTimes = mergeOnsets(onsetTimes, chordTolerance)
+    # An onset counts from the first sample at or after it (as the step function features do)
+    samples = np.ceil(np.round(onsetTimes * sampleRate, 6)).astype(int)
+    samples = samples[(samples >= 0) & (samples < totalSamples)]
+    counts = np.bincount(samples, minlength=totalSamples).astype(float)
+
+    if kernel == BOXCAR:
+        windowSamples = max(int(round(windowDur * sampleRate)), 1)
+        cumulative = np.concatenate(([0], np.cumsum(counts)))
+        k = np.arange(1, totalSamples + 1)
+        return (cumulative[k] - cumulative[np.maximum(k - windowSamples, 0)]) / (windowSamples / sampleRate)
+    elif kernel == EXPONENTIAL:
+        decay = np.exp(-1 / (windowDur * sampleRate))
+        return signal.lfilter([(1 - decay) * sampleRate], [1, -decay], counts)
+    raise ValueError('unknown onset density kernel %s' % kernel)
+
+
+# The onset density as step function events at every sample time (see featureAnalysis.getOnsetFreqEvents)
+def getOnsetDensityEvents(onsetTimes, sampleRate, totalSamples, windowDur=WINDOW_DUR, kernel=BOXCAR):
+    density = getOnsetDensity(onsetTimes, sampleRate, totalSamples, windowDur, kernel)
+    if density.size == 0:
+        return np.zeros(0), np.zeros(0), 0
+    return np.arange(1, totalSamples) / sampleRate, density[1:], density[0]
@@ -0,0 +1,443 @@
+# Real-time tension analysis of a stream of MIDI events, e.g. for live-concert visualizations
+#
+# Events are timestamped note-on/note-off/tempo messages (MidiEvent) coming from any iterator or from an asyncio
+# queue; replayMidiFile() reads a MIDI file and plays its events back at wall-clock speed in place of a device.
+# A RealtimeTracker keeps the state needed for each feature as the events come in - the current onset group (notes
+# starting within onsetTolerance of each other), the melodic line, loudness, dissonance, the tempo and a
+# duration-weighted pitch-class histogram plus the currently sounding notes for the harmonic tension - and emits a
+# feature frame at every sample on the model's grid together with the tension prediction.
+#
+# Differences from the offline analysis (featureAnalysis.extractFeaturesMidi + tensionModel.runModel):
+#   - the key is estimated from the pitch classes heard so far, and harmonic tension is the spiral array distance
+#     between the sounding notes and that key at each moment, instead of being computed in beat windows
+#   - a note's end time isn't known when it starts, so the melodic line checks whether the previous melody note is
+#     still sounding instead of comparing end times
+#   - features are normalized with running means and standard deviations, the prediction isn't normalized at the
+#     end and no lag is applied; otherwise the model stage is the same, run causally: each attentional window is
+#     processed as soon as its last sample has been emitted
+#   - with memoryHalfLife, the memory slope is exponentially weighted (see tensionModel.runModelFromSlopes), and only
+#     the last attentional window of the prediction is kept
+#
+# The tension of the latest sample is available right after each event (RealtimeTracker.current()), and the
+# latency of every event (from receiving it to having the updated frame) is recorded.
+#
+# Example usage:
+#   tracker = realtime.RealtimeTracker([2, 3, 3, 2, 1, 1])
+#   tracker.run(realtime.replayMidiFile("midi/Brahms.mid"), onFrame=lambda frame: print(frame.time, frame.tension))
+#   print(tracker.latencyPercentiles())
+
+import asyncio
+import math
+import time
+from collections import Counter
+import numpy as np
+import dissonance as diss
+import helperFunctions as hf
+import tonalTension
+import tension_calculation as tc
+
+NOTE_ON = 'note_on'
+NOTE_OFF = 'note_off'
+TEMPO = 'tempo'
+
+NUM_FEATURES = 6
+iOnsetFreq, iMelodicContour, iLoudness, iTempo, iHarmony, iDissonance = range(NUM_FEATURES)
+
+
+class MidiEvent:
+    # time: seconds since the start of the performance
+    # kind: NOTE_ON, NOTE_OFF or TEMPO; tempo is in beats per minute
+    # received: time.perf_counter() value when the event arrived (set by the source; used for latency measurement)
+    def __init__(self, time, kind, pitch=0, velocity=0, tempo=0, received=None):
+        self.time = time
+        self.kind = kind
+        self.pitch = pitch
+        self.velocity = velocity
+        self.tempo = tempo
+        self.received = received
+
+    def print(self):
+        print(self.time, self.kind, self.pitch, self.velocity, self.tempo)
+
+
+class FeatureFrame:
+    # features: the six raw (not normalized) feature values at this sample, in featureAnalysis order
+    # tension: the model output at this sample (provisional until the attentional windows covering it have passed)
+    def __init__(self, sampleIndex, time, features, tension):
+        self.sampleIndex = sampleIndex
+        self.time = time
+        self.features = features
+        self.tension = tension
+
+
+################################################################################################################################
+# Event sources
+################################################################################################################################
+
+# All events of a MIDI file (drum tracks excluded), sorted by time; at the same time note-offs come first
+def midiFileEvents(inputFile):
+    pm = tc.read_midi(inputFile)
+    events = []
+    for instrument in pm.instruments:
+        if instrument.is_drum:
+            continue
+        for note in instrument.notes:
+            events.append(MidiEvent(note.start, NOTE_ON, note.pitch, note.velocity))
+            events.append(MidiEvent(note.end, NOTE_OFF, note.pitch))
+    tempoTimes, tempos = pm.get_tempo_changes()
+    for tempoTime, tempo in zip(tempoTimes, tempos):
+        events.append(MidiEvent(tempoTime, TEMPO, tempo=tempo))
+
+    order = {TEMPO: 0, NOTE_OFF: 1, NOTE_ON: 2}
+    events.sort(key=lambda event: (event.time, order[event.kind]))
+    return events
+
+
+# Play back the events of a MIDI file in real time (speed > 1 plays faster); each event is yielded when it is due
+def replayMidiFile(inputFile, speed=1):
+    events = midiFileEvents(inputFile)
+    start = time.perf_counter()
+    for event in events:
+        delay = start + event.time/speed - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+        event.received = time.perf_counter()
+        yield event
+
+
+# The same as replayMidiFile, but puts the events into an asyncio queue, followed by None at the end
+async def replayToQueue(inputFile, queue, speed=1):
+    events = midiFileEvents(inputFile)
+    loop = asyncio.get_running_loop()
+    start = loop.time()
+    for event in events:
+        delay = start + event.time/speed - loop.time()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        event.received = time.perf_counter()
+        await queue.put(event)
+    await queue.put(None)
+
+
+################################################################################################################################
+# Tracker
+################################################################################################################################
+
+class RealtimeTracker:
+    def __init__(self, featureWeights, sampleRate=10, memoryWindowDur=3, attentionalWindowDur=3, windowShift=.25,
+                 memoryWeight=5, initSlope=1, sliderOnset=True, onsetTolerance=.01, memoryHalfLife=None):
+        self.featureWeights = featureWeights
+        self.sampleRate = sampleRate
+        self.memoryWindowDur = memoryWindowDur if memoryHalfLife is None else memoryHalfLife
+        self.memoryHalfLife = memoryHalfLife
+        self.memoryWeight = memoryWeight
+        self.initSlope = initSlope
+        self.sliderOnset = sliderOnset
+        # Notes starting within this many seconds of the first note of an onset group belong to that group
+        self.onsetTolerance = onsetTolerance
+
+        # Model parameters (see tensionModel.runModelFromSlopes)
+        self.samplesPerAttentionalWindow = hf.normal_round(attentionalWindowDur * sampleRate)
+        self.shift = max(hf.normal_round(windowShift * sampleRate), 1)
+        self.samplesPerMemoryWindow = hf.normal_round(memoryWindowDur * sampleRate) if memoryHalfLife is None else 0
+        self.startWindowDur = 2 * sampleRate
+        absoluteValsofWeights = [int(math.fabs(ele)) for ele in featureWeights]
+        scaleWeightFactor = sum(absoluteValsofWeights)
+        self.weights = np.array(featureWeights)/scaleWeightFactor
+        self.initialSliderMovementSlope = .25/scaleWeightFactor
+
+        # Key positions of the spiral array, computed once per key name
+        self.keyPositions = {}
+        self.latencies = []
+        self.reset()
+
+    def reset(self):
+        self.time = 0
+        self.nextSample = 0
+
+        # Onset groups and note state
+        self.activeNotes = Counter() # pitch -> number of sounding notes with that pitch
+        self.groupOnset = None
+        self.groupPitches = []
+        self.groupVelocities = []
+        self.prevGroupOnset = None
+        self.melodyPitch = -1
+        self.melodySounding = False
+        self.melodyBeforeGroup = (-1, False)
+        self.pitchClassHistogram = np.zeros(12)
+
+        # Current feature values
+        self.values = np.zeros(NUM_FEATURES)
+        self.values[iTempo] = 120 # default MIDI tempo
+        self.melodyStarted = False
+
+        # Running mean/variance of each feature (Welford's algorithm)
+        self.count = np.zeros(NUM_FEATURES)
+        self.mean = np.zeros(NUM_FEATURES)
+        self.m2 = np.zeros(NUM_FEATURES)
+        self.leadingMelodyFrames = 0
+
+        # The last attentional window of raw feature frames
+        self.window = np.zeros((NUM_FEATURES, self.samplesPerAttentionalWindow))
+        # Prediction line; prediction[j] is the value of sample predictionBase + j
+        self.prediction = np.zeros(0)
+        self.predictionBase = 0
+        self.predictionLen = 0
+        self.slopeTotal = 0
+        self.prevSlope = self.initSlope
+        if self.memoryHalfLife is not None and self.memoryHalfLife > 0:
+            self.exponentialMemory = hf.ExponentialSlope(self.memoryHalfLife * self.sampleRate)
+        self.memorySamples = 0 # the prediction before this sample has been added to exponentialMemory
+
+    ############################################################################################################################
+    # Event handling
+    ############################################################################################################################
+
+    # Process one event: emit the frames of the samples before it, then update the feature state.  onFrame is called
+    # with each emitted FeatureFrame.  Returns the list of emitted frames.
+    def process(self, event, onFrame=None):
+        received = event.received if event.received is not None else time.perf_counter()
+        frames = self.advance(event.time, onFrame)
+
+        if event.kind == NOTE_ON and event.velocity > 0:
+            self.noteOn(event.time, event.pitch, event.velocity)
+        elif event.kind == NOTE_ON or event.kind == NOTE_OFF:
+            self.noteOff(event.pitch)
+        elif event.kind == TEMPO:
+            self.values[iTempo] = event.tempo
+        else:
+            print('unknown event type: %s' % event.kind)
+        self.values[iHarmony] = self.harmonicTension()
+
+        self.latencies.append(time.perf_counter() - received)
+        return frames
+
+    # Emit the frames of all samples before the given time (e.g. driven by a clock while no events arrive)
+    def advance(self, eventTime, onFrame=None):
+        frames = []
+        while self.nextSample / self.sampleRate < eventTime:
+            self.accumulateHistogram(self.nextSample / self.sampleRate)
+            frame = self.emitFrame()
+            frames.append(frame)
+            if onFrame is not None:
+                onFrame(frame)
+        self.accumulateHistogram(eventTime)
+        return frames
+
+    def noteOn(self, onset, pitch, velocity):
+        if self.groupOnset is None or onset - self.groupOnset > self.onsetTolerance:
+            # A new onset group; onset frequency is the inverse of the time since the previous group
+            if self.groupOnset is not None:
+                self.prevGroupOnset = self.groupOnset
+                self.values[iOnsetFreq] = 1/(onset - self.prevGroupOnset)
+            self.groupOnset = onset
+            self.groupPitches = []
+            self.groupVelocities = []
+            self.melodyBeforeGroup = (self.melodyPitch, self.melodySounding)
+
+        self.groupPitches.append(pitch)
+        self.groupVelocities.append(velocity)
+        self.activeNotes[pitch] += 1
+
+        # Loudness: the loudest note of the group plus the other notes scaled down (as in noteObj.getLoudness)
+        loudest = int(np.argmax(self.groupVelocities))
+        self.values[iLoudness] = sum(v if j == loudest else .1 * v for j, v in enumerate(self.groupVelocities))
+        self.values[iDissonance] = diss.calculateChordDissonance12tet(self.groupPitches)
+
+        # Melodic line: the highest note of the group is selected if the previous melody note is no longer sounding
+        # or if it's higher (as in noteObj.getMelodicLine); decided against the state before the group started
+        highest = max(self.groupPitches)
+        prevPitch, prevSounding = self.melodyBeforeGroup
+        if not prevSounding or highest > prevPitch:
+            self.melodyPitch = highest
+            self.melodySounding = True
+            self.values[iMelodicContour] = highest
+            if not self.melodyStarted:
+                self.startMelody(highest)
+
+    def noteOff(self, pitch):
+        if self.activeNotes[pitch] > 0:
+            self.activeNotes[pitch] -= 1
+        if self.activeNotes[pitch] == 0:
+            del self.activeNotes[pitch]
+            if pitch == self.melodyPitch:
+                self.melodySounding = False
+
+    # Until the first melody note the melodic contour is undefined; like featureAnalysis.fillLeadingZeros, the earlier
+    # samples (those still in the attentional window and in the running statistics) take the first pitch
+    def startMelody(self, pitch):
+        self.melodyStarted = True
+        numLeading = min(self.leadingMelodyFrames, self.samplesPerAttentionalWindow)
+        if numLeading > 0:
+            self.window[iMelodicContour, -numLeading:] = pitch
+        for _ in range(self.leadingMelodyFrames):
+            self.updateStats(iMelodicContour, pitch)
+
+    def accumulateHistogram(self, untilTime):
+        if untilTime > self.time:
+            for pitch, count in self.activeNotes.items():
+                self.pitchClassHistogram[pitch % 12] += count * (untilTime - self.time)
+            self.time = untilTime
+
+    # Spiral array distance between the centroid of the sounding notes and the key estimated from the pitch-class
+    # histogram so far (0 when nothing is sounding, as for silent windows in tension_calculation)
+    def harmonicTension(self):
+        if len(self.activeNotes) == 0 or self.pitchClassHistogram.sum() == 0:
+            return 0
+        keyNames = tonalTension.estimate_key_names_from_histogram(self.pitchClassHistogram)
+        keyName = Counter(keyNames).most_common(1)[0][0]
+        if keyName not in self.keyPositions:
+            self.keyPositions[keyName] = tc.key_position_and_shift(keyName)
+        keyPos, keyShift = self.keyPositions[keyName]
+        roll = np.zeros(128)
+        for pitch in self.activeNotes:
+            roll[pitch] = 1
+        return np.linalg.norm(tc.notes_to_ce(roll, keyShift) - keyPos)
+
+    ############################################################################################################################
+    # Frames and model
+    ############################################################################################################################
+
+    def updateStats(self, row, value):
+        self.count[row] += 1
+        delta = value - self.mean[row]
+        self.mean[row] += delta / self.count[row]
+        self.m2[row] += delta * (value - self.mean[row])
+
+    def emitFrame(self):
+        k = self.nextSample
+        self.nextSample += 1
+        values = self.values.copy()
+
+        self.window = np.roll(self.window, -1, axis=1)
+        self.window[:, -1] = values
+        for row in range(NUM_FEATURES):
+            if row == iMelodicContour and not self.melodyStarted:
+                self.leadingMelodyFrames += 1
+            else:
+                self.updateStats(row, values[row])
+
+        # Windows end at samples 1, 1 + shift, 1 + 2*shift, ... (see tensionModel.getWindowGeometry)
+        if k >= 1 and (k - 1) % self.shift == 0:
+            self.processWindow(k)
+
+        return FeatureFrame(k, k / self.sampleRate, values, self.tensionAt(k))
+
+    # Model output at sample k: the prediction line if it reaches k, otherwise extended with the latest slope
+    def tensionAt(self, k):
+        last = self.predictionBase + self.predictionLen - 1
+        if self.predictionLen == 0:
+            return 0
+        if k <= last:
+            return self.prediction[k - self.predictionBase]
+        return self.prediction[self.predictionLen - 1] + self.slopeTotal * (k - last)
+
+    # One step of tensionModel.runModelFromSlopes for the attentional window ending at sample endpt
+    def processWindow(self, endpt):
+        i = endpt - self.samplesPerAttentionalWindow + 1
+        startpt = max(i, 0)
+        n = endpt - startpt + 1
+
+        # Slopes of the normalized features: the raw slopes divided by the running standard deviations
+        stdev = np.sqrt(np.divide(self.m2, self.count, out=np.zeros(NUM_FEATURES), where=self.count > 0))
+        x = np.arange(n) - (n - 1)/2
+        rawSlopes = self.window[:, -n:] @ x / (x @ x)
+        slopes = np.divide(rawSlopes, stdev, out=np.zeros(NUM_FEATURES), where=stdev > 0)
+
+        memoryWindowActive = False
+        if self.memoryWindowDur > 0:
+            memEnd = startpt - 1
+            memStart = max(memEnd - self.samplesPerMemoryWindow + 1, 0)
+            memoryWindowActive = memEnd >= 3
+            if memoryWindowActive and self.memoryHalfLife is not None:
+                self.exponentialMemory.update(self.prediction[self.memorySamples - self.predictionBase:startpt - self.predictionBase])
+                self.memorySamples = startpt
+                self.prevSlope = self.exponentialMemory.slope()
+            elif memoryWindowActive:
+                self.prevSlope = hf.linearSlope(self.prediction[memStart - self.predictionBase:memEnd + 1 - self.predictionBase])
+                if np.isnan(self.prevSlope):
+                    self.prevSlope = 0
+
+        if self.sliderOnset and i < self.startWindowDur:
+            slopeTotal = self.initialSliderMovementSlope
+        else:
+            slopeTotal = self.weights @ slopes
+
+        epsilon = .0001
+        decay = .001
+        if memoryWindowActive:
+            if -epsilon < slopeTotal < epsilon and -epsilon < self.prevSlope < epsilon:
+                slopeTotal = slopeTotal - decay
+            elif (slopeTotal > 0 and self.prevSlope > 0) or (slopeTotal < 0 and self.prevSlope < 0):
+                slopeTotal = slopeTotal * self.memoryWeight
+        self.slopeTotal = slopeTotal
+
+        # Merge the new line into the prediction (as in tensionModel.runModelFromSlopes)
+        y = slopeTotal * np.arange(n)
+        prediction = np.zeros(startpt + n - self.predictionBase)
+        prediction[:self.predictionLen] = self.prediction[:self.predictionLen]
+        start = startpt - self.predictionBase
+        if startpt == 0:
+            prediction[start:start + n] = y
+        else:
+            overlap = self.predictionLen - start
+            middle = (y[:overlap] + prediction[start:self.predictionLen])/2
+            if middle.size > 0:
+                middle = middle + prediction[start] - middle[0]
+            endChunk = y[len(middle):]
+            if endChunk.size > 0 and middle.size > 0:
+                endChunk = endChunk + middle[-1] - endChunk[0]
+            prediction[start:start + len(middle)] = middle
+            prediction[start + len(middle):start + n] = endChunk
+        self.predictionLen = start + n
+
+        # Only the memory window before the next attentional window is needed from here on (with the exponential
+        # memory, only the samples that haven't been added to it yet)
+        if self.memoryHalfLife is not None:
+            keepFrom = (self.memorySamples if self.memoryWindowDur > 0 else startpt) - self.predictionBase
+        else:
+            keepFrom = max(i + self.shift - self.samplesPerMemoryWindow - 1, 0) - self.predictionBase
+        if keepFrom > 0:
+            prediction = prediction[keepFrom:]
+            self.predictionBase += keepFrom
+            self.predictionLen -= keepFrom
+        self.prediction = prediction
+
+    # Feature values and tension right now (after the last processed event), without emitting a frame
+    def current(self):
+        return FeatureFrame(None, self.time, self.values.copy(), self.tensionAt(self.nextSample))
+
+    ############################################################################################################################
+    # Running
+    ############################################################################################################################
+
+    # Process all events of an iterator (e.g. replayMidiFile); onUpdate is called with current() after each event.
+    # The frames up to the last event are flushed at the end.
+    def run(self, events, onFrame=None, onUpdate=None):
+        for event in events:
+            self.process(event, onFrame)
+            if onUpdate is not None:
+                onUpdate(self.current())
+        self.finish(onFrame)
+
+    # The same as run, for events from an asyncio queue; None in the queue ends the stream
+    async def runQueue(self, queue, onFrame=None, onUpdate=None):
+        while True:
+            event = await queue.get()
+            if event is None:
+                break
+            self.process(event, onFrame)
+            if onUpdate is not None:
+                onUpdate(self.current())
+        self.finish(onFrame)
+
+    # Emit the frames up to and including the time of the last event
+    def finish(self, onFrame=None):
+        return self.advance(self.time + .5/self.sampleRate, onFrame)
+
+    # Per-event latency percentiles in milliseconds
+    def latencyPercentiles(self, percentiles=(50, 90, 99, 100)):
+        if len(self.latencies) == 0:
+            return {}
+        values = np.percentile(np.array(self.latencies) * 1000, percentiles)
+        return {p: v for p, v in zip(percentiles, values)}
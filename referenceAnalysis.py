@@ -0,0 +1,580 @@
+# Frozen reference implementation of the feature extraction and the spiral array tension, for equivalence.py
+#
+# These are copies of the plain Python code the published results were produced with: featureAnalysis.extractFeaturesMidi
+# with the note helpers of noteObj and dissonance, and tension_calculation.cal_tension with the spiral array functions
+# it calls (with the module globals verticalStep, radius, weight, alpha and beta at their default values).  They only
+# depend on music21, pretty_midi and noteObj.NoteObj, so optimizing the live modules can't change them: the golden
+# outputs of equivalence.py always come from the same code.  Don't optimize or restyle this file.
+#
+# The copies are trimmed to what the golden cases run: cal_tension without output files and messages (with the key found
+# among all keys), and the harmony feature with its fixed parameters (2 beat windows, end ratio 1).
+#
+# Example usage:
+#   features = referenceAnalysis.extractFeaturesMidi("midi/Brahms.mid", 10)
+#   total_tension, diameters, centroid_diff, key_name, times = referenceAnalysis.calTensionFile("midi/Brahms.mid", 2, 1)
+
+import copy
+import itertools
+import music21
+import numpy as np
+import pretty_midi
+from noteObj import NoteObj
+
+NUM_FEATURES = 6
+iOnsetFreq = 0
+iMelodicContour = 1
+iLoudness = 2
+iTempo = 3
+iHarmony = 4
+iDissonance = 5
+
+
+################################################################################################################################
+# Spiral array tension (tension_calculation)
+################################################################################################################################
+
+pitch_index_to_sharp_names = np.array(['C', 'C#', 'D', 'D#', 'E', 'F', 'F#', 'G',
+                                       'G#', 'A', 'A#', 'B'])
+
+pitch_index_to_flat_names = np.array(['C', 'D-', 'D', 'E-', 'E', 'F', 'G-', 'G',
+                                      'A-', 'A', 'B-', 'B'])
+
+pitch_name_to_pitch_index = {"G-": -6, "D-": -5, "A-": -4, "E-": -3,
+                             "B-": -2, "F": -1, "C": 0, "G": 1, "D": 2, "A": 3,
+                             "E": 4, "B": 5, "F#": 6, "C#": 7, "G#": 8, "D#": 9,
+                             "A#": 10}
+
+pitch_index_to_pitch_name = {v: k for k, v in pitch_name_to_pitch_index.items()}
+
+valid_major = ["G-", "D-", "A-", "E-", "B-", "F", "C", "G", "D", "A", "E", "B"]
+
+valid_minor = ["E-", "B-", "F", "C", "G", "D", "A", "E", "B", "F#", "C#", "G#"]
+
+enharmonic_dict = {"F#": "G-", "C#": "D-", "G#": "A-", "D#": "E-", "A#": "B-"}
+enharmonic_reverse_dict = {v: k for k, v in enharmonic_dict.items()}
+
+all_key_names = ['C major', 'G major', 'D major', 'A major',
+                 'E major', 'B major', 'F major', 'B- major',
+                 'E- major', 'A- major', 'D- major', 'G- major',
+                 'A minor', 'E minor', 'B minor', 'F# minor',
+                 'C# minor', 'G# minor', 'D minor', 'G minor',
+                 'C minor', 'F minor', 'B- minor', 'E- minor',
+                 ]
+
+note_index_to_pitch_index = [0, -5, 2, -3, 4, -1, -6, 1, -4, 3, -2, 5]
+
+weight = np.array([0.536, 0.274, 0.19])
+alpha = 0.75
+beta = 0.75
+verticalStep = 0.4
+radius = 1.0
+
+
+def cal_diameter(piano_roll, key_index, key_change_beat=-1, changed_key_index=-1):
+    diameters = []
+    for i in range(0, piano_roll.shape[1]):
+        indices = []
+        for index, j in enumerate(piano_roll[:, i]):
+            if j > 0:
+                if i / 4 > key_change_beat and key_change_beat != -1:
+                    shifted_index = index % 12 - changed_key_index
+                    if shifted_index < 0:
+                        shifted_index += 12
+                else:
+                    shifted_index = index % 12 - key_index
+                    if shifted_index < 0:
+                        shifted_index += 12
+                indices.append(note_index_to_pitch_index[shifted_index])
+        diameters.append(largest_distance(indices))
+    return diameters
+
+
+def largest_distance(pitches):
+    if len(pitches) < 2:
+        return 0
+    diameter = 0
+    for pitch_pair in itertools.combinations(pitches, 2):
+        distance = np.linalg.norm(pitch_index_to_position(pitch_pair[0]) - pitch_index_to_position(pitch_pair[1]))
+        if distance > diameter:
+            diameter = distance
+    return diameter
+
+
+def piano_roll_to_ce(piano_roll, shift):
+    pitch_index = []
+    for i in range(0, piano_roll.shape[1]):
+        indices = []
+        for index, j in enumerate(piano_roll[:, i]):
+            if j > 0:
+                shifted_index = index % 12 - shift
+                if shifted_index < 0:
+                    shifted_index += 12
+                indices.append(note_index_to_pitch_index[shifted_index])
+        pitch_index.append(indices)
+    return ce_sum(pitch_index)
+
+
+def notes_to_ce(notes, shift):
+    indices = []
+    for index, j in enumerate(notes):
+        if j > 0:
+            shifted_index = index % 12 - shift
+            if shifted_index < 0:
+                shifted_index += 12
+            indices.append(note_index_to_pitch_index[shifted_index])
+
+    total = np.zeros(3)
+    count = 0
+    for index in indices:
+        total += pitch_index_to_position(index)
+        count += 1
+    if count != 0:
+        total /= count
+    return total
+
+
+def pitch_index_to_position(pitch_index):
+    c = pitch_index - (4 * (pitch_index // 4))
+    pos = np.array([0.0, 0.0, 0.0])
+    if c == 0:
+        pos[1] = radius
+    if c == 1:
+        pos[0] = radius
+    if c == 2:
+        pos[1] = -1*radius
+    if c == 3:
+        pos[0] = -1*radius
+    pos[2] = pitch_index * verticalStep
+    return np.array(pos)
+
+
+def ce_sum(indices):
+    total = np.zeros(3)
+    count = 0
+    for data in indices:
+        for pitch in data:
+            total += pitch_index_to_position(pitch)
+            count += 1
+    return total/count
+
+
+def major_triad_position(root_index):
+    root_pos = pitch_index_to_position(root_index)
+    fifth_pos = pitch_index_to_position(root_index + 1)
+    third_pos = pitch_index_to_position(root_index + 4)
+    return weight[0] * root_pos + weight[1] * fifth_pos + weight[2] * third_pos
+
+
+def minor_triad_position(root_index):
+    root_pos = pitch_index_to_position(root_index)
+    fifth_pos = pitch_index_to_position(root_index + 1)
+    third_pos = pitch_index_to_position(root_index - 3)
+    return weight[0] * root_pos + weight[1] * fifth_pos + weight[2] * third_pos
+
+
+def major_key_position(key_index):
+    root_triad_pos = major_triad_position(key_index)
+    fifth_triad_pos = major_triad_position(key_index + 1)
+    fourth_triad_pos = major_triad_position(key_index - 1)
+    return weight[0] * root_triad_pos + weight[1] * fifth_triad_pos + weight[2] * fourth_triad_pos
+
+
+def minor_key_position(key_index):
+    root_triad_pos = minor_triad_position(key_index)
+    fifth_index = key_index + 1
+    fourth_index = key_index - 1
+    major_fourth_triad_pos = major_triad_position(fourth_index)
+    minor_fourth_triad_pos = minor_triad_position(fourth_index)
+    major_fifth_triad_pos = major_triad_position(fifth_index)
+    minor_fifth_triad_pos = minor_triad_position(fifth_index)
+    return weight[0] * root_triad_pos + \
+        weight[1] * (alpha * major_fifth_triad_pos + (1-alpha) * minor_fifth_triad_pos) + \
+        weight[2] * (beta * minor_fourth_triad_pos + (1 - beta) * major_fourth_triad_pos)
+
+
+def cal_key(piano_roll, key_names, end_ratio=0.5):
+    end = int(piano_roll.shape[1] * end_ratio)
+    distances = []
+    key_positions = []
+    key_shifts = []
+    for name in key_names:
+        key = name.split()[0].upper()
+        mode = name.split()[1]
+        valid = valid_minor if mode == 'minor' else valid_major
+        if key not in valid:
+            if key in enharmonic_dict:
+                key = enharmonic_dict[key]
+            elif key in enharmonic_reverse_dict:
+                key = enharmonic_reverse_dict[key]
+        if key not in valid:
+            raise ValueError('no such key %s' % name)
+        key_index = pitch_name_to_pitch_index[key]
+
+        if mode == 'minor':
+            # all the minor key_pos is a minor
+            key_pos = minor_key_position(3)
+        else:
+            # all the major key_pos is C major
+            key_pos = major_key_position(0)
+        key_positions.append(key_pos)
+
+        if mode == 'minor':
+            key_index -= 3
+        key_shift_name = pitch_index_to_pitch_name[key_index]
+        if key_shift_name in pitch_index_to_sharp_names:
+            key_shift_for_ce = np.argwhere(pitch_index_to_sharp_names == key_shift_name)[0][0]
+        else:
+            key_shift_for_ce = np.argwhere(pitch_index_to_flat_names == key_shift_name)[0][0]
+        key_shifts.append(key_shift_for_ce)
+        ce = piano_roll_to_ce(piano_roll[:, :end], key_shift_for_ce)
+        distances.append(np.linalg.norm(ce - key_pos))
+
+    index = np.argmin(np.array(distances))
+    return key_names[index], key_positions[index], key_shifts[index]
+
+
+def merge_tension(metric, beat_indices, down_beat_indices, window_size=-1):
+    new_metric = []
+    if window_size == -1:
+        for i in range(len(down_beat_indices)-1):
+            new_metric.append(np.mean(metric[down_beat_indices[i]:down_beat_indices[i+1]], axis=0))
+    else:
+        for i in range(0, len(beat_indices) - window_size, window_size):
+            new_metric.append(np.mean(metric[beat_indices[i]:beat_indices[i + window_size]], axis=0))
+    return np.array(new_metric)
+
+
+def cal_centroid(piano_roll, key_index, key_change_beat=-1, changed_key_index=-1):
+    centroids = []
+    for time_step in range(0, piano_roll.shape[1]):
+        roll = piano_roll[:, time_step]
+        if key_change_beat != -1:
+            if time_step / 4 > key_change_beat:
+                centroids.append(notes_to_ce(roll, changed_key_index))
+            else:
+                centroids.append(notes_to_ce(roll, key_index))
+        else:
+            centroids.append(notes_to_ce(roll, key_index))
+    return centroids
+
+
+def detect_key_change(key_diff, diameter, start_ratio=0.5):
+    # 8 bar window
+    key_diff_ratios = []
+    fill_one = False
+    for i in range(8, key_diff.shape[0]-8):
+        if fill_one and steps > 0:
+            key_diff_ratios.append(1)
+            steps -= 1
+            if steps == 0:
+                fill_one = False
+            continue
+
+        if np.any(key_diff[i-4:i]) and np.any(key_diff[i:i+4]):
+            previous = np.mean(key_diff[i-4:i])
+            current = np.mean(key_diff[i:i+4])
+            key_diff_ratios.append(current / previous)
+        else:
+            fill_one = True
+            steps = 4
+
+    for i in range(int(len(key_diff_ratios) * start_ratio), len(key_diff_ratios)-2):
+        if np.mean(key_diff_ratios[i:i+4]) > 2:
+            key_diff_change_bar = i
+            break
+    else:
+        key_diff_change_bar = -1
+    return key_diff_change_bar + 12 if key_diff_change_bar != -1 else key_diff_change_bar
+
+
+def get_key_index_change(pm, start_time, sixteenth_time):
+    new_pm = copy.deepcopy(pm)
+    for instrument in new_pm.instruments:
+        for i, note in enumerate(instrument.notes):
+            if note.start > start_time:
+                instrument.notes = instrument.notes[i:]
+                break
+    piano_roll = get_piano_roll(new_pm, sixteenth_time)
+    return cal_key(piano_roll, all_key_names, end_ratio=1)
+
+
+# cal_tension; returns total_tension, diameters, centroid_diff, key_name, times
+def cal_tension(piano_roll, sixteenth_time, beat_time, beat_indices, down_beat_time, down_beat_indices, pm, window_size=1,
+                key_names=all_key_names, end_ratio=.2, key_changed=True):
+    key_name, key_pos, note_shift = cal_key(piano_roll, key_names, end_ratio=end_ratio)
+    centroids = cal_centroid(piano_roll, note_shift, -1, -1)
+
+    if key_changed is True:
+        # use a bar window to detect key change
+        merged_centroids = merge_tension(centroids, beat_indices, down_beat_indices, window_size=-1)
+        silent = np.where(np.linalg.norm(merged_centroids, axis=-1) == 0)
+        merged_centroids = np.array(merged_centroids)
+        key_diff = merged_centroids - key_pos
+        key_diff = np.linalg.norm(key_diff, axis=-1)
+        key_diff[silent] = 0
+
+        diameters = cal_diameter(piano_roll, note_shift, -1, -1)
+        diameters = merge_tension(diameters, beat_indices, down_beat_indices, window_size=-1)
+
+        key_change_bar = detect_key_change(key_diff, diameters, start_ratio=end_ratio)
+        if key_change_bar != -1:
+            key_change_beat = np.argwhere(beat_time == down_beat_time[key_change_bar])[0][0]
+            change_time = down_beat_time[key_change_bar]
+            changed_key_name, changed_key_pos, changed_note_shift = get_key_index_change(pm, change_time, sixteenth_time)
+            if changed_key_name == key_name:
+                changed_note_shift = -1
+                key_change_beat = -1
+        else:
+            changed_note_shift = -1
+            key_change_beat = -1
+    else:
+        changed_note_shift = -1
+        key_change_beat = -1
+
+    centroids = cal_centroid(piano_roll, note_shift, key_change_beat, changed_note_shift)
+    merged_centroids = np.array(merge_tension(centroids, beat_indices, down_beat_indices, window_size=window_size))
+    silent = np.where(np.linalg.norm(merged_centroids, axis=-1) < 0.1)
+
+    if window_size == -1:
+        window_time = down_beat_time
+    else:
+        window_time = beat_time[::window_size]
+
+    if key_change_beat != -1:
+        key_diff = np.zeros(merged_centroids.shape[0])
+        changed_step = int(key_change_beat / abs(window_size))
+        for step in range(merged_centroids.shape[0]):
+            if step < changed_step:
+                key_diff[step] = np.linalg.norm(merged_centroids[step] - key_pos)
+            else:
+                key_diff[step] = np.linalg.norm(merged_centroids[step] - changed_key_pos)
+    else:
+        key_diff = np.linalg.norm(merged_centroids - key_pos, axis=-1)
+    key_diff[silent] = 0
+
+    diameters = cal_diameter(piano_roll, note_shift, key_change_beat, changed_note_shift)
+    diameters = merge_tension(diameters, beat_indices, down_beat_indices, window_size)
+    diameters[silent] = 0
+
+    centroid_diff = np.diff(merged_centroids, axis=0)
+    np.nan_to_num(centroid_diff, copy=False)
+    centroid_diff = np.linalg.norm(centroid_diff, axis=-1)
+    centroid_diff = np.insert(centroid_diff, 0, 0)
+
+    total_tension = key_diff
+    times = window_time[:len(total_tension)]
+    return total_tension, diameters, centroid_diff, key_name, times
+
+
+def get_piano_roll(pm, beat_times):
+    piano_roll = pm.get_piano_roll(times=beat_times)
+    np.nan_to_num(piano_roll, copy=False)
+    piano_roll = piano_roll > 0
+    return piano_roll.astype(int)
+
+
+def remove_drum_track(pm):
+    instrument_idx = []
+    for idx in range(len(pm.instruments)):
+        if pm.instruments[idx].is_drum:
+            instrument_idx.append(idx)
+    for idx in instrument_idx[::-1]:
+        del pm.instruments[idx]
+    return pm
+
+
+def get_beat_time(pm, beat_division=4):
+    beats = pm.get_beats()
+    beats = np.unique(beats, axis=0)
+
+    divided_beats = []
+    for i in range(len(beats) - 1):
+        for j in range(beat_division):
+            divided_beats.append((beats[i + 1] - beats[i]) / beat_division * j + beats[i])
+    divided_beats.append(beats[-1])
+    divided_beats = np.unique(divided_beats, axis=0)
+
+    beat_indices = []
+    for beat in beats:
+        beat_indices.append(np.argwhere(divided_beats == beat)[0][0])
+
+    down_beats = pm.get_downbeats()
+    if divided_beats[-1] > down_beats[-1]:
+        down_beats = np.append(down_beats, down_beats[-1] - down_beats[-2] + down_beats[-1])
+    down_beats = np.unique(down_beats, axis=0)
+
+    down_beat_indices = []
+    for down_beat in down_beats:
+        down_beat_indices.append(np.argmin(np.abs(down_beat - divided_beats)))
+
+    return np.array(divided_beats), np.array(beats), np.array(down_beats), beat_indices, down_beat_indices
+
+
+# extract_notes and cal_tension (all tracks, the key found among all keys) for a MIDI file
+def calTensionFile(fileName, windowSize, endRatio, keyChanged=False):
+    pm = remove_drum_track(pretty_midi.PrettyMIDI(fileName))
+    sixteenth_time, beat_time, down_beat_time, beat_indices, down_beat_indices = get_beat_time(pm, beat_division=4)
+    piano_roll = get_piano_roll(pm, sixteenth_time)
+    return cal_tension(piano_roll, sixteenth_time, beat_time, beat_indices, down_beat_time, down_beat_indices, pm, windowSize,
+                       all_key_names, endRatio, keyChanged)
+
+
+################################################################################################################################
+# Note helpers (noteObj, dissonance)
+################################################################################################################################
+
+intervalDissonance = {0 : 0, 1 : 0.85, 2 : 0.4, 3 : 0.255, 4 : 0.225, 5 : 0.15, 6 : 0.275, 7 : 0.075, 8 : 0.275, 9 : 0.175, 10 : 0.225, 11 : 0.4}
+
+
+def calculateChordDissonance12tet(notes):
+    numNotes = len(notes)
+    totalDissonance = 0
+    for i in range(0,numNotes):
+        for j in range(i+1,numNotes):
+            totalDissonance += intervalDissonance[(abs(notes[i] - notes[j])) % 12]
+    return totalDissonance
+
+
+def returnNotes(offsetSeconds, element):
+    if isinstance(element, music21.note.Note):
+        return [NoteObj(offsetSeconds, offsetSeconds+element.seconds, element.pitch.midi, element.volume.velocity)]
+    noteList = []
+    for note in element.pitches:
+        noteList.append(NoteObj(offsetSeconds, offsetSeconds+element.seconds, note.midi, element.volume.velocity))
+    return noteList
+
+
+def getHighestVelocity(noteList):
+    currMax = -1
+    i = 0
+    for note in noteList:
+        if note.velocity > currMax:
+            currMax = note.velocity
+            index = i
+    return currMax, index
+
+
+def getHighestNote(noteList):
+    currMax = -1
+    pitch = -1
+    endTime = -1
+    for note in noteList:
+        if note.pitch > currMax:
+            pitch = note.pitch
+            endTime = note.endTime
+            currMax = note.pitch
+    return pitch, endTime
+
+
+def getMelodicLine(onsetsAll):
+    minOnsetDiff = .01 # 10ms buffer between notes when judging when a note on and note off overlap
+    prevPitch = -1
+    prevEndTime = -1
+    melodicLine = {}
+    for currOnset, noteList in onsetsAll.items():
+        currPitch, currEndTime = getHighestNote(noteList)
+        if prevEndTime - currOnset < minOnsetDiff or (prevEndTime > currOnset and currPitch > prevPitch):
+            melodicLine[currOnset] = currPitch
+            prevPitch = currPitch
+            prevEndTime = currEndTime
+    return melodicLine
+
+
+def getLoudness(onsetsAll):
+    SCALE_FACTOR = .1
+    loudness = {}
+    for currOnset, noteList in onsetsAll.items():
+        totalVelocity = 0
+        highestVelocity, index = getHighestVelocity(noteList)
+        for i in range(0, len(noteList)):
+            if i == index:
+                totalVelocity += noteList[i].velocity
+            else:
+                totalVelocity += SCALE_FACTOR * noteList[i].velocity
+        loudness[currOnset] = totalVelocity
+    return loudness
+
+
+def getDissonance(onsetsAll):
+    dissonanceVals = {}
+    for currOnset, noteList in onsetsAll.items():
+        dissonanceVals[currOnset] = calculateChordDissonance12tet([note.pitch for note in noteList])
+    return dissonanceVals
+
+
+################################################################################################################################
+# Feature extraction (featureAnalysis)
+################################################################################################################################
+
+# Fill features[row] from sampleIndex on with the value of the last event before each sample (the loops of
+# extractFeaturesMidi); returns the next sample index
+def fillEvents(features, row, sampleRate, eventTimes, eventValues, prevVal, totalSamples):
+    sampleIndex = 0
+    for eventTime, val in zip(eventTimes, eventValues):
+        currSampleTime = int(sampleIndex/sampleRate * 100000)
+        nextTime = int(eventTime * 100000)
+        while currSampleTime < nextTime:
+            features[row,sampleIndex] = prevVal
+            sampleIndex = sampleIndex + 1
+            currSampleTime = int(sampleIndex/sampleRate * 100000)
+        prevVal = val
+    while sampleIndex <= totalSamples - 1:
+        features[row,sampleIndex] = prevVal
+        sampleIndex = sampleIndex + 1
+
+
+def extractFeaturesMidi(inputFile, sampleRate=10):
+    score = music21.converter.parse(inputFile, quarterLengthDivisors=[256])
+    flatScore = score.flatten()
+
+    onsetsAll = {}
+    tempoChanges = {0 : [0, 120]}
+    for ele in flatScore.secondsMap:
+        element = ele['element']
+        offsetSeconds = ele['offsetSeconds']
+        if isinstance(element, music21.note.Note) or isinstance(element, music21.chord.Chord):
+            if offsetSeconds in onsetsAll.keys():
+                onsetsAll[offsetSeconds].extend(returnNotes(offsetSeconds, element))
+            else:
+                onsetsAll[offsetSeconds] = returnNotes(offsetSeconds, element)
+        elif isinstance(element, music21.tempo.MetronomeMark):
+            tempoChanges[offsetSeconds] = [offsetSeconds, element.number]
+
+    totalDuration = flatScore.seconds
+    if np.isnan(totalDuration):
+        totalDuration = flatScore.secondsMap[-1]["endTimeSeconds"]
+
+    totalSamples = int(totalDuration * sampleRate)
+    features = np.zeros((NUM_FEATURES,totalSamples))
+
+    # Onset frequency: the value of each onset is 1/(time since the previous onset), from the next onset on
+    onsetTimes = np.array(list(onsetsAll.keys()), dtype=float)
+    onsetFreq = np.concatenate([[0], 1/np.diff(onsetTimes)])
+    fillEvents(features, iOnsetFreq, sampleRate, onsetTimes[1:], onsetFreq[1:], onsetFreq[0], totalSamples)
+
+    # Melodic contour, with leading zeros replaced by the first pitch
+    highestPitches = getMelodicLine(onsetsAll)
+    fillEvents(features, iMelodicContour, sampleRate, list(highestPitches.keys()), list(highestPitches.values()), 0, totalSamples)
+    currIndex = 0
+    currMidiPitch = features[iMelodicContour,currIndex]
+    while currIndex < totalSamples - 1 and currMidiPitch == 0:
+        currIndex += 1
+        currMidiPitch = features[iMelodicContour,currIndex]
+    if currIndex != totalSamples - 1:
+        for i in range(0,currIndex):
+            features[iMelodicContour, i] = currMidiPitch
+
+    loudness = getLoudness(onsetsAll)
+    fillEvents(features, iLoudness, sampleRate, list(loudness.keys()), list(loudness.values()), 0, totalSamples)
+
+    fillEvents(features, iTempo, sampleRate, [val[0] for val in tempoChanges.values()], [val[1] for val in tempoChanges.values()],
+               0, totalSamples)
+
+    # Harmony: tonalTension.analyzeTonalTension(inputFile, "output", 2, 1, False, '')
+    harmonicTension, diameters, centroid_diff, key_name, times = calTensionFile(inputFile, 2, 1)
+    fillEvents(features, iHarmony, sampleRate, times[1:len(harmonicTension)], harmonicTension[1:], harmonicTension[0], totalSamples)
+
+    dissonanceVals = getDissonance(onsetsAll)
+    fillEvents(features, iDissonance, sampleRate, list(dissonanceVals.keys()), list(dissonanceVals.values()), 0, totalSamples)
+
+    return features
@@ -0,0 +1,248 @@
+# Loading continuous-response (slider) data from listening experiments as model targets
+#
+# Each participant's response to a stimulus is a log of (timestamp, slider value) rows with irregular timestamps,
+# stored as a CSV file (an optional header line, then one row per log entry; extra columns are ignored) or as a
+# .npy array of shape (entries x 2 or more).  loadResponses() reads the logs of all participants for one stimulus,
+# puts them in one (participants x samples) matrix on the model's sample grid (sample k is at time k/sampleRate, as
+# in featureAnalysis) and returns a ResponseSet.  The logs are read in a thread pool; the resampling is done for a
+# block of participants at a time with a single binary search over their concatenated logs.  With outputDir, the
+# matrix and its mask are .npy files opened as memory maps and each block is written straight into them, so studies
+# with thousands of participants don't have to fit in memory.
+#
+# Resampling: "hold" (the default) keeps each logged value until the next log entry, which is how a slider that only
+# logs changes behaves; "linear" interpolates between log entries.  After the last entry the slider keeps its value.
+# Samples before a participant's first entry, entries with NaN values, and (with maxGap) samples more than maxGap
+# seconds after the last entry are missing: they are NaN in the matrix and False in the mask.
+#
+# ResponseSet.target() is the mean (or median) over the participants, with samples that no participant covers
+# filled from the nearest covered sample, so it can be passed as the target of tensionModel.runModel or to
+# evaluation.evaluatePredictions.
+#
+# Example usage:
+#   responses = responseData.loadResponses(glob.glob("study/brahms/*.csv"), SAMPLE_RATE, len(features[0]))
+#   prediction = tensionModel.runModel(features, responses.target(), featureList, featureWeights, ...)
+#   results = evaluation.evaluatePredictions(prediction, responses.target(), SAMPLE_RATE)
+#
+#   study = responseData.loadStudy("study", SAMPLE_RATE, {"brahms": 1234, "morgengruss": 987}, outputDir="responses")
+
+import os
+import warnings
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+
+HOLD = "hold"
+LINEAR = "linear"
+MEAN = "mean"
+MEDIAN = "median"
+LOG_EXTENSIONS = (".csv", ".npy")
+DATA_SUFFIX = ".responses.npy"
+MASK_SUFFIX = ".mask.npy"
+# Number of samples (participants x samples) resampled at a time
+BLOCK_ELEMENTS = 1 << 18
+
+
+class ResponseSet:
+    # data: (participants x samples) matrix of slider values, NaN where missing; mask: True where data is valid
+    def __init__(self, data, mask, participantIds, sampleRate):
+        self.data = data
+        self.mask = mask
+        self.participantIds = participantIds
+        self.sampleRate = sampleRate
+
+    def numParticipants(self):
+        return self.data.shape[0]
+
+    def numPoints(self):
+        return self.data.shape[1]
+
+    # Number of participants with a valid value at each sample
+    def coverage(self):
+        return self.mask.sum(axis=0)
+
+    # Mean or median response over the participants.  Samples covered by fewer than minParticipants participants
+    # take the value of the nearest sample that is covered (unless fill is False, in which case they are NaN).
+    def target(self, statistic=MEAN, minParticipants=1, fill=True):
+        covered = self.coverage() >= max(minParticipants, 1)
+        target = np.full(self.numPoints(), np.nan)
+        if covered.any():
+            values = self.data[:, covered]
+            if statistic == MEAN:
+                target[covered] = np.nanmean(values, axis=0)
+            elif statistic == MEDIAN:
+                target[covered] = np.nanmedian(values, axis=0)
+            else:
+                raise ValueError('unknown statistic %s' % statistic)
+        if fill:
+            target = fillMissing(target[np.newaxis, :], covered[np.newaxis, :])[0]
+        return target
+
+    # Every participant's response with the missing samples filled from the nearest valid sample (for comparing
+    # predictions with the individual responses in evaluation.evaluatePredictions)
+    def filledResponses(self):
+        return fillMissing(self.data, self.mask)
+
+
+# Replace the values where valid is False by the nearest earlier valid value in the same row (or the first valid
+# value, before it).  Rows with no valid values become zeros.
+def fillMissing(data, valid):
+    data = np.asarray(data, dtype=float)
+    valid = np.asarray(valid, dtype=bool)
+    numPoints = data.shape[1]
+    positions = np.arange(numPoints)
+    previous = np.maximum.accumulate(np.where(valid, positions, -1), axis=1)
+    following = np.flip(np.minimum.accumulate(np.flip(np.where(valid, positions, numPoints), axis=1), axis=1), axis=1)
+    source = np.where(previous >= 0, previous, following)
+    anyValid = source < numPoints
+    rows = np.arange(data.shape[0])[:, np.newaxis]
+    return np.where(anyValid, data[rows, np.minimum(source, numPoints - 1)], 0)
+
+
+# Read one log as (timestamps, values)
+def readLog(fileName):
+    if fileName.endswith(".npy"):
+        log = np.load(fileName)
+    else:
+        with open(fileName) as fp:
+            firstLine = fp.readline()
+        # Skip a header line (any line with letters in it other than exponents and NaNs)
+        header = any(c.isalpha() for c in firstLine.lower().replace("nan", "").replace("e", ""))
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore") # empty logs
+            log = np.loadtxt(fileName, delimiter=",", skiprows=int(header), usecols=(0, 1), ndmin=2)
+    if log.ndim != 2 or log.shape[1] < 2:
+        raise ValueError('%s is not a log of (timestamp, value) rows' % fileName)
+    return log[:, 0].astype(float), log[:, 1].astype(float)
+
+
+# Read all logs in a thread pool.  Returns the participant index of every log entry, the timestamps and the values,
+# concatenated over all logs.
+def readLogs(fileNames, numThreads=8):
+    with ThreadPoolExecutor(max_workers=numThreads) as executor:
+        logs = list(executor.map(readLog, fileNames))
+    lengths = np.array([len(times) for times, values in logs], dtype=int)
+    participants = np.repeat(np.arange(len(logs)), lengths)
+    if len(logs) == 0:
+        return participants, np.zeros(0), np.zeros(0)
+    times = np.concatenate([times for times, values in logs])
+    values = np.concatenate([values for times, values in logs])
+    return participants, times, values
+
+
+# Resample the concatenated logs of numParticipants participants onto the sample grid (numPoints samples at
+# sampleRate).  Returns the (participants x samples) matrix (NaN where missing) and the mask.
+# timeOffset: seconds subtracted from the timestamps (e.g. the stimulus onset); timeScale converts the timestamps
+# to seconds (e.g. .001 for milliseconds).  The participants are resampled in blocks of rows of about BLOCK_ELEMENTS
+# samples, each written straight into out/outMask, so the temporary arrays don't grow with the number of participants.
+def resampleLogs(participants, times, values, numParticipants, sampleRate, numPoints, method=HOLD, timeOffset=0,
+                 timeScale=1, maxGap=None, out=None, outMask=None):
+    if method not in (HOLD, LINEAR):
+        raise ValueError('unknown resampling method %s' % method)
+    times = np.asarray(times, dtype=float) * timeScale - timeOffset
+    values = np.asarray(values, dtype=float)
+    participants = np.asarray(participants, dtype=int)
+    keep = ~np.isnan(times)
+    participants, times, values = participants[keep], times[keep], values[keep]
+
+    # Sort by participant, then time, and offset every participant's times by its own span so that one binary search
+    # finds the log entry of every participant at every sample
+    order = np.lexsort((times, participants))
+    participants, times, values = participants[order], times[order], values[order]
+    gridTimes = np.arange(numPoints) / sampleRate
+    origin = min(times.min() if times.size else 0, 0)
+    span = max(times.max() if times.size else 0, gridTimes[-1] if numPoints else 0) - origin + 1
+    keys = participants * span + (times - origin)
+
+    data = out if out is not None else np.empty((numParticipants, numPoints))
+    mask = outMask if outMask is not None else np.empty((numParticipants, numPoints), dtype=bool)
+    blockRows = max(BLOCK_ELEMENTS // max(numPoints, 1), 1)
+    for first in range(0, numParticipants, blockRows):
+        last = min(first + blockRows, numParticipants)
+        # the log entries of the block's participants are a contiguous slice of the sorted logs
+        start, end = np.searchsorted(participants, [first, last])
+        valid, resampled = resampleBlock(participants[start:end], times[start:end], values[start:end], keys[start:end],
+                                         np.arange(first, last), span, origin, gridTimes, method, maxGap)
+        data[first:last] = np.where(valid, resampled, np.nan)
+        mask[first:last] = valid
+    return data, mask
+
+
+# The mask and values of the participants in rows, given their sorted log entries (see resampleLogs)
+def resampleBlock(participants, times, values, keys, rows, span, origin, gridTimes, method, maxGap):
+    rows = rows[:, np.newaxis]
+    if len(keys) == 0:
+        return np.zeros((len(rows), len(gridTimes)), dtype=bool), np.full((len(rows), len(gridTimes)), np.nan)
+
+    index = np.searchsorted(keys, rows * span + (gridTimes - origin)[np.newaxis, :], side="right") - 1
+    clipped = np.clip(index, 0, len(keys) - 1)
+    valid = (index >= 0) & (participants[clipped] == rows)
+    resampled = values[clipped]
+    if method == LINEAR:
+        following = np.minimum(clipped + 1, len(keys) - 1)
+        interpolate = valid & (following != clipped) & (participants[following] == rows)
+        duration = times[following] - times[clipped]
+        fraction = np.divide(gridTimes[np.newaxis, :] - times[clipped], duration, out=np.zeros_like(duration),
+                             where=interpolate & (duration > 0))
+        # (only where interpolating, so that the next participant's first value can't leak in)
+        resampled = np.where(interpolate, resampled + fraction * (values[following] - resampled), resampled)
+    if maxGap is not None:
+        isLast = (clipped == len(keys) - 1) | (participants[np.minimum(clipped + 1, len(keys) - 1)] != rows)
+        valid &= ~(isLast & (gridTimes[np.newaxis, :] - times[clipped] > maxGap))
+    valid &= ~np.isnan(resampled)
+    return valid, resampled
+
+
+def participantId(fileName):
+    return os.path.splitext(os.path.basename(fileName))[0]
+
+
+# The responses of all participants to one stimulus, one log file per participant.  If outputDir is given, the
+# matrix and the mask are written to <outputDir>/<name>.responses.npy and .mask.npy and returned as memory maps.
+def loadResponses(fileNames, sampleRate, numPoints, method=HOLD, timeOffset=0, timeScale=1, maxGap=None, outputDir=None,
+                  name="responses", numThreads=8):
+    fileNames = sorted(fileNames)
+    participants, times, values = readLogs(fileNames, numThreads)
+    numParticipants = len(fileNames)
+
+    out = outMask = None
+    if outputDir is not None:
+        os.makedirs(outputDir, exist_ok=True)
+        out = np.lib.format.open_memmap(os.path.join(outputDir, name + DATA_SUFFIX), mode="w+", dtype=np.float64,
+                                        shape=(numParticipants, numPoints))
+        outMask = np.lib.format.open_memmap(os.path.join(outputDir, name + MASK_SUFFIX), mode="w+", dtype=bool,
+                                            shape=(numParticipants, numPoints))
+    data, mask = resampleLogs(participants, times, values, numParticipants, sampleRate, numPoints, method, timeOffset,
+                              timeScale, maxGap, out, outMask)
+    if outputDir is not None:
+        data.flush()
+        mask.flush()
+    return ResponseSet(data, mask, [participantId(fileName) for fileName in fileNames], sampleRate)
+
+
+# Open responses written by loadResponses(..., outputDir) as read-only memory maps
+def openResponses(outputDir, name, sampleRate, participantIds=None):
+    data = np.load(os.path.join(outputDir, name + DATA_SUFFIX), mmap_mode="r")
+    mask = np.load(os.path.join(outputDir, name + MASK_SUFFIX), mmap_mode="r")
+    if participantIds is None:
+        participantIds = [str(i) for i in range(data.shape[0])]
+    return ResponseSet(data, mask, participantIds, sampleRate)
+
+
+# All the responses of a study laid out as <studyDir>/<stimulus>/<participant>.csv (or .npy).  numPoints is the
+# number of model samples of each stimulus (a dict keyed by stimulus name, or one number for all of them).
+# Returns a dict of ResponseSets keyed by stimulus name.
+def loadStudy(studyDir, sampleRate, numPoints, method=HOLD, timeOffset=0, timeScale=1, maxGap=None, outputDir=None, numThreads=8):
+    study = {}
+    for stimulus in sorted(os.listdir(studyDir)):
+        stimulusDir = os.path.join(studyDir, stimulus)
+        if not os.path.isdir(stimulusDir):
+            continue
+        if isinstance(numPoints, dict):
+            if stimulus not in numPoints:
+                continue
+            stimulusPoints = numPoints[stimulus]
+        else:
+            stimulusPoints = numPoints
+        fileNames = [os.path.join(stimulusDir, fileName) for fileName in os.listdir(stimulusDir) if fileName.endswith(LOG_EXTENSIONS)]
+        study[stimulus] = loadResponses(fileNames, sampleRate, stimulusPoints, method, timeOffset, timeScale, maxGap,
+                                        outputDir, stimulus, numThreads)
+    return study
@@ -0,0 +1,181 @@
+# Columnar storage of analysis results (features, harmonic tension intermediates and predictions) for corpus runs
+#
+# A result dataset is a directory with a JSON schema (column name -> dtype) and one part directory per writer.
+# Each part holds one raw binary file per column, to which the values of every record (piece) are appended, and a
+# JSON index giving the offset and shape of each record in each column file.  Several processes can write to the
+# same dataset at the same time, each through its own ResultWriter (and so its own part), without any locking.
+# The index of a part is replaced atomically on flush(), so readers only ever see complete records.
+#
+# Reading maps the column files into memory (np.memmap), so getting a record is a zero-copy view without any
+# deserialization.
+#
+# Example usage:
+#   writer = resultStore.ResultWriter("results")
+#   writer.append("brahms", features=features, prediction=prediction, **resultStore.tonalTensionColumns(retvals))
+#   writer.close()
+#
+#   dataset = resultStore.ResultDataset("results")
+#   prediction = dataset.get("brahms", "prediction")
+
+import json
+import os
+import uuid
+import numpy as np
+
+SCHEMA_FILE = "schema.json"
+INDEX_FILE = "index.json"
+PART_PREFIX = "part-"
+COLUMN_SUFFIX = ".bin"
+
+# Columns of a dataset created without an explicit schema
+DEFAULT_SCHEMA = {"features": "float64",
+                  "prediction": "float64",
+                  "total_tension": "float64",
+                  "diameters": "float64",
+                  "centroid_diff": "float64",
+                  "times": "float64"}
+
+
+# The harmonic tension intermediates from tension_calculation.cal_tension (or tonalTension.getTonalTension) as columns
+def tonalTensionColumns(retvals):
+    total_tension, diameters, centroid_diff, key_name, key_change_time, key_change_bar, key_change_name, new_output_folder, times = retvals
+    return {"total_tension": total_tension, "diameters": diameters, "centroid_diff": centroid_diff, "times": times}
+
+
+# Write a JSON file by writing a temporary file and renaming it, so that readers never see a partly written file
+def writeJsonAtomic(path, data):
+    tempPath = "%s.%s.tmp" % (path, uuid.uuid4().hex)
+    with open(tempPath, "w") as fp:
+        json.dump(data, fp)
+    os.replace(tempPath, path)
+
+
+# Load the schema of a dataset, creating it if the dataset is new.  If the dataset exists, a given schema must match.
+def loadSchema(path, schema=None):
+    schemaPath = os.path.join(path, SCHEMA_FILE)
+    if not os.path.exists(schemaPath):
+        os.makedirs(path, exist_ok=True)
+        writeJsonAtomic(schemaPath, {"columns": schema if schema is not None else DEFAULT_SCHEMA})
+    with open(schemaPath) as fp:
+        columns = json.load(fp)["columns"]
+    if schema is not None and schema != columns:
+        raise ValueError("schema does not match the existing schema of %s" % path)
+    return columns
+
+
+class ResultWriter:
+    # writerId names the part this writer appends to; by default it's unique to the writer.  Reusing the id of an
+    # existing part appends to it (only one writer may use a given id at a time).
+    def __init__(self, path, schema=None, writerId=None):
+        self.path = path
+        self.schema = loadSchema(path, schema)
+        if writerId is None:
+            writerId = "%d-%s" % (os.getpid(), uuid.uuid4().hex[:8])
+        self.partPath = os.path.join(path, PART_PREFIX + str(writerId))
+        os.makedirs(self.partPath, exist_ok=True)
+
+        indexPath = os.path.join(self.partPath, INDEX_FILE)
+        self.records = {}
+        if os.path.exists(indexPath):
+            with open(indexPath) as fp:
+                self.records = json.load(fp)
+
+        self.files = {}
+        self.sizes = {}
+        for column, dtype in self.schema.items():
+            columnPath = os.path.join(self.partPath, column + COLUMN_SUFFIX)
+            self.files[column] = open(columnPath, "ab")
+            # Anything after the last indexed record (e.g. from a writer that didn't flush) is dropped
+            self.sizes[column] = self.indexedSize(column) * np.dtype(dtype).itemsize
+            self.files[column].truncate(self.sizes[column])
+
+    def indexedSize(self, column):
+        size = 0
+        for record in self.records.values():
+            if column in record:
+                offset, shape = record[column]
+                size = max(size, offset + int(np.prod(shape)))
+        return size
+
+    # Append the values of one record; columns is any subset of the schema's columns (each an array of any shape)
+    def append(self, recordId, **columns):
+        recordId = str(recordId)
+        if recordId in self.records:
+            raise ValueError("record %s is already in %s" % (recordId, self.partPath))
+        record = {}
+        for column, values in columns.items():
+            if column not in self.schema:
+                raise ValueError("column %s is not in the schema of %s" % (column, self.path))
+            dtype = np.dtype(self.schema[column])
+            values = np.ascontiguousarray(values, dtype=dtype)
+            record[column] = [self.sizes[column] // dtype.itemsize, list(values.shape)]
+            self.files[column].write(values.tobytes())
+            self.sizes[column] += values.nbytes
+        self.records[recordId] = record
+
+    # Make the records appended so far visible to readers
+    def flush(self):
+        for fp in self.files.values():
+            fp.flush()
+            os.fsync(fp.fileno())
+        writeJsonAtomic(os.path.join(self.partPath, INDEX_FILE), self.records)
+
+    def close(self):
+        if self.files:
+            self.flush()
+            for fp in self.files.values():
+                fp.close()
+            self.files = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class ResultDataset:
+    def __init__(self, path):
+        self.path = path
+        self.schema = loadSchema(path)
+        # record id -> (part name, {column: [offset, shape]})
+        self.records = {}
+        self.columns = {} # part name -> {column: memory-mapped column file}
+
+        for part in sorted(os.listdir(path)):
+            indexPath = os.path.join(path, part, INDEX_FILE)
+            if not part.startswith(PART_PREFIX) or not os.path.exists(indexPath):
+                continue
+            with open(indexPath) as fp:
+                partRecords = json.load(fp)
+            self.columns[part] = {}
+            for recordId, record in partRecords.items():
+                if recordId in self.records:
+                    raise ValueError("record %s is in both %s and %s" % (recordId, self.records[recordId][0], part))
+                self.records[recordId] = (part, record)
+
+    def recordIds(self):
+        return list(self.records.keys())
+
+    def columnFile(self, part, column):
+        if column not in self.columns[part]:
+            columnPath = os.path.join(self.path, part, column + COLUMN_SUFFIX)
+            self.columns[part][column] = np.memmap(columnPath, dtype=self.schema[column], mode="r")
+        return self.columns[part][column]
+
+    # Zero-copy, read-only view of one column of one record (None if the record has no value for the column)
+    def get(self, recordId, column):
+        part, record = self.records[str(recordId)]
+        if column not in record:
+            return None
+        offset, shape = record[column]
+        size = int(np.prod(shape))
+        if size == 0:
+            return np.zeros(shape, dtype=self.schema[column])
+        return self.columnFile(part, column)[offset:offset + size].reshape(shape)
+
+    # (record id, view) for every record that has a value for the column
+    def iterColumn(self, column):
+        for recordId, (part, record) in self.records.items():
+            if column in record:
+                yield recordId, self.get(recordId, column)
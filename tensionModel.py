@@ -16,20 +16,29 @@
 #   memoryWeight: weighted effect of memory window on attentional window (recommended value: 5)
 #   initSlope: initial starting slope (recommended: positive value)
 #   lag: for display/comparison purposes; the amount of lag in seconds, assumed for target
+#   outputDir: if given (with showFigures), the figures are written to PNG files in this directory instead of being shown
+#   memoryHalfLife: if given, the memory is an exponentially weighted slope of the prediction with this half-life in
+#                    seconds, instead of the slope of the last memoryWindowDur seconds (see runModelFromSlopes)
 
 import numpy as np
 import math
 import helperFunctions as hf
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 import matplotlib as mpl
 import matplotlib.pyplot as plt
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
 
 def runModel(features, target, featureList, featureWeights, memoryWindowDur, sampleRate, 
-                       attentionalWindowDur, windowShift, name, memoryWeight, initSlope, lag, sliderOnset=False, showFigures=False):
+                       attentionalWindowDur, windowShift, name, memoryWeight, initSlope, lag, sliderOnset=False, showFigures=False, outputDir=None,
+                       memoryHalfLife=None):
 
     predictionResult = []
     # Convert to numpy arrays
     target = np.array(target)
-    features = np.array(features)
+    features = np.asarray(features)
     
     error = False
     # error checking to make sure dimensions of arguments match
@@ -56,17 +65,154 @@ def runModel(features, target, featureList, featureWeights, memoryWindowDur, sam
     numPoints = len(features[0])
     numFeatures = len(featureWeights)
 
-# Loop the excerpt in attentionalWindowDuration chunks until the end is reached
-    samplesPerAttentionalWindow = hf.normal_round(sampleRate * attentionalWindowDur)
-    samplesPerMemoryWindow = hf.normal_round(memoryWindowDur * sampleRate)
+    # The per-feature window slopes don't depend on the weights, so they are computed first and then combined
+    slopeTensor = computeSlopeTensor(features, sampleRate, attentionalWindowDur, windowShift)
+    prediction = runModelFromSlopes(slopeTensor, featureWeights, memoryWindowDur, memoryWeight, initSlope, lag, sliderOnset,
+                                    memoryHalfLife)
 
-    # numWindows = ceil(numPoints/samplesPerAttentionalWindow);
-    prediction = []
-    endReached = False
+    if showFigures:
+        currName = name + '_result'
+        target = target.conj().transpose() 
+        # Graph prediction along with target (empirical data) if available for comparison
+        predictionFile = featuresFile = None
+        if outputDir is not None:
+            predictionFile = os.path.join(outputDir, os.path.basename(currName) + '.png')
+            featuresFile = os.path.join(outputDir, os.path.basename(name) + '_features.png')
+        graphPrediction(prediction, target, currName, sampleRate, numPoints, predictionFile)
+        graphFeatures(target, features, featureList, sampleRate, name, numPoints, numFeatures, featuresFile)
+
+    return prediction
+
+#############################################################################################################
+# The model is split into two stages: computeSlopeTensor() finds the slope of every feature in every attentional
+# window, which depends only on the features and the window geometry; runModelFromSlopes() applies the feature
+# weights, the memory window, the merging of the windowed lines and the lag.  The second stage is cheap, so a
+# SlopeTensor can be reused to try different weights or to leave features out (see runAblations()).
+#############################################################################################################
+
+class SlopeTensor:
+    # slopes: (features x windows) matrix of the least-squares slope of each feature in each attentional window
+    # windowIndices: the loop index i of each window (negative while the attentional window is still filling up)
+    # startpts, endpts: first and last sample of each window
+    def __init__(self, slopes, windowIndices, startpts, endpts, numPoints, sampleRate):
+        self.slopes = slopes
+        self.windowIndices = windowIndices
+        self.startpts = startpts
+        self.endpts = endpts
+        self.numPoints = numPoints
+        self.sampleRate = sampleRate
+
+
+# Start and end points of the attentional windows used by the model, in the order they are processed
+def getWindowGeometry(numPoints, sampleRate, attentionalWindowDur, windowShift):
+    samplesPerAttentionalWindow = hf.normal_round(sampleRate * attentionalWindowDur)
     shift = hf.normal_round(windowShift * sampleRate)
     if shift == 0:
        shift = 1
 
+    windowIndices = []
+    startpts = []
+    endpts = []
+    endReached = False
+    # Attentional window is minimally 2 samples in length (thus the initally index of -samplesPerAttentionalWindow+2)
+    for i in range(-samplesPerAttentionalWindow+2, numPoints, shift):
+        startpt = i
+        endpt = samplesPerAttentionalWindow + i - 1
+        # if near the end, the attentional window is smaller (and if the excerpt is shorter than the window, it
+        # starts at the beginning)
+        if numPoints - endpt <= 0:
+            endpt = numPoints - 1
+            if startpt < 0:
+                startpt = 0
+        # In the beginning when the attentional window is still less than designated duration
+        elif startpt < 0:
+            startpt = 0
+            if endpt < 1:
+                endpt = 1
+
+        if not endReached and endpt > startpt:
+            windowIndices.append(i)
+            startpts.append(startpt)
+            endpts.append(endpt)
+
+        if endpt == numPoints - 1:
+            endReached = True
+
+    return np.array(windowIndices, dtype=int), np.array(startpts, dtype=int), np.array(endpts, dtype=int)
+
+
+# Least-squares slopes of the rows of data over the samples startpts[w]..endpts[w] of each window w (x = 0, 1, 2, ...),
+# computed from running sums so that the cost doesn't depend on the window length
+def windowSlopes(cumY, cumKY, startpts, endpts):
+    sumY = cumY[:, endpts+1] - cumY[:, startpts]
+    sumKY = cumKY[:, endpts+1] - cumKY[:, startpts]
+    return slopesFromSums(sumY, sumKY, startpts, endpts)
+
+
+# The same, given the sums of the data and of sample index * data over each window
+def slopesFromSums(sumY, sumKY, startpts, endpts):
+    n = (endpts - startpts + 1).astype(float)
+    sumXY = sumKY - startpts * sumY
+    sumX = n * (n - 1) / 2
+    sumXX = (n - 1) * n * (2*n - 1) / 6
+    return (n * sumXY - sumX * sumY) / (n * sumXX - sumX * sumX)
+
+
+# Running sums of the rows of data and of sample index * data, each with a leading zero column
+def cumulativeStats(data):
+    data = np.atleast_2d(data)
+    k = np.arange(data.shape[1])
+    zeros = np.zeros((data.shape[0], 1))
+    cumY = np.concatenate((zeros, np.cumsum(data, axis=1)), axis=1)
+    cumKY = np.concatenate((zeros, np.cumsum(k * data, axis=1)), axis=1)
+    return cumY, cumKY
+
+
+def computeSlopeTensor(features, sampleRate, attentionalWindowDur, windowShift):
+    return computeSlopeTensors(features, sampleRate, [attentionalWindowDur], windowShift)[0]
+
+
+# Slope tensors for several attentional window durations; the running sums are computed once and shared
+def computeSlopeTensors(features, sampleRate, attentionalWindowDurs, windowShift):
+    features = np.atleast_2d(np.asarray(features, dtype=float))
+    numPoints = features.shape[1]
+
+    # Each feature is centred first; this doesn't change the slopes but keeps the running sums small
+    centred = features - np.nanmean(features, axis=1, keepdims=True) if numPoints > 0 else features.copy()
+    # NaN samples are left out of the running sums and counted instead, so that only the windows containing one get a
+    # NaN slope (as with a line fit to each window) rather than every window after it
+    nans = np.isnan(centred)
+    centred[nans] = 0
+    cumY, cumKY = cumulativeStats(centred)
+    cumNans = np.concatenate((np.zeros((nans.shape[0], 1), dtype=int), np.cumsum(nans, axis=1)), axis=1)
+
+    slopeTensors = []
+    for attentionalWindowDur in attentionalWindowDurs:
+        windowIndices, startpts, endpts = getWindowGeometry(numPoints, sampleRate, attentionalWindowDur, windowShift)
+        slopes = windowSlopes(cumY, cumKY, startpts, endpts)
+        slopes[cumNans[:, endpts+1] - cumNans[:, startpts] > 0] = np.nan
+
+        if np.isnan(slopes).any():
+            slopes[np.isnan(slopes)] = 0
+            print("WARNING: NAN in data!!")
+
+        slopeTensors.append(SlopeTensor(slopes, windowIndices, startpts, endpts, numPoints, sampleRate))
+    return slopeTensors
+
+
+# memoryHalfLife: if given (in seconds), the memory slope is an exponentially weighted slope of the whole prediction so
+# far, whose weights halve every memoryHalfLife seconds, instead of the slope of the last memoryWindowDur seconds.  It
+# is updated with the samples finalized since the previous window, so its cost doesn't depend on the memory length.
+def runModelFromSlopes(slopeTensor, featureWeights, memoryWindowDur, memoryWeight, initSlope, lag, sliderOnset=False,
+                       memoryHalfLife=None):
+    sampleRate = slopeTensor.sampleRate
+    numPoints = slopeTensor.numPoints
+    samplesPerMemoryWindow = hf.normal_round(memoryWindowDur * sampleRate)
+    if memoryHalfLife is not None:
+        memoryWindowDur = memoryHalfLife
+        exponentialMemory = hf.ExponentialSlope(memoryHalfLife * sampleRate) if memoryHalfLife > 0 else None
+        memorySamples = 0 # the samples before this have been added to exponentialMemory
+
     startWindowDur = 2 * sampleRate # two (one) seconds for the initial slider motion upwards
     prevSlope = initSlope
 
@@ -79,24 +225,18 @@ def runModel(features, target, featureList, featureWeights, memoryWindowDur, sam
     memoryMultiplier = memoryWeight
     memoryWindowActive = False
 
-    # Attentional window is minimally 2 samples in length (thus the initally index of -samplesPerAttentionalWindow+2)
-    for i in range(-samplesPerAttentionalWindow+2, numPoints, shift):
-        # find the start and end points of current window of time in question
-        startpt = i    
-        endpt = samplesPerAttentionalWindow + i - 1
-        x = np.array(range(0,samplesPerAttentionalWindow))
-        # if near the end, the attentional window is smaller
-        if numPoints - endpt <= 0:
-            endpt = numPoints - 1 
-            x = np.array(range(0, endpt - startpt + 1))
-        # In the beginning when the attentional window is still less than designated duration
-        elif startpt < 0:
-            startpt = 0
-            endpt = samplesPerAttentionalWindow + i - 1
-            if endpt < 1:
-                endpt = 1
-            x = np.array(range(0, endpt - startpt + 1))
-    
+    # The weighted slope of every attentional window
+    slopeTotals = weights @ slopeTensor.slopes
+
+    # The prediction is built up in place; predictionLen is the length of the prediction line so far
+    prediction = np.zeros(numPoints)
+    predictionLen = 0
+    for w in range(len(slopeTensor.startpts)):
+        i = slopeTensor.windowIndices[w]
+        startpt = slopeTensor.startpts[w]
+        endpt = slopeTensor.endpts[w]
+        x = np.arange(0, endpt - startpt + 1)
+
         # Find start and end points of memory window if applicable
         if memoryWindowDur > 0:
             memEnd = startpt - 1
@@ -107,82 +247,71 @@ def runModel(features, target, featureList, featureWeights, memoryWindowDur, sam
                 memoryWindowActive = True
             else:
                 memoryWindowActive = False
-     
-       
-        if not endReached and endpt > startpt:
-            # Get the parts of the feature graphs that correspond to the current window
-            currFeatures = features[:,startpt:endpt+1]
-  
-            # Find the slope and linear fit for each feature at current window in time
-            slopes = np.zeros(numFeatures)        
-            for j in range(0,numFeatures):
-                p = np.polyfit(x,currFeatures[j],1)
-                slopes[j] = p[0]
-                if np.isnan(slopes[j]):
-                    slopes[j] = 0
-                    print("WARNING: NAN in data!!")
-             
-            # Get the slopes of the memory windows, if there are any
-            if memoryWindowDur > 0 and memoryWindowActive:                
-                currMemoryWindowSamples = memEnd - memStart + 1
-                xMem = range(0,currMemoryWindowSamples)
-                p1 = np.polyfit(xMem,prediction[memStart:memEnd+1],1)
-                prevSlope = p1[0]
-                if np.isnan(prevSlope):
-                    prevSlope = 0
-
-            # Dealing with the intial slider movement upwards
-            if sliderOnset and i <  startWindowDur:
-                # hard coded slope value -- pretty steep
-                slopeTotal = initialSliderMovementSlope 
-            else:
-                slopeTotal = sum(weights * slopes)
-            
-            if np.isnan(slopeTotal):
-                print("NANs!!")
-
-            # If the trend in this window is same as the trend in the previous
-            # window (positive or negation) increase magnitude of predicted slope.
-            epsilon = .0001
-            decay = .001
-
-            if memoryWindowDur > 0 and memoryWindowActive:
-                # If there is no change in attentional slope (practically
-                # speaking) following no change in the memory window, add a
-                # decrease the slope of the attentional window slightly.
-                if slopeTotal < epsilon and slopeTotal > -epsilon and prevSlope < epsilon and prevSlope > -epsilon:
-                    slopeTotal = slopeTotal - decay
-                # if both attentional and memory windows are in the same
-                # direction, negative or positive, strengthen the attentional
-                # window slope in the current direction
-                elif (slopeTotal > 0 and prevSlope > 0) or (slopeTotal < 0 and prevSlope < 0):
-                    slopeTotal = slopeTotal * memoryMultiplier
-                            
-            # This is our new predicted line
-            y = slopeTotal * x
-
-            # Now add the current y to the overall prediction line
-            if startpt == 0:
-                prediction = y
-            # The middle is the part that needs to be averaged with the
+
+        # Get the slopes of the memory windows, if there are any
+        if memoryWindowDur > 0 and memoryWindowActive:
+            if memoryHalfLife is not None:
+                # The prediction before startpt won't change any more
+                exponentialMemory.update(prediction[memorySamples:startpt])
+                memorySamples = startpt
+                prevSlope = exponentialMemory.slope()
             else:
-                start = prediction[0:startpt] 
-                originalStartMergeVal = prediction[startpt]
-                middle = np.array(y[0:len(prediction)-startpt] + prediction[startpt:])/2  
+                prevSlope = hf.linearSlope(prediction[memStart:memEnd+1])
+            if np.isnan(prevSlope):
+                prevSlope = 0
 
-                if middle.size > 0:
-                    offset1 = originalStartMergeVal - middle[0]
-                    middle = middle + offset1
+        # Dealing with the intial slider movement upwards
+        if sliderOnset and i <  startWindowDur:
+            # hard coded slope value -- pretty steep
+            slopeTotal = initialSliderMovementSlope 
+        else:
+            slopeTotal = slopeTotals[w]
+        
+        if np.isnan(slopeTotal):
+            print("NANs!!")
 
-                endChunk = y[len(middle):]                
-                if endChunk.size > 0 and middle.size > 0:
-                    offset2 = middle[-1] - endChunk[0]
-                    endChunk = endChunk + offset2
+        # If the trend in this window is same as the trend in the previous
+        # window (positive or negation) increase magnitude of predicted slope.
+        epsilon = .0001
+        decay = .001
 
-                prediction = np.concatenate((start, middle, endChunk), axis=0)
-        
-        if endpt == numPoints - 1:
-            endReached = True
+        if memoryWindowDur > 0 and memoryWindowActive:
+            # If there is no change in attentional slope (practically
+            # speaking) following no change in the memory window, add a
+            # decrease the slope of the attentional window slightly.
+            if slopeTotal < epsilon and slopeTotal > -epsilon and prevSlope < epsilon and prevSlope > -epsilon:
+                slopeTotal = slopeTotal - decay
+            # if both attentional and memory windows are in the same
+            # direction, negative or positive, strengthen the attentional
+            # window slope in the current direction
+            elif (slopeTotal > 0 and prevSlope > 0) or (slopeTotal < 0 and prevSlope < 0):
+                slopeTotal = slopeTotal * memoryMultiplier
+                        
+        # This is our new predicted line
+        y = slopeTotal * x
+
+        # Now add the current y to the overall prediction line
+        if startpt == 0:
+            prediction[0:len(y)] = y
+        # The middle is the part that needs to be averaged with the
+        else:
+            originalStartMergeVal = prediction[startpt]
+            middle = np.array(y[0:predictionLen-startpt] + prediction[startpt:predictionLen])/2  
+
+            if middle.size > 0:
+                offset1 = originalStartMergeVal - middle[0]
+                middle = middle + offset1
+
+            endChunk = y[len(middle):]                
+            if endChunk.size > 0 and middle.size > 0:
+                offset2 = middle[-1] - endChunk[0]
+                endChunk = endChunk + offset2
+
+            prediction[startpt:startpt+len(middle)] = middle
+            prediction[startpt+len(middle):startpt+len(y)] = endChunk
+        predictionLen = startpt + len(y)
+
+    prediction = prediction[0:predictionLen]
 
     # Normalize prediction curve
     prediction = (prediction - np.mean(prediction))/np.std(prediction, ddof=1)
@@ -196,37 +325,94 @@ def runModel(features, target, featureList, featureWeights, memoryWindowDur, sam
         predictionLagged = np.concatenate((trim, predictionTrimmed), axis=0)
         prediction = predictionLagged
 
-    if showFigures:
-        currName = name + '_result'
-        target = target.conj().transpose() 
-        # Graph prediction along with target (empirical data) if available for comparison
-        graphPrediction(prediction, target, currName, sampleRate, numPoints)
-        graphFeatures(target, features, featureList, sampleRate, name, numPoints, numFeatures)
-
     return prediction
 
+
+# Predictions with all features and with each feature left out in turn, keyed by 'All' and by the name of the
+# feature that was left out.  The slope tensor is only computed once.
+def runAblations(features, featureList, featureWeights, memoryWindowDur, sampleRate, attentionalWindowDur, windowShift,
+                 memoryWeight, initSlope, lag, sliderOnset=False, slopeTensor=None, memoryHalfLife=None):
+    if slopeTensor is None:
+        slopeTensor = computeSlopeTensor(features, sampleRate, attentionalWindowDur, windowShift)
+
+    predictions = {'All': runModelFromSlopes(slopeTensor, featureWeights, memoryWindowDur, memoryWeight, initSlope, lag, sliderOnset,
+                                             memoryHalfLife)}
+    for j in range(len(featureWeights)):
+        if featureWeights[j] == 0:
+            continue
+        ablatedWeights = np.array(featureWeights, dtype=float)
+        ablatedWeights[j] = 0
+        predictions[featureList[j]] = runModelFromSlopes(slopeTensor, ablatedWeights, memoryWindowDur, memoryWeight,
+                                                         initSlope, lag, sliderOnset, memoryHalfLife)
+    return predictions
+
+
+# Predictions for several window scales at once: scale k uses attentionalWindowDurs[k] and memoryWindowDurs[k]
+# (memoryWindowDurs can also be a single duration for all scales, or None to use the attentional window durations).
+# Return value: (scales x samples) array with one prediction per row
+def runMultiScale(features, featureWeights, attentionalWindowDurs, memoryWindowDurs, sampleRate, windowShift, memoryWeight,
+                  initSlope, lag, sliderOnset=False):
+    if memoryWindowDurs is None:
+        memoryWindowDurs = attentionalWindowDurs
+    elif np.isscalar(memoryWindowDurs):
+        memoryWindowDurs = [memoryWindowDurs] * len(attentionalWindowDurs)
+    if len(memoryWindowDurs) != len(attentionalWindowDurs):
+        raise ValueError('memoryWindowDurs length does not match attentionalWindowDurs length')
+
+    # Scales with the same attentional window share a slope tensor
+    uniqueDurs = sorted(set(attentionalWindowDurs))
+    slopeTensors = dict(zip(uniqueDurs, computeSlopeTensors(features, sampleRate, uniqueDurs, windowShift)))
+
+    bank = np.zeros((len(attentionalWindowDurs), np.shape(features)[1]))
+    for k, (attentionalWindowDur, memoryWindowDur) in enumerate(zip(attentionalWindowDurs, memoryWindowDurs)):
+        bank[k] = runModelFromSlopes(slopeTensors[attentionalWindowDur], featureWeights, memoryWindowDur, memoryWeight,
+                                     initSlope, lag, sliderOnset)
+    return bank
+
+
+# Weighted combination of the rows of a multi-scale prediction bank (equal weights by default), normalized
+def combineScales(bank, scaleWeights=None):
+    bank = np.atleast_2d(bank)
+    if scaleWeights is None:
+        scaleWeights = np.ones(len(bank))
+    scaleWeights = np.asarray(scaleWeights, dtype=float)
+    if len(scaleWeights) != len(bank):
+        raise ValueError('scaleWeights length does not match the number of scales')
+    combined = scaleWeights @ bank / np.sum(np.abs(scaleWeights))
+    stdev = np.std(combined, ddof=1)
+    if stdev == 0 or np.isnan(stdev):
+        return np.zeros(len(combined))
+    return (combined - np.mean(combined))/stdev
+
+
 #############################################################################################################
 #############################################################################################################
 
 
-def graphPrediction(prediction, target, currName, sampleRate, numPoints):
+# Figures written to files are drawn at this size; curves are decimated to about two points per pixel column
+FIGURE_SIZE = (12, 6)
+FIGURE_DPI = 100
+
+def graphPrediction(prediction, target, currName, sampleRate, numPoints, outputFile=None):
     black = [0, 0, 0]
     x = np.linspace(0,numPoints/sampleRate,numPoints)      
-    fig, ax = plt.subplots() 
-    ax.plot(x, prediction, color='red', label='Prediction')
-    
-    if np.size(target) > 0:
-        ax.plot(x, target, color='blue', label='Target')
+    fig, ax = newFigure(outputFile)
+    try:
+        plotCurve(ax, outputFile, x, prediction, color='red', label='Prediction')
 
-    ax.set_xlabel('Time (seconds)')  # Add an x-label to the axes.
-    ax.set_ylabel('Tension')  # Add a y-label to the axes.
-    ax.set_title("Tension prediction")  # Add a title to the axes.
-    ax.legend()  # Add a legend.
-    plt.ioff()
-    plt.show()
+        if np.size(target) > 0:
+            plotCurve(ax, outputFile, x, target, color='blue', label='Target')
+
+        ax.set_xlabel('Time (seconds)')  # Add an x-label to the axes.
+        ax.set_ylabel('Tension')  # Add a y-label to the axes.
+        ax.set_title("Tension prediction")  # Add a title to the axes.
+        ax.legend()  # Add a legend.
+        showFigure(fig, outputFile)
+    finally:
+        closeFigure(fig, outputFile)
 
 # Graph the features along with (optionally) a tension graph; tension can either be empirical data (target), or the predicted tension
-def graphFeatures(tension, features, featureList, sampleRate, name, numPoints, numFeatures):
+def graphFeatures(tension, features, featureList, sampleRate, name, numPoints, numFeatures, outputFile=None):
 
     # Line styles
     solid = '-'; dashed = '--'; dotted = ':'; dashDotted = '-.'
@@ -248,18 +434,113 @@ def graphFeatures(tension, features, featureList, sampleRate, name, numPoints, n
     yLabel = 'Normalized Data'
     title = name
     x = np.linspace(0,numPoints/sampleRate,numPoints)      
-    fig, ax = plt.subplots() 
+    fig, ax = newFigure(outputFile)
+    try:
+        for i in range(0, numFeatures):
+            plotCurve(ax, outputFile, x, features[i,:], color=fColor[i % numColors], linewidth=fLineWidth, linestyle=fLineStyle, label=featureList[i])
 
-    for i in range(0, numFeatures):
-        ax.plot(x, features[i,:], color=fColor[i % numColors], linewidth=fLineWidth, linestyle=fLineStyle, label=featureList[i])
+        if len(tension) > 0:
+            plotCurve(ax, outputFile, x, tension, color=tColor, linewidth=tLineWidth, linestyle=tLineStyle, label='Tension')
 
-    if len(tension) > 0:
-        ax.plot(x, tension, color=tColor, linewidth=tLineWidth, linestyle=tLineStyle, label='Tension')
+        ax.set_xlabel(xLabel)  # Add an x-label to the axes.
+        ax.set_ylabel(yLabel)  # Add a y-label to the axes.
+        ax.set_title(title)  # Add a title to the axes.
+        ax.legend()  # Add a legend.
+        showFigure(fig, outputFile)
+    finally:
+        closeFigure(fig, outputFile)
 
-    ax.set_xlabel(xLabel)  # Add an x-label to the axes.
-    ax.set_ylabel(yLabel)  # Add a y-label to the axes.
-    ax.set_title(title)  # Add a title to the axes.
-    ax.legend()  # Add a legend.
-    plt.ioff()
-    plt.show()
-    
+
+# Without an output file, figures are shown interactively with pyplot.  With an output file (.png, .svg, ...) the
+# figure is drawn with the non-interactive Agg canvas and isn't registered with pyplot, so nothing blocks and
+# nothing is kept around after the file is written (this also works in worker threads/processes).
+def newFigure(outputFile):
+    if outputFile is None:
+        return plt.subplots()
+    fig = Figure(figsize=FIGURE_SIZE, dpi=FIGURE_DPI)
+    FigureCanvasAgg(fig)
+    return fig, fig.add_subplot()
+
+def showFigure(fig, outputFile):
+    if outputFile is None:
+        plt.ioff()
+        plt.show()
+    else:
+        fig.savefig(outputFile)
+
+def closeFigure(fig, outputFile):
+    if outputFile is not None:
+        fig.clear()
+
+# Curves drawn into files are decimated to the pixel width of the figure
+def plotCurve(ax, outputFile, x, y, **kwargs):
+    if outputFile is not None:
+        x, y = decimateMinMax(x, y, int(FIGURE_SIZE[0] * FIGURE_DPI))
+    ax.plot(x, y, **kwargs)
+
+
+# Reduce a curve to the minimum and maximum of each of numBuckets consecutive chunks (in their original order), so
+# that the peaks and troughs of a long curve are still drawn when there are fewer pixels than samples
+def decimateMinMax(x, y, numBuckets):
+    x = np.asarray(x)
+    y = np.asarray(y)
+    numPoints = len(y)
+    if numPoints <= 2 * numBuckets:
+        return x, y
+
+    bucket = np.arange(numPoints) * numBuckets // numPoints
+    # Sorting by bucket, then by value, puts the minimum of each bucket first and the maximum last
+    order = np.lexsort((y, bucket))
+    bucketStarts = np.flatnonzero(np.diff(bucket[order], prepend=-1))
+    bucketEnds = np.append(bucketStarts[1:], numPoints) - 1
+    keep = np.unique(np.concatenate((order[bucketStarts], order[bucketEnds])))
+    return x[keep], y[keep]
+
+
+# Renders graphs to files in a bounded pool of worker processes, for batch reports over many pieces.  submit() blocks
+# while maxPending graphs are queued or rendering, so memory use doesn't grow with the size of the batch.
+#
+# Example usage:
+#   renderer = tensionModel.GraphRenderer(numWorkers=4)
+#   renderer.submit(tensionModel.graphPrediction, prediction, [], name, sampleRate, numPoints, outputFile=name + ".png")
+#   errors = renderer.close()
+class GraphRenderer:
+    def __init__(self, numWorkers=None, maxPending=None, useThreads=False):
+        if numWorkers is None:
+            numWorkers = os.cpu_count()
+        if maxPending is None:
+            maxPending = 2 * numWorkers
+        executorClass = ThreadPoolExecutor if useThreads else ProcessPoolExecutor
+        self.executor = executorClass(max_workers=numWorkers)
+        self.pending = threading.BoundedSemaphore(maxPending)
+        self.errors = []
+        self.lock = threading.Lock()
+
+    # graphFunction is graphPrediction or graphFeatures; outputFile must be given
+    def submit(self, graphFunction, *args, outputFile, **kwargs):
+        self.pending.acquire()
+        try:
+            future = self.executor.submit(graphFunction, *args, outputFile=outputFile, **kwargs)
+        except Exception:
+            self.pending.release()
+            raise
+        future.add_done_callback(lambda done: self.finished(done, outputFile))
+        return future
+
+    def finished(self, future, outputFile):
+        error = future.exception()
+        if error is not None:
+            with self.lock:
+                self.errors.append((outputFile, error))
+        self.pending.release()
+
+    # Wait for all graphs to be written; returns a list of (output file, exception) for the graphs that failed
+    def close(self):
+        self.executor.shutdown(wait=True)
+        return self.errors
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
@@ -6,7 +6,9 @@
 
 import argparse
 import copy
+import io
 import itertools
+import math
 import os
 import sys
 from typing import List, Tuple, Union
@@ -105,10 +107,11 @@ def largest_distance(pitches: List[int]) -> int:
     if len(pitches) < 2:
         return 0
     diameter = 0
+    position = spiral_array().pitch_index_to_position
     pitch_pairs = itertools.combinations(pitches, 2)
     for pitch_pair in pitch_pairs:
-        distance = np.linalg.norm(pitch_index_to_position(
-            pitch_pair[0]) - pitch_index_to_position(pitch_pair[1]))
+        distance = np.linalg.norm(position(
+            pitch_pair[0]) - position(pitch_pair[1]))
         if distance > diameter:
             diameter = distance
     return diameter
@@ -147,8 +150,9 @@ def notes_to_ce(notes: List[int], shift: int) -> ndarray:
 
     total = np.zeros(3)
     count = 0
+    position = spiral_array().pitch_index_to_position
     for index in indices:
-        total += pitch_index_to_position(index)
+        total += position(index)
         count += 1
 
     if count != 0:
@@ -156,23 +160,9 @@ def notes_to_ce(notes: List[int], shift: int) -> ndarray:
     return total
 
 
+# The legacy functions below read the positions from the SpiralArray of the module globals
 def pitch_index_to_position(pitch_index: int) -> ndarray:
-
-    c = pitch_index - (4 * (pitch_index // 4))
-
-    pos = np.array([0.0, 0.0, 0.0])
-
-    if c == 0:
-        pos[1] = radius
-    if c == 1:
-        pos[0] = radius
-    if c == 2:
-        pos[1] = -1*radius
-    if c == 3:
-        pos[0] = -1*radius
-
-    pos[2] = pitch_index * verticalStep
-    return np.array(pos)
+    return spiral_array().pitch_index_to_position(pitch_index)
 
 
 def ce_sum(indices: List[int], start=None, end=None) -> ndarray:
@@ -184,75 +174,79 @@ def ce_sum(indices: List[int], start=None, end=None) -> ndarray:
     indices = indices[start:end]
     total = np.zeros(3)
     count = 0
+    position = spiral_array().pitch_index_to_position
     for timestep, data in enumerate(indices):
         for pitch in data:
-            total += pitch_index_to_position(pitch)
+            total += position(pitch)
             count += 1
     return total/count
 
 
 def major_triad_position(root_index: int) -> ndarray:
-    root_pos = pitch_index_to_position(root_index)
-
-    fifth_index = root_index + 1
-    third_index = root_index + 4
-
-    fifth_pos = pitch_index_to_position(fifth_index)
-    third_pos = pitch_index_to_position(third_index)
-
-    centre_pos = weight[0] * root_pos + \
-        weight[1] * fifth_pos + weight[2] * third_pos
-    return centre_pos
+    return spiral_array().major_triad_position(root_index)
 
 
 def minor_triad_position(root_index: int) -> ndarray:
-    root_pos = pitch_index_to_position(root_index)
-
-    fifth_index = root_index + 1
-    third_index = root_index - 3
-
-    fifth_pos = pitch_index_to_position(fifth_index)
-    third_pos = pitch_index_to_position(third_index)
-
-    centre_pos = weight[0] * root_pos + \
-        weight[1] * fifth_pos + weight[2] * third_pos
-
-    return centre_pos
+    return spiral_array().minor_triad_position(root_index)
 
 
 def major_key_position(key_index: int) -> ndarray:
-    root_triad_pos = major_triad_position(key_index)
-    fifth_index = key_index + 1
-
-    fourth_index = key_index - 1
-
-    fifth_triad_pos = major_triad_position(fifth_index)
-    fourth_triad_pos = major_triad_position(fourth_index)
+    return spiral_array().major_key_position(key_index)
 
-    key_pos = weight[0] * root_triad_pos + weight[1] * \
-        fifth_triad_pos + weight[2] * fourth_triad_pos
 
-    return key_pos
+def minor_key_position(key_index: int) -> ndarray:
+    return spiral_array().minor_key_position(key_index)
 
 
-def minor_key_position(key_index: int) -> ndarray:
+def key_position_and_shift(name: str) -> Tuple[ndarray, int]:
+    # all the major key pos is C major pos, all the minor key pos is a minor pos;
+    # the shift transposes the notes of the key to C major/a minor
+    key = name.split()[0].upper()
+    mode = name.split()[1]
 
-    root_triad_pos = minor_triad_position(key_index)
-    fifth_index = key_index + 1
-    fourth_index = key_index - 1
-    major_fourth_triad_pos = major_triad_position(fourth_index)
-    minor_fourth_triad_pos = minor_triad_position(fourth_index)
+    if mode == 'minor':
+        if key not in valid_minor:
+            if key in enharmonic_dict:
+                key = enharmonic_dict[key]
+            elif key in enharmonic_reverse_dict:
+                key = enharmonic_reverse_dict[key]
+            else:
+                print('no such key')
+        if key not in valid_minor:
+            print('no such key')
+            return None
 
-    major_fifth_triad_pos = major_triad_position(fifth_index)
-    minor_fifth_triad_pos = minor_triad_position(fifth_index)
+    else:
+        if key not in valid_major:
+            if key in enharmonic_dict:
+                key = enharmonic_dict[key]
+            elif key in enharmonic_reverse_dict:
+                key = enharmonic_reverse_dict[key]
+            else:
+                print('no such key')
+        if key not in valid_major:
+            print('no such key')
+            return None
+    key_index = pitch_name_to_pitch_index[key]
+
+    if mode == 'minor':
+        # all the minor key_pos is a minor
+        key_pos = minor_key_position(3)
+    else:
+        # all the major key_pos is C major
+        key_pos = major_key_position(0)
 
-    key_pos = weight[0] * root_triad_pos + \
-        weight[1] * (alpha * major_fifth_triad_pos +
-                     (1-alpha) * minor_fifth_triad_pos) + \
-        weight[2] * (beta * minor_fourth_triad_pos +
-                     (1 - beta) * major_fourth_triad_pos)
+    if mode == 'minor':
+        key_index -= 3
+    key_shift_name = pitch_index_to_pitch_name[key_index]
 
-    return key_pos
+    if key_shift_name in pitch_index_to_sharp_names:
+        key_shift_for_ce = np.argwhere(
+            pitch_index_to_sharp_names == key_shift_name)[0][0]
+    else:
+        key_shift_for_ce = np.argwhere(
+            pitch_index_to_flat_names == key_shift_name)[0][0]
+    return key_pos, key_shift_for_ce
 
 
 def cal_key(piano_roll: PianoRoll,
@@ -263,66 +257,22 @@ def cal_key(piano_roll: PianoRoll,
     end = int(piano_roll.shape[1] * end_ratio)
     distances = []
     key_positions = []
-    key_indices = []
     key_shifts = []
     for name in key_names:
-        key = name.split()[0].upper()
-        mode = name.split()[1]
-
-        if mode == 'minor':
-            if key not in valid_minor:
-                if key in enharmonic_dict:
-                    key = enharmonic_dict[key]
-                elif key in enharmonic_reverse_dict:
-                    key = enharmonic_reverse_dict[key]
-                else:
-                    print('no such key')
-            if key not in valid_minor:
-                print('no such key')
-                return None
-
-        else:
-            if key not in valid_major:
-                if key in enharmonic_dict:
-                    key = enharmonic_dict[key]
-                elif key in enharmonic_reverse_dict:
-                    key = enharmonic_reverse_dict[key]
-                else:
-                    print('no such key')
-            if key not in valid_major:
-                print('no such key')
-                return None
-        key_index = pitch_name_to_pitch_index[key]
-
-        if mode == 'minor':
-            # all the minor key_pos is a minor
-            key_pos = minor_key_position(3)
-        else:
-            # all the major key_pos is C major
-            key_pos = major_key_position(0)
+        result = key_position_and_shift(name)
+        if result is None:
+            return None
+        key_pos, key_shift_for_ce = result
         key_positions.append(key_pos)
-
-        if mode == 'minor':
-            key_index -= 3
-        key_shift_name = pitch_index_to_pitch_name[key_index]
-
-        if key_shift_name in pitch_index_to_sharp_names:
-            key_shift_for_ce = np.argwhere(
-                pitch_index_to_sharp_names == key_shift_name)[0][0]
-        else:
-            key_shift_for_ce = np.argwhere(
-                pitch_index_to_flat_names == key_shift_name)[0][0]
         key_shifts.append(key_shift_for_ce)
         ce = piano_roll_to_ce(piano_roll[:, :end], key_shift_for_ce)
         distance = np.linalg.norm(ce - key_pos)
         distances.append(distance)
-        key_indices.append(key_index)
 
     index = np.argmin(np.array(distances))
     key_name = key_names[index]
     key_pos = key_positions[index]
     key_shift_for_ce = key_shifts[index]
-    # key_index = key_indices[index]
     return key_name, key_pos, key_shift_for_ce
 
 
@@ -724,7 +674,7 @@ def extract_notes(file_name: str,
                   track_num: int
                   ) -> Tuple[PrettyMIDI, PianoRoll, ndarray, ndarray, ndarray, List[int], List[int]]:
     try:
-        pm = pretty_midi.PrettyMIDI(file_name)
+        pm = read_midi(file_name)
         pm = remove_drum_track(pm)
 
         # if len(pm.time_signature_changes) > 1:
@@ -766,6 +716,25 @@ def walk(folder_name: str) -> List[str]:
     return files
 
 
+class MidiMember(str):
+    # A MIDI file that isn't on disk, e.g. a member of an archive (see midiArchive.py).  The string is the member's name,
+    # used in messages and output paths like a file name; data holds the bytes of the file.
+    def __new__(cls, name: str, data: bytes):
+        member = super().__new__(cls, name)
+        member.data = data
+        return member
+
+    def __getnewargs__(self):
+        return str(self), self.data
+
+
+def read_midi(file_name: str) -> PrettyMIDI:
+    # file_name is a path or a MidiMember
+    if isinstance(file_name, MidiMember):
+        return pretty_midi.PrettyMIDI(io.BytesIO(file_name.data))
+    return pretty_midi.PrettyMIDI(file_name)
+
+
 def get_args(default='.') -> argparse.Namespace:
     parser = argparse.ArgumentParser()
     parser.add_argument('-i', '--input_folder', default=default, type=str,
@@ -819,29 +788,442 @@ def note_to_note_pos(note_indices: List[int], note_pos: int) -> ndarray:
 
 
 def chord_to_key_pos(chord_indices: List[int], key_pos: int) -> ndarray:
-    chord_positions = []
-    for chord_index in chord_indices:
-        chord_positions.append(major_triad_position(
-            note_index_to_pitch_index[chord_index]))
-
-    for chord_index in chord_indices:
-        chord_positions.append(minor_triad_position(
-            note_index_to_pitch_index[chord_index]))
-    diffs = np.linalg.norm(np.array(chord_positions)-key_pos, axis=1)
-    return diffs
+    return spiral_array().chord_to_key_pos(chord_indices, key_pos)
 
 
 def key_to_key_pos(key_indices: List[int], key_pos: int) -> ndarray:
-    key_positions = []
-    for key_index in key_indices:
-        key_positions.append(major_key_position(
-            note_index_to_pitch_index[key_index]))
+    return spiral_array().key_to_key_pos(key_indices, key_pos)
 
-    for key_index in key_indices:
-        key_positions.append(minor_key_position(
-            note_index_to_pitch_index[key_index]))
 
-    diffs = np.linalg.norm(np.array(key_positions)-key_pos, axis=1)
-    return diffs
 
 
+################################################################################################################################
+# Reentrant analysis API
+#
+# The functions above read their parameters from module globals (verticalStep, radius, weight, alpha, beta), report
+# errors by printing and returning None, and print status messages.  An AnalysisContext instead carries all of the
+# parameters and the tables derived from them (spiral array positions, key positions and chord diameters), never
+# changes after it is created, raises TensionAnalysisError subclasses and writes no output.  Contexts can be shared
+# between threads, and analyses with different parameters can run at the same time.
+#
+# Example usage:
+#   context = AnalysisContext(vertical_step=0.35, window_size=2, end_ratio=1)
+#   result = context.analyze_file("midi/Brahms.mid")
+#   result.total_tension, result.times
+################################################################################################################################
+
+
+class TensionAnalysisError(Exception):
+    pass
+
+
+class InvalidParameterError(TensionAnalysisError):
+    pass
+
+
+class MidiReadError(TensionAnalysisError):
+    pass
+
+
+class InvalidKeyError(TensionAnalysisError):
+    pass
+
+
+class EmptyScoreError(TensionAnalysisError):
+    pass
+
+
+class TensionResult:
+    # chords: the triad recognized in each window (indexed as SpiralArray.chord_positions, -1 in silent windows);
+    # chord_key_distance: the distance of that triad from the key in the spiral array (0 in silent windows)
+    def __init__(self, total_tension, diameters, centroid_diff, key_name, key_change_time, key_change_bar,
+                 changed_key_name, times, chords=None, chord_key_distance=None):
+        self.total_tension = total_tension
+        self.diameters = diameters
+        self.centroid_diff = centroid_diff
+        self.key_name = key_name
+        self.key_change_time = key_change_time
+        self.key_change_bar = key_change_bar
+        self.changed_key_name = changed_key_name
+        self.times = times
+        self.chords = chords
+        self.chord_key_distance = chord_key_distance
+
+    # the list returned by cal_tension
+    def as_list(self, new_output_folder=''):
+        return [self.total_tension, self.diameters, self.centroid_diff, self.key_name, self.key_change_time,
+                self.key_change_bar, self.changed_key_name, new_output_folder, self.times]
+
+
+# Positions in Chew's spiral array for one set of parameters, computed once: every pitch on the line of fifths, and the
+# major and minor triads and keys on every root, for the pitch indices PITCH_INDEX_MIN..PITCH_INDEX_MAX (other indices
+# are calculated when asked for), plus the 24 triads and 24 keys of the note indices.  These are indexed like
+# chord_to_key_pos and key_to_key_pos: 0-11 major and 12-23 minor, on the roots/tonics C, D-, D, ..., B (note index).
+# This is the only implementation of the spiral array: the legacy functions above read the SpiralArray of the module
+# globals (spiral_array()), and every AnalysisContext has its own.  The tables are read-only.
+class SpiralArray:
+    PITCH_INDEX_MIN = -12
+    PITCH_INDEX_MAX = 12
+
+    def __init__(self, vertical_step=0.4, radius=1.0, weight=(0.536, 0.274, 0.19), alpha=0.75, beta=0.75):
+        self.vertical_step = vertical_step
+        self.radius = radius
+        self.weight = np.array(weight, dtype=float)
+        self.alpha = alpha
+        self.beta = beta
+
+        pitch_indices = np.arange(self.PITCH_INDEX_MIN, self.PITCH_INDEX_MAX + 1)
+        self.pitch_positions = self.cal_pitch_positions(pitch_indices)
+        self.major_triad_positions = self.cal_major_triad_positions(pitch_indices)
+        self.minor_triad_positions = self.cal_minor_triad_positions(pitch_indices)
+        self.major_key_positions = self.cal_major_key_positions(pitch_indices)
+        self.minor_key_positions = self.cal_minor_key_positions(pitch_indices)
+
+        roots = np.array(note_index_to_pitch_index)
+        self.chord_positions = np.concatenate((self.cal_major_triad_positions(roots), self.cal_minor_triad_positions(roots)))
+        self.key_positions = np.concatenate((self.cal_major_key_positions(roots), self.cal_minor_key_positions(roots)))
+        # shifted_positions[shift, pitch class]: position of the pitch class transposed by the key shift
+        shifted_classes = (np.arange(octave)[np.newaxis, :] - np.arange(octave)[:, np.newaxis]) % octave
+        self.shifted_positions = self.cal_pitch_positions(roots[shifted_classes])
+
+        for table in (self.pitch_positions, self.major_triad_positions, self.minor_triad_positions, self.major_key_positions,
+                      self.minor_key_positions, self.chord_positions, self.key_positions, self.shifted_positions):
+            table.setflags(write=False)
+
+    # Positions of an array of pitch indices (an array of positions with one more axis)
+    def cal_pitch_positions(self, pitch_indices: ndarray) -> ndarray:
+        pitch_indices = np.asarray(pitch_indices)
+        c = pitch_indices % 4
+        positions = np.zeros(pitch_indices.shape + (3,))
+        positions[c == 1, 0] = self.radius
+        positions[c == 3, 0] = -1*self.radius
+        positions[c == 0, 1] = self.radius
+        positions[c == 2, 1] = -1*self.radius
+        positions[..., 2] = pitch_indices * self.vertical_step
+        return positions
+
+    def cal_major_triad_positions(self, root_indices: ndarray) -> ndarray:
+        root_indices = np.asarray(root_indices)
+        return self.weight[0] * self.cal_pitch_positions(root_indices) + \
+            self.weight[1] * self.cal_pitch_positions(root_indices + 1) + \
+            self.weight[2] * self.cal_pitch_positions(root_indices + 4)
+
+    def cal_minor_triad_positions(self, root_indices: ndarray) -> ndarray:
+        root_indices = np.asarray(root_indices)
+        return self.weight[0] * self.cal_pitch_positions(root_indices) + \
+            self.weight[1] * self.cal_pitch_positions(root_indices + 1) + \
+            self.weight[2] * self.cal_pitch_positions(root_indices - 3)
+
+    def cal_major_key_positions(self, key_indices: ndarray) -> ndarray:
+        key_indices = np.asarray(key_indices)
+        return self.weight[0] * self.cal_major_triad_positions(key_indices) + \
+            self.weight[1] * self.cal_major_triad_positions(key_indices + 1) + \
+            self.weight[2] * self.cal_major_triad_positions(key_indices - 1)
+
+    def cal_minor_key_positions(self, key_indices: ndarray) -> ndarray:
+        key_indices = np.asarray(key_indices)
+        fifth_indices = key_indices + 1
+        fourth_indices = key_indices - 1
+        return self.weight[0] * self.cal_minor_triad_positions(key_indices) + \
+            self.weight[1] * (self.alpha * self.cal_major_triad_positions(fifth_indices) +
+                              (1-self.alpha) * self.cal_minor_triad_positions(fifth_indices)) + \
+            self.weight[2] * (self.beta * self.cal_minor_triad_positions(fourth_indices) +
+                              (1 - self.beta) * self.cal_major_triad_positions(fourth_indices))
+
+    # The row of table for one index, or the calculated position for indices outside the tables
+    def lookup(self, table: ndarray, index: int, cal_positions) -> ndarray:
+        if self.PITCH_INDEX_MIN <= index <= self.PITCH_INDEX_MAX:
+            return table[index - self.PITCH_INDEX_MIN]
+        return cal_positions(index)
+
+    def pitch_index_to_position(self, pitch_index: int) -> ndarray:
+        return self.lookup(self.pitch_positions, pitch_index, self.cal_pitch_positions)
+
+    def major_triad_position(self, root_index: int) -> ndarray:
+        return self.lookup(self.major_triad_positions, root_index, self.cal_major_triad_positions)
+
+    def minor_triad_position(self, root_index: int) -> ndarray:
+        return self.lookup(self.minor_triad_positions, root_index, self.cal_minor_triad_positions)
+
+    def major_key_position(self, key_index: int) -> ndarray:
+        return self.lookup(self.major_key_positions, key_index, self.cal_major_key_positions)
+
+    def minor_key_position(self, key_index: int) -> ndarray:
+        return self.lookup(self.minor_key_positions, key_index, self.cal_minor_key_positions)
+
+    # Distances of the major triads and then the minor triads on the roots chord_indices (note indices) from key_pos
+    def chord_to_key_pos(self, chord_indices: List[int], key_pos: ndarray) -> ndarray:
+        chord_indices = np.asarray(chord_indices, dtype=int)
+        positions = np.concatenate((self.chord_positions[chord_indices], self.chord_positions[octave + chord_indices]))
+        return np.linalg.norm(positions - key_pos, axis=1)
+
+    # Distances of the major keys and then the minor keys on the tonics key_indices (note indices) from key_pos
+    def key_to_key_pos(self, key_indices: List[int], key_pos: ndarray) -> ndarray:
+        key_indices = np.asarray(key_indices, dtype=int)
+        positions = np.concatenate((self.key_positions[key_indices], self.key_positions[octave + key_indices]))
+        return np.linalg.norm(positions - key_pos, axis=1)
+
+    # The triad closest to each centroid (rows of centroids), and its distance from key_positions (one position, or
+    # one per centroid), from chord_to_key_pos.  The centroids and key positions must be in the same frame as
+    # chord_positions.
+    def recognize_chords(self, centroids: ndarray, key_positions: ndarray) -> Tuple[ndarray, ndarray]:
+        distances = np.linalg.norm(centroids[:, np.newaxis, :] - self.chord_positions[np.newaxis, :, :], axis=-1)
+        chords = np.argmin(distances, axis=1)
+        key_positions = np.broadcast_to(key_positions, centroids.shape)
+        chord_key_distances = np.zeros(len(chords))
+        for key_pos in np.unique(key_positions, axis=0):
+            in_key = np.all(key_positions == key_pos, axis=1)
+            chord_key_distances[in_key] = self.chord_to_key_pos(range(octave), key_pos)[chords[in_key]]
+        return chords, chord_key_distances
+
+
+# The SpiralArray of the module globals verticalStep, radius, weight, alpha and beta, built again when they change
+spiral_arrays = {}
+
+
+def spiral_array() -> SpiralArray:
+    parameters = (verticalStep, radius, np.asarray(weight, dtype=float).tobytes(), alpha, beta)
+    spiral = spiral_arrays.get(parameters)
+    if spiral is None:
+        spiral = SpiralArray(verticalStep, radius, weight, alpha, beta)
+        spiral_arrays[parameters] = spiral
+    return spiral
+
+
+class AnalysisContext:
+    def __init__(self,
+                 vertical_step=0.4,
+                 radius=1.0,
+                 weight=(0.536, 0.274, 0.19),
+                 alpha=0.75,
+                 beta=0.75,
+                 window_size=1,
+                 end_ratio=0.5,
+                 key_changed=False,
+                 track_num=0):
+        if not math.sqrt(2/15) <= vertical_step <= math.sqrt(0.2):
+            raise InvalidParameterError(
+                f'vertical step {vertical_step} is not between sqrt(2/15) and sqrt(0.2)')
+        if window_size == 0 or window_size < -1:
+            raise InvalidParameterError(
+                f'window size {window_size} is not a number of beats or -1 (every downbeat)')
+        self.spiral = SpiralArray(vertical_step, radius, weight, alpha, beta)
+        self.window_size = window_size
+        self.end_ratio = end_ratio
+        self.key_changed = key_changed
+        self.track_num = track_num
+
+        # shifted_positions[shift, pitch class]: position of the pitch class transposed by the key shift
+        self.shifted_positions = self.spiral.shifted_positions
+        self.key_table = {name: self.key_position_and_shift(name) for name in all_key_names}
+        self.diameter_tables = self.cal_diameter_tables()
+
+    def key_position_and_shift(self, name: str) -> Tuple[ndarray, int]:
+        if hasattr(self, 'key_table') and name in self.key_table:
+            return self.key_table[name]
+        parts = name.split()
+        if len(parts) != 2 or parts[1] not in ('major', 'minor'):
+            raise InvalidKeyError(f'invalid key name {name!r}, expected e.g. "B- major" or "C# minor"')
+        key = parts[0].upper()
+        mode = parts[1]
+        valid = valid_minor if mode == 'minor' else valid_major
+        if key not in valid:
+            key = enharmonic_dict.get(key, enharmonic_reverse_dict.get(key, key))
+        if key not in valid:
+            raise InvalidKeyError(f'no such key {name!r}')
+
+        key_index = pitch_name_to_pitch_index[key]
+        if mode == 'minor':
+            # all the minor key_pos is a minor
+            key_pos = self.spiral.minor_key_position(3)
+            key_index -= 3
+        else:
+            # all the major key_pos is C major
+            key_pos = self.spiral.major_key_position(0)
+        key_shift_name = pitch_index_to_pitch_name[key_index]
+        if key_shift_name in pitch_index_to_sharp_names:
+            key_shift = int(np.argwhere(pitch_index_to_sharp_names == key_shift_name)[0][0])
+        else:
+            key_shift = int(np.argwhere(pitch_index_to_flat_names == key_shift_name)[0][0])
+        return key_pos, key_shift
+
+    # diameter_tables[shift, pattern]: largest distance between the pitch classes in the 12-bit pattern (as cal_diameter)
+    def cal_diameter_tables(self) -> ndarray:
+        patterns = np.arange(1 << octave)
+        present = (patterns[:, np.newaxis] >> np.arange(octave)) & 1 == 1
+        tables = np.zeros((octave, len(patterns)))
+        for shift in range(octave):
+            positions = self.shifted_positions[shift]
+            for i, j in itertools.combinations(range(octave), 2):
+                distance = np.linalg.norm(positions[i] - positions[j])
+                both = present[:, i] & present[:, j]
+                tables[shift, both] = np.maximum(tables[shift, both], distance)
+        return tables
+
+    # per time step: number of sounding pitches of each pitch class (12 x time steps)
+    @staticmethod
+    def pitch_class_counts(piano_roll: PianoRoll) -> ndarray:
+        num_pitches, num_steps = piano_roll.shape
+        padded = np.zeros((-(-num_pitches // octave) * octave, num_steps))
+        padded[:num_pitches] = piano_roll > 0
+        return padded.reshape(-1, octave, num_steps).sum(axis=0)
+
+    # the key shift of each time step (the changed key applies after the key change beat, as in cal_centroid)
+    @staticmethod
+    def step_shifts(num_steps: int, key_shift: int, key_change_beat=-1, changed_key_shift=-1) -> ndarray:
+        shifts = np.full(num_steps, key_shift)
+        if key_change_beat != -1:
+            shifts[np.arange(num_steps) / 4 > key_change_beat] = changed_key_shift
+        return shifts
+
+    def cal_centroids(self, counts: ndarray, shifts: ndarray) -> ndarray:
+        positions = self.shifted_positions[shifts]  # time steps x pitch classes x 3
+        totals = np.einsum('tp,tpd->td', counts.T, positions)
+        num_notes = counts.sum(axis=0)[:, np.newaxis]
+        return np.divide(totals, num_notes, out=np.zeros_like(totals), where=num_notes > 0)
+
+    def cal_diameters(self, counts: ndarray, shifts: ndarray) -> ndarray:
+        patterns = ((counts > 0) * (1 << np.arange(octave))[:, np.newaxis]).sum(axis=0)
+        return self.diameter_tables[shifts, patterns]
+
+    # as cal_key: the key among key_names closest to the centroid of the first end_ratio of the piece
+    def cal_key(self, counts: ndarray, key_names: List[str], end_ratio: float) -> Tuple[str, ndarray, int]:
+        end = int(counts.shape[1] * end_ratio)
+        histogram = counts[:, :end].sum(axis=1)
+        if histogram.sum() == 0:
+            raise EmptyScoreError('no notes to find the key from')
+        best = None
+        for name in key_names:
+            key_pos, key_shift = self.key_position_and_shift(name)
+            ce = histogram @ self.shifted_positions[key_shift] / histogram.sum()
+            distance = np.linalg.norm(ce - key_pos)
+            if best is None or distance < best[0]:
+                best = (distance, name, key_pos, key_shift)
+        return best[1], best[2], best[3]
+
+    def extract_notes(self, file_name: str):
+        try:
+            pm = remove_drum_track(read_midi(file_name))
+            if self.track_num != 0:
+                pm.instruments = pm.instruments[:self.track_num]
+            sixteenth_time, beat_time, down_beat_time, beat_indices, down_beat_indices = get_beat_time(pm, beat_division=4)
+            piano_roll = get_piano_roll(pm, sixteenth_time)
+        except (ValueError, EOFError, IndexError, OSError, KeyError, ZeroDivisionError) as e:
+            raise MidiReadError(f'cannot read {file_name}: {e}') from e
+        return pm, piano_roll, sixteenth_time, beat_time, down_beat_time, beat_indices, down_beat_indices
+
+    def analyze_file(self, file_name: str, key_name='') -> TensionResult:
+        return self.analyze(*self.extract_notes(file_name), key_name=key_name)
+
+    # the same analysis as cal_tension; key_name = '' finds the key among all keys
+    def analyze(self, pm: PrettyMIDI, piano_roll: PianoRoll, sixteenth_time: ndarray, beat_time: ndarray,
+                down_beat_time: ndarray, beat_indices: List[int], down_beat_indices: List[int], key_name='') -> TensionResult:
+        key_names = all_key_names if key_name == '' else [key_name]
+        counts = self.pitch_class_counts(piano_roll)
+        num_steps = counts.shape[1]
+        key_name, key_pos, key_shift = self.cal_key(counts, key_names, self.end_ratio)
+
+        key_change_beat = -1
+        change_time = -1
+        key_change_bar = -1
+        changed_key_name = ''
+        changed_key_pos = None
+        changed_key_shift = -1
+        if self.key_changed:
+            key_change_beat, change_time, key_change_bar, changed_key_name, changed_key_pos, changed_key_shift = \
+                self.find_key_change(pm, counts, key_name, key_pos, key_shift, sixteenth_time, beat_time,
+                                     down_beat_time, beat_indices, down_beat_indices)
+
+        shifts = self.step_shifts(num_steps, key_shift, key_change_beat, changed_key_shift)
+        merged_centroids = np.array(merge_tension(
+            self.cal_centroids(counts, shifts), beat_indices, down_beat_indices, window_size=self.window_size))
+        if merged_centroids.size == 0:
+            raise EmptyScoreError('the piece is shorter than one tension window')
+        silent = np.linalg.norm(merged_centroids, axis=-1) < 0.1
+
+        if self.window_size == -1:
+            window_time = down_beat_time
+        else:
+            window_time = beat_time[::self.window_size]
+
+        key_positions = np.tile(key_pos, (merged_centroids.shape[0], 1))
+        if key_change_beat != -1:
+            changed_step = int(key_change_beat / abs(self.window_size))
+            key_positions[changed_step:] = changed_key_pos
+        key_diff = np.linalg.norm(merged_centroids - key_positions, axis=-1)
+        key_diff[silent] = 0
+
+        diameters = merge_tension(self.cal_diameters(counts, shifts), beat_indices, down_beat_indices, self.window_size)
+        diameters[silent] = 0
+
+        centroid_diff = np.diff(merged_centroids, axis=0)
+        np.nan_to_num(centroid_diff, copy=False)
+        centroid_diff = np.insert(np.linalg.norm(centroid_diff, axis=-1), 0, 0)
+
+        chords, chord_key_distance = self.cal_chords(counts, shifts, key_positions, beat_indices, down_beat_indices)
+        chords[silent] = -1
+        chord_key_distance[silent] = 0
+        if key_change_beat != -1:
+            # back from the key frame to the pitch classes of the chord roots
+            window_shifts = np.where(np.arange(len(chords)) < changed_step, key_shift, changed_key_shift)
+        else:
+            window_shifts = np.full(len(chords), key_shift)
+        sounding = chords >= 0
+        chords[sounding] = (chords[sounding] % octave + window_shifts[sounding]) % octave + \
+            octave * (chords[sounding] >= octave)
+
+        times = window_time[:len(key_diff)]
+        return TensionResult(key_diff, diameters, centroid_diff, key_name, change_time, key_change_bar,
+                             changed_key_name, times, chords, chord_key_distance)
+
+    # The triad closest to the pitch class centroid of each window and its distance from the key, in the key frame
+    # (chord indices are relative to the key shift; -1 for windows without notes)
+    def cal_chords(self, counts: ndarray, shifts: ndarray, key_positions: ndarray, beat_indices: List[int],
+                   down_beat_indices: List[int]) -> Tuple[ndarray, ndarray]:
+        # pitch classes of each time step transposed by its key shift, as in cal_centroids
+        shifted_counts = counts[(np.arange(octave)[:, np.newaxis] + shifts[np.newaxis, :]) % octave, np.arange(counts.shape[1])]
+        window_counts = merge_tension(shifted_counts.T, beat_indices, down_beat_indices, self.window_size)
+        totals = window_counts.sum(axis=1)
+        centroids = window_counts @ self.shifted_positions[0] / np.where(totals > 0, totals, 1)[:, np.newaxis]
+        chords, distances = self.spiral.recognize_chords(centroids, key_positions)
+        chords[totals == 0] = -1
+        distances[totals == 0] = 0
+        return chords, distances
+
+    # as the key change detection in cal_tension; returns (key change beat, change time, key change bar,
+    # changed key name, changed key position, changed key shift), with -1/'' /None when the key doesn't change
+    def find_key_change(self, pm, counts, key_name, key_pos, key_shift, sixteenth_time, beat_time, down_beat_time,
+                        beat_indices, down_beat_indices):
+        no_change = (-1, -1, -1, '', None, -1)
+        shifts = self.step_shifts(counts.shape[1], key_shift)
+
+        # use a bar window to detect key change
+        merged_centroids = np.array(merge_tension(
+            self.cal_centroids(counts, shifts), beat_indices, down_beat_indices, window_size=-1))
+        if merged_centroids.size == 0:
+            return no_change
+        key_diff = np.linalg.norm(merged_centroids - key_pos, axis=-1)
+        key_diff[np.linalg.norm(merged_centroids, axis=-1) == 0] = 0
+        diameters = merge_tension(self.cal_diameters(counts, shifts), beat_indices, down_beat_indices, window_size=-1)
+
+        key_change_bar = detect_key_change(key_diff, diameters, start_ratio=self.end_ratio)
+        if key_change_bar == -1 or key_change_bar >= len(down_beat_time):
+            return no_change
+        matches = np.argwhere(beat_time == down_beat_time[key_change_bar])
+        if len(matches) == 0:
+            return no_change
+        key_change_beat = matches[0][0]
+        change_time = down_beat_time[key_change_bar]
+
+        # the key of the notes after the change
+        new_pm = copy.deepcopy(pm)
+        for instrument in new_pm.instruments:
+            for i, note in enumerate(instrument.notes):
+                if note.start > change_time:
+                    instrument.notes = instrument.notes[i:]
+                    break
+        changed_counts = self.pitch_class_counts(get_piano_roll(new_pm, sixteenth_time))
+        changed_key_name, changed_key_pos, changed_key_shift = self.cal_key(changed_counts, all_key_names, 1)
+        if changed_key_name == key_name:
+            return no_change
+        return key_change_beat, change_time, key_change_bar, changed_key_name, changed_key_pos, changed_key_shift
@@ -0,0 +1,27 @@
+# Augmented features and predictions against the full pipeline run on the variant MIDI files (see
+# augmentation.verifyAugmentation)
+
+import os
+import pytest
+import augmentation
+
+MIDI_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "midi")
+MIDI_FILES = [os.path.join(MIDI_DIR, name) for name in ("Brahms.mid", "Morgengruss.mid")]
+
+
+def failures(reports):
+    return [(report["transposition"], report["timeScale"], report["featureDeviation"], report["predictionDeviation"])
+            for report in reports if not report["passed"]]
+
+
+@pytest.mark.parametrize("inputFile", MIDI_FILES, ids=os.path.basename)
+def test_transpositions(inputFile):
+    reports = augmentation.verifyAugmentation(inputFile, transpositions=range(-6, 6), timeScales=(1,))
+    assert len(reports) == 12
+    assert failures(reports) == []
+
+
+@pytest.mark.parametrize("inputFile", MIDI_FILES, ids=os.path.basename)
+def test_time_scales(inputFile):
+    reports = augmentation.verifyAugmentation(inputFile, transpositions=(-5, 0, 7), timeScales=(.8, 1.25))
+    assert failures(reports) == []
@@ -0,0 +1,22 @@
+# Every engine of the equivalence harness against the stored golden outputs (see equivalence.checkEngine)
+
+import pytest
+import equivalence
+
+ENGINES = [(stage, engineName) for stage, engines in equivalence.ENGINES.items() for engineName in engines
+           if engineName != equivalence.REFERENCE]
+
+
+@pytest.mark.parametrize("stage, engineName", ENGINES, ids=["%s-%s" % engine for engine in ENGINES])
+def test_engine(stage, engineName):
+    reports = equivalence.checkEngine(stage, engineName)
+    assert [(report["case"], report["maxDeviation"]) for report in reports if not report["passed"]] == []
+    # the golden outputs have to be reproduced by the reference itself
+    assert [(report["case"], report["referenceDeviation"]) for report in reports
+            if report["referenceDeviation"] > report["tolerance"]] == []
+
+
+@pytest.mark.parametrize("engineName", equivalence.NAN_ENGINES)
+def test_nan_samples(engineName):
+    reports = equivalence.checkNanSamples(engineName)
+    assert [(report["case"], report["maxDeviation"]) for report in reports if not report["passed"]] == []
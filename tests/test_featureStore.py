@@ -0,0 +1,46 @@
+# Feature stores in shared memory and in memory-mapped files
+
+import gc
+import numpy as np
+import pytest
+import featureStore
+import tensionModel
+
+PARAMS = {"featureWeights": [2, 3], "memoryWindowDur": 3, "sampleRate": 10, "attentionalWindowDur": 3, "windowShift": .25,
+          "memoryWeight": 5, "initSlope": 1, "lag": 1, "sliderOnset": True}
+
+
+def featureDict():
+    rng = np.random.default_rng(0)
+    return {1: rng.random((2, 300)), "b": rng.random((2, 200))}
+
+
+@pytest.mark.parametrize("inFile", [False, True], ids=["sharedMemory", "memmap"])
+def test_get(inFile, tmp_path):
+    features = featureDict()
+    with featureStore.createFeatureStore(features, str(tmp_path / "store") if inFile else None) as store:
+        # ids are stored as strings, and either form finds the piece
+        assert np.array_equal(store.get(1), features[1])
+        assert np.array_equal(store.get("1"), features[1])
+        assert np.array_equal(store.get("b"), features["b"])
+        assert not store.get("b").flags.writeable
+
+
+def test_views_outlive_close():
+    features = featureDict()
+    store = featureStore.createFeatureStore(features)
+    view = store.get("b")
+    store.close()
+    assert np.array_equal(view, features["b"])
+    del view
+    gc.collect()
+
+
+def test_run_model_tasks():
+    features = featureDict()
+    with featureStore.createFeatureStore(features) as store:
+        tasks = [featureStore.ModelTask(pieceId, PARAMS) for pieceId in features]
+        predictions = featureStore.runModelTasks(store, tasks, numWorkers=2)
+    for pieceId, prediction in zip(features, predictions):
+        expected = tensionModel.runModel(features[pieceId], [], ["Feature 1", "Feature 2"], name=str(pieceId), **PARAMS)
+        assert np.array_equal(prediction, expected)
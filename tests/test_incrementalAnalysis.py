@@ -0,0 +1,62 @@
+# An edited AnalysisSession against the full pipeline run on the edited MIDI file written back out
+#
+# The synthetic golden files are used because their pretty_midi round trip is exact: writing a file rounds its tempos
+# to whole microseconds per beat (which moves the beat grid of the harmony analysis), and music21 gives the notes of a
+# chord a single velocity, so a written copy of an arbitrary file isn't always parsed the same as the file itself.
+
+import os
+import numpy as np
+import pytest
+import augmentation
+import featureAnalysis as analysis
+import incrementalAnalysis
+
+GOLDEN_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "golden")
+FEATURE_WEIGHTS = [2, 3, 3, 2, 1, 1]
+SAMPLE_RATE = 10
+
+
+def instrumentOf(session, onset, pitch):
+    for index, instrument in enumerate(session.pm.instruments):
+        if any(note.pitch == pitch and abs(note.start - onset) <= session.timeTolerance for note in instrument.notes):
+            return index
+
+
+def edit(session):
+    onsets = list(session.onsetsAll)
+    # a note a fifth above the last note of an onset, given a slightly late onset that is snapped to the onset
+    note = session.onsetsAll[onsets[20]][-1]
+    session.insertNote(note.onset + .004, note.endTime, note.pitch + 7, note.velocity, instrumentOf(session, note.onset, note.pitch))
+    note = session.onsetsAll[onsets[30]][0]
+    session.modifyNote(note.onset, note.pitch, newPitch=note.pitch - 2, newVelocity=100,
+                       instrument=instrumentOf(session, note.onset, note.pitch))
+    pitch = session.onsetsAll[onsets[40]][0].pitch
+    session.deleteNote(onsets[40], pitch, instrumentOf(session, onsets[40], pitch))
+    # deleting the last bar (every onset from the start of the last chord) shortens the piece
+    lastEnd = incrementalAnalysis.lastEndTime(session.onsetsAll)
+    lastBar = min(note.onset for notes in session.onsetsAll.values() for note in notes if note.endTime >= lastEnd - 1e-9)
+    for onset in [onset for onset in onsets if onset >= lastBar]:
+        for pitch in [note.pitch for note in session.onsetsAll[onset]]:
+            session.deleteNote(onset, pitch, instrumentOf(session, onset, pitch))
+
+
+@pytest.mark.parametrize("caseName", ["synthetic2", "synthetic3"])
+def test_edits_match_written_file(caseName, tmp_path):
+    session = incrementalAnalysis.AnalysisSession(os.path.join(GOLDEN_DIR, caseName + ".mid"), FEATURE_WEIGHTS,
+                                                  SAMPLE_RATE, bDissonance=False)
+    numSamples = session.totalSamples
+    edit(session)
+    features, prediction = session.update()
+    assert session.totalSamples < numSamples
+
+    outputFile = str(tmp_path / "edited.mid")
+    session.writeMidi(outputFile)
+    expected = analysis.extractFeaturesMidi(outputFile, SAMPLE_RATE, bDissonance=False)
+    expectedPrediction = augmentation.augmentPredictions({0: expected}, FEATURE_WEIGHTS, 3, SAMPLE_RATE, 3, .25, 5, 1, 1, True)[0]
+    assert features.shape == expected.shape
+    assert np.max(np.abs(features - expected)) <= 1e-9
+    assert np.max(np.abs(prediction - expectedPrediction)) <= 1e-6
+
+    scratchFeatures, scratchPrediction = session.fromScratch()
+    assert np.max(np.abs(features - scratchFeatures)) <= 1e-9
+    assert np.max(np.abs(prediction - scratchPrediction)) <= 1e-6
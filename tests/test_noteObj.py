@@ -0,0 +1,85 @@
+# The sounding-note index (noteObj.NoteIndex) against a scan over all notes, and its feature rows
+# (featureAnalysis noteFeatures) against the augmented variants
+
+import os
+import numpy as np
+import pytest
+import augmentation
+import featureAnalysis as analysis
+import noteObj
+
+MIDI_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "midi")
+NOTE_FEATURES = (analysis.SOUNDING_DISSONANCE, analysis.TEXTURE_DENSITY, analysis.SUSTAINED_LOUDNESS)
+
+
+def randomNotes(numNotes, seed):
+    rng = np.random.default_rng(seed)
+    # Times on a coarse grid, so that many notes start and end together (and some have no duration)
+    onsets = rng.integers(0, 200, numNotes) / 4
+    endTimes = onsets + rng.integers(0, 12, numNotes) / 4
+    return onsets, endTimes, rng.integers(21, 109, numNotes), rng.integers(1, 128, numNotes)
+
+
+def scan(onsets, endTimes, pitches, velocities, time):
+    sounding = np.flatnonzero((onsets <= time) & (time < endTimes))
+    pairs = [(p, q) for i, p in enumerate(pitches[sounding]) for q in pitches[sounding][i + 1:]]
+    dissonance = sum(noteObj.diss.intervalDissonance[abs(p - q) % 12] for p, q in pairs)
+    soundingVelocities = velocities[sounding]
+    loudest = soundingVelocities.max() if len(sounding) > 0 else 0
+    loudness = loudest + noteObj.LOUDNESS_SCALE_FACTOR * (soundingVelocities.sum() - loudest)
+    return sounding, dissonance, loudness
+
+
+@pytest.mark.parametrize("seed", range(3))
+def test_queries_match_scan(seed, monkeypatch):
+    monkeypatch.setattr(noteObj, "SWEEP_CHUNK", 64) # several blocks in the sweep
+    notes = randomNotes(500, seed)
+    index = noteObj.NoteIndex(*notes)
+    times = np.concatenate((np.unique(notes[0]), np.unique(notes[1]), np.linspace(-1, 55, 301)))
+    offsets, noteIndices = index.soundingNotes(times)
+    density, dissonance, loudness = index.textureDensity(times), index.soundingDissonance(times), index.sustainedLoudness(times)
+    for i, time in enumerate(times):
+        sounding, expectedDissonance, expectedLoudness = scan(*notes, time)
+        assert sorted(noteIndices[offsets[i]:offsets[i + 1]]) == sorted(sounding)
+        assert density[i] == len(sounding)
+        assert dissonance[i] == pytest.approx(expectedDissonance, abs=1e-9)
+        assert loudness[i] == pytest.approx(expectedLoudness, abs=1e-9)
+
+
+def test_no_drift():
+    # Many chords of notes that all end before the last one: nothing sounds in between, so the dissonance and
+    # loudness must be exactly 0 there, however many notes came before
+    numChords, chordSize = 2000, 6
+    onsets = np.repeat(np.arange(numChords, dtype=float), chordSize)
+    pitches = np.tile(np.arange(60, 60 + chordSize), numChords)
+    index = noteObj.NoteIndex(onsets, onsets + .5, pitches, np.full(len(onsets), 100))
+    gaps = np.arange(numChords) + .75
+    assert np.all(index.textureDensity(gaps) == 0)
+    assert np.all(index.soundingDissonance(gaps) == 0)
+    assert np.all(index.sustainedLoudness(gaps) == 0)
+    assert np.all(index.soundingDissonance(gaps - .5) == index.soundingDissonance([0.25])[0])
+
+
+def test_feature_rows():
+    inputFile = os.path.join(MIDI_DIR, "Morgengruss.mid")
+    features = analysis.extractFeaturesMidi(inputFile, noteFeatures=NOTE_FEATURES)
+    assert len(features) == analysis.NUM_FEATURES + len(NOTE_FEATURES)
+    assert analysis.getFeatureList(noteFeatures=NOTE_FEATURES)[analysis.NUM_FEATURES:] == \
+        ["Sounding dissonance", "Texture density", "Sustained loudness"]
+
+    onsetsAll, _, _ = analysis.readMidi(inputFile)
+    notes = [note for noteList in onsetsAll.values() for note in noteList]
+    arrays = [np.array([getattr(note, name) for note in notes]) for name in ("onset", "endTime", "pitch", "velocity")]
+    for sample in range(0, features.shape[1], 7):
+        sounding, dissonance, loudness = scan(*arrays, sample / 10)
+        expected = [dissonance, len(sounding), loudness]
+        assert features[analysis.NUM_FEATURES:, sample] == pytest.approx(expected, abs=1e-9)
+
+    with pytest.raises(ValueError):
+        analysis.extractFeaturesMidi(inputFile, noteFeatures=["texture"])
+
+
+def test_augmented_note_features():
+    reports = augmentation.verifyAugmentation(os.path.join(MIDI_DIR, "Morgengruss.mid"), transpositions=(-5, 0, 7),
+                                              timeScales=(.8, 1, 1.25), noteFeatures=NOTE_FEATURES)
+    assert [report for report in reports if not report["passed"]] == []
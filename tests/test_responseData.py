@@ -0,0 +1,43 @@
+# Resampling response logs onto the model's sample grid
+
+import numpy as np
+import pytest
+import responseData
+
+
+def randomLogs(numParticipants, seed=0):
+    rng = np.random.default_rng(seed)
+    participants, times, values = [], [], []
+    for participant in range(numParticipants):
+        if participant % 11 == 3:
+            continue # no log
+        numEntries = int(rng.integers(1, 40))
+        entryValues = rng.random(numEntries)
+        entryValues[rng.random(numEntries) < .05] = np.nan
+        participants += [participant] * numEntries
+        times += list(np.sort(rng.random(numEntries) * 70 - 3))
+        values += list(entryValues)
+    order = rng.permutation(len(participants))
+    return np.array(participants)[order], np.array(times)[order], np.array(values)[order]
+
+
+@pytest.mark.parametrize("method", [responseData.HOLD, responseData.LINEAR])
+@pytest.mark.parametrize("maxGap", [None, 2.5])
+def test_blocks(method, maxGap, monkeypatch):
+    participants, times, values = randomLogs(57)
+    expected, expectedMask = responseData.resampleLogs(participants, times, values, 59, 10, 650, method, .5, maxGap=maxGap)
+    # one participant per block, and blocks that don't divide the participants evenly
+    for blockElements in (1, 650 * 4):
+        monkeypatch.setattr(responseData, "BLOCK_ELEMENTS", blockElements)
+        data, mask = responseData.resampleLogs(participants, times, values, 59, 10, 650, method, .5, maxGap=maxGap)
+        assert np.array_equal(mask, expectedMask)
+        assert np.array_equal(data, expected, equal_nan=True)
+
+
+def test_hold_and_linear():
+    # participant 0 logs 0 at 1s and 1 at 2s; participant 1 starts with a NaN entry, which mustn't leak into participant 0
+    data, mask = responseData.resampleLogs([0, 0, 1, 1], [1, 2, 1.5, 2.5], [0, 1, np.nan, 3], 2, 2, 7, responseData.LINEAR)
+    assert np.array_equal(mask, [[False, False, True, True, True, True, True], [False, False, False, False, False, True, True]])
+    assert np.array_equal(data[0, 2:], [0, .5, 1, 1, 1])
+    data, mask = responseData.resampleLogs([0, 0], [1, 2], [0, 1], 1, 2, 5, responseData.HOLD)
+    assert np.array_equal(data, [[np.nan, np.nan, 0, 0, 1]], equal_nan=True)
@@ -5,17 +5,14 @@
 # Guo R, Simpson I, Magnusson T, Kiefer C., Herremans D. 2020. A variational autoencoder for music generation 
 # controlled by tonal tension. Joint Conference on AI Music Creativity (CSMC + MuMe).
 
-import sys
-import music21
 import numpy as np 
 import tension_calculation as tc
-import json
 import math
 import os
-import sys
 from collections import Counter
 import matplotlib.pyplot as plt
 from numpy import ndarray
+from typing import List
 
 PianoRoll = ndarray
 
@@ -75,179 +72,98 @@ beta = 0.75
 verticalStep = 0.4
 radius = 1.0
 
-def getTonalTension(file_name, output_folder, vertical_step, track_num, window_size, key_name, key_changed, end_ratio):
+# Key profiles (major, minor) used by music21's KrumhanslSchmuckler, TemperleyKostkaPayne and BellmanBudge key analyzers
+key_profiles = {'KrumhanslSchmuckler': ([6.35, 2.23, 3.48, 2.33, 4.38, 4.09, 2.52, 5.19, 2.39, 3.66, 2.29, 2.88],
+                                        [6.33, 2.68, 3.52, 5.38, 2.60, 3.53, 2.54, 4.75, 3.98, 2.69, 3.34, 3.17]),
+                'TemperleyKostkaPayne': ([0.748, 0.060, 0.488, 0.082, 0.670, 0.460, 0.096, 0.715, 0.104, 0.366, 0.057, 0.400],
+                                         [0.712, 0.084, 0.474, 0.618, 0.049, 0.460, 0.105, 0.747, 0.404, 0.067, 0.133, 0.330]),
+                'BellmanBudge': ([16.80, 0.86, 12.95, 1.41, 13.49, 11.93, 1.25, 20.28, 1.80, 8.04, 0.62, 10.57],
+                                 [18.16, 0.69, 12.99, 13.34, 1.07, 11.15, 1.38, 21.07, 7.49, 1.53, 0.92, 10.21])}
 
-    retvals = []
-    if math.sqrt(2/15) <= vertical_step <= math.sqrt(0.2):
-        verticalStep = vertical_step
-    else:
-        print('invalid vertical step, use 0.4 instead')
-        verticalStep = 0.4
 
-    #output_json_name = os.path.join(output_folder, "files_result.json")
+def key_profile_matrix(major_weights, minor_weights) -> ndarray:
+    # rows 0-11 are the major keys on tonics C..B, rows 12-23 the minor keys; row i is the profile rotated to tonic i
+    rotation = (np.arange(octave)[np.newaxis, :] - np.arange(octave)[:, np.newaxis]) % octave
+    return np.concatenate([np.array(major_weights)[rotation], np.array(minor_weights)[rotation]], axis=0)
 
-    files_result = {}
 
-    # test purpose
-    # note_to_note_diff = note_to_note_pos([0,1,2,3,4,5,6,7,8,9,10,11],pitch_index_to_position(note_index_to_pitch_index[0]))
-    # note_to_key_diff = note_to_key_pos([0,1,2,3,4,5,6,7,8,9,10,11],major_key_position(0))
-    # chord_to_key_diff = chord_to_key_pos([0,1,2,3,4,5,6,7,8,9,10,11],major_key_position(0))
-    # key_to_key_diff = key_to_key_pos([0, 1, 2, 3, 4, 5, 6, 7, 8, 9, 10, 11], major_key_position(0))
+key_profile_matrices = {name: key_profile_matrix(major, minor) for name, (major, minor) in key_profiles.items()}
 
-    if len(file_name) > 0:
-        all_names = [file_name]
-        input_folder = os.path.dirname(file_name)
-    else:
-        all_names = os.walk(input_folder)
 
-    for file_name in all_names:
+def pitch_class_histogram(piano_roll: PianoRoll) -> ndarray:
+    # every piano roll column is a sixteenth step, so summing the columns weights each pitch class by its duration
+    histogram = np.zeros(octave)
+    np.add.at(histogram, np.arange(piano_roll.shape[0]) % octave, piano_roll.sum(axis=1))
+    return histogram
 
-        base_name = os.path.basename(file_name)
 
-        # logger.info(f'working on {file_name}')
-        # file_name = '/Users/ruiguo/Downloads/36067affdbefb38a779e510e6edabe6b.mid'
-        result = tc.extract_notes(file_name, track_num)
+def key_profile_correlations(histogram: ndarray, profile_matrix: ndarray) -> ndarray:
+    # Pearson correlation of the histogram with all 24 rotated key profiles
+    centred_profiles = profile_matrix - profile_matrix.mean(axis=1, keepdims=True)
+    centred_histogram = histogram - histogram.mean()
+    denominator = np.linalg.norm(centred_profiles, axis=1) * np.linalg.norm(centred_histogram)
+    if denominator[0] == 0:
+        return np.zeros(profile_matrix.shape[0])
+    return centred_profiles @ centred_histogram / denominator
+
+
+def estimate_key_names(piano_roll: PianoRoll) -> List[str]:
+    return estimate_key_names_from_histogram(pitch_class_histogram(piano_roll))
 
-        if result is None:
-            continue
-        else:
-            pm, piano_roll, sixteenth_time, beat_time, down_beat_time, beat_indices, down_beat_indices = result
-
-        try:
-            if key_name == '':
-                # key_name = get_key_name(file_name)
-                key_name = all_key_names
-
-                """ def cal_tension(file_name: str,
-                piano_roll: PianoRoll,
-                sixteenth_time: ndarray,
-                beat_time: ndarray,
-                beat_indices: List[int],
-                down_beat_time: ndarray,
-                down_beat_indices: List[int],
-                input_folder: str,
-                output_folder: str,
-                window_size=1,
-                key_name='',
-                end_ratio = .2,
-                key_changed = False): """
-
-                retvals = tc.cal_tension(
-                    file_name, piano_roll, sixteenth_time, beat_time, beat_indices, down_beat_time, down_beat_indices, pm, input_folder, output_folder, window_size, key_name, end_ratio, key_changed)
-
-            else:
-                retvals = tc.cal_tension(
-                    file_name, piano_roll, sixteenth_time, beat_time, beat_indices, down_beat_time, down_beat_indices, pm, input_folder, output_folder, window_size, [key_name], end_ratio, key_changed)
-                    
-            total_tension, diameters, centroid_diff, key_name, key_change_time, key_change_bar, key_change_name, new_output_folder, times = retvals
-
-            if key_name == '':
-                result_list = []
-                result_list.append(key_name)
-
-                s = music21.converter.parse(file_name)
-                # s = music21.converter.parse(files[i][:-12] + '_remi.mid')
-
-                p = music21.analysis.discrete.KrumhanslSchmuckler()
-                p1 = music21.analysis.discrete.TemperleyKostkaPayne()
-                p2 = music21.analysis.discrete.BellmanBudge()
-                key1 = p.getSolution(s).name
-                key2 = p1.getSolution(s).name
-                key3 = p2.getSolution(s).name
-
-                key1_name = key1.split()[0].upper()
-                key1_mode = key1.split()[1]
-
-                key2_name = key2.split()[0].upper()
-                key2_mode = key2.split()[1]
-
-                key3_name = key3.split()[0].upper()
-                key3_mode = key3.split()[1]
-
-                if key1_mode == 'major':
-                    if key1_name in major_enharmonics:
-                        result_list.append(
-                            major_enharmonics[key1_name] + ' ' + key1_mode)
-                    else:
-                        result_list.append(key1_name + ' ' + key1_mode)
-                else:
-                    if key1_name in minor_enharmonics:
-                        result_list.append(
-                            minor_enharmonics[key1_name] + ' ' + key1_mode)
-                    else:
-                        result_list.append(key1_name + ' ' + key1_mode)
-
-                if key2_mode == 'major':
-                    if key2_name in major_enharmonics:
-                        result_list.append(
-                            major_enharmonics[key2_name] + ' ' + key2_mode)
-                    else:
-                        result_list.append(key2_name + ' ' + key2_mode)
-                else:
-                    if key2_name in minor_enharmonics:
-                        result_list.append(
-                            minor_enharmonics[key2_name] + ' ' + key2_mode)
-                    else:
-                        result_list.append(key2_name + ' ' + key2_mode)
-
-                if key3_mode == 'major':
-                    if key3_name in major_enharmonics:
-                        result_list.append(
-                            major_enharmonics[key3_name] + ' ' + key3_mode)
-                    else:
-                        result_list.append(key3_name + ' ' + key3_mode)
-                else:
-                    if key3_name in minor_enharmonics:
-                        result_list.append(
-                            minor_enharmonics[key3_name] + ' ' + key3_mode)
-                    else:
-                        result_list.append(key3_name + ' ' + key3_mode)
-
-                count_result = Counter(result_list)
-                result_key = sorted(
-                    count_result, key=count_result.get, reverse=True)[0]
-
-                retvals = tc.cal_tension(
-                    file_name, piano_roll, sixteenth_time, beat_time, beat_indices, down_beat_time, down_beat_indices, pm, input_folder, output_folder, window_size, [result_key], end_ratio, key_changed)
-
-                total_tension, diameters, centroid_diff, key_name, key_change_time, key_change_bar, key_change_name, new_output_folder, times = retvals
-
-            #print(f'file name {file_name}, calculated key name {key_name}')
-            #print(f'if the calculated key name is not correct, you can set the key name by -n parameter')
-
-            if np.count_nonzero(total_tension) == 0:
-                print(f"tensile 0 skip {file_name}")
-
-                continue
-
-            if np.count_nonzero(diameters) == 0:
-                print(f"diameters 0, skip {file_name}")
-
-                continue
-
-        except (ValueError, EOFError, IndexError, OSError, KeyError, ZeroDivisionError) as e:
-            exception_str = 'Unexpected error in ' + \
-                file_name + ':\n', e, sys.exc_info()[0]
-            print(exception_str)
-
-        if key_name is not None:
-            files_result[new_output_folder + '/' + base_name] = []
-            files_result[new_output_folder + '/' + base_name].append(key_name)
-            files_result[new_output_folder + '/' +
-                            base_name].append(int(key_change_time))
-            files_result[new_output_folder + '/' +
-                            base_name].append(int(key_change_bar))
-            files_result[new_output_folder + '/' +
-                            base_name].append(key_change_name)
 
+def estimate_key_names_from_histogram(histogram: ndarray) -> List[str]:
+    # one key name per key profile, with the same enharmonic spelling as the spiral array key names
+    key_names = []
+    for profile_matrix in key_profile_matrices.values():
+        best = int(np.argmax(key_profile_correlations(histogram, profile_matrix)))
+        key = pitch_index_to_sharp_names[best % octave]
+        if best < octave:
+            key_names.append(major_enharmonics.get(key, key) + ' major')
         else:
-            print(f'cannot find the key of song {file_name}, skip this file')
+            key_names.append(minor_enharmonics.get(key, key) + ' minor')
+    return key_names
 
-#    print(len(files_result))
-#    with open(os.path.join(output_folder, 'files_result.json'), 'w') as fp:
-#        json.dump(files_result, fp)
 
-    return retvals
+def vote_key_name(piano_roll: PianoRoll) -> str:
+    # majority vote of the three key profiles; '' (find the key among all keys) when no two of them agree
+    result_list = ['']
+    result_list.extend(estimate_key_names(piano_roll))
+    count_result = Counter(result_list)
+    return sorted(count_result, key=count_result.get, reverse=True)[0]
+
+
+def getTonalTension(file_name, output_folder, vertical_step, track_num, window_size, key_name, key_changed, end_ratio, key_vote=False):
+    # A wrapper of tension_calculation.AnalysisContext that keeps the original status messages, prints errors instead
+    # of raising them, and returns the list of cal_tension (an empty list if the file can't be analyzed).
+    # With key_vote, an unknown key (key_name = '') is the majority vote of the three key profiles, if two of them agree,
+    # instead of the closest of all keys in the spiral array
+    if not math.sqrt(2/15) <= vertical_step <= math.sqrt(0.2):
+        print('invalid vertical step, use 0.4 instead')
+        vertical_step = 0.4
+
+    try:
+        context = tc.AnalysisContext(vertical_step=vertical_step, window_size=window_size, end_ratio=end_ratio,
+                                     key_changed=key_changed, track_num=track_num)
+        notes = context.extract_notes(file_name)
+        if key_name == '' and key_vote:
+            pm, piano_roll = notes[:2]
+            key_name = vote_key_name(piano_roll)
+        result = context.analyze(*notes, key_name=key_name)
+    except tc.TensionAnalysisError as e:
+        print('Unexpected error in ' + file_name + ':\n', e)
+        return []
+
+    if result.key_change_time != -1:
+        m = int(result.key_change_time // 60)
+        s = int(result.key_change_time % 60)
+        print(f'key changed, change time is {m} minutes, {s} second')
+    if np.count_nonzero(result.total_tension) == 0:
+        print(f"tensile 0 skip {file_name}")
+    elif np.count_nonzero(result.diameters) == 0:
+        print(f"diameters 0, skip {file_name}")
+
+    new_output_folder = os.path.dirname(os.path.join(output_folder, os.path.basename(file_name)))
+    return result.as_list(new_output_folder)
 
 
 def draw_tension(time, values):
@@ -257,9 +173,18 @@ def draw_tension(time, values):
     plt.tight_layout()
     plt.show()
 
-def analyzeTonalTension(fileName, outputDir, windowSize, endRatio = .5, keyChanged=False, keyName='', trackNum=0):
+# keyVote: find an unknown key (keyName = '') by the vote of the three key profiles (see getTonalTension)
+def analyzeTonalTension(fileName, outputDir, windowSize, endRatio = .5, keyChanged=False, keyName='', trackNum=0, keyVote=False):
+    total_tension, diameters, centroid_diff, times = analyzeTonalTensionComponents(fileName, outputDir, windowSize, endRatio,
+                                                                                   keyChanged, keyName, trackNum, keyVote)
+    return total_tension, times
+
+# The same analysis, also returning the other two values computed in the same pass: the diameter of the notes in
+# each window (harmonic spread) and the distance between consecutive window centroids (harmonic motion)
+def analyzeTonalTensionComponents(fileName, outputDir, windowSize, endRatio = .5, keyChanged=False, keyName='', trackNum=0,
+                                  keyVote=False):
     # trackNum = 0 default means use all tracks
-    result = getTonalTension(fileName, outputDir, verticalStep, trackNum, windowSize, keyName, keyChanged, endRatio)
+    result = getTonalTension(fileName, outputDir, verticalStep, trackNum, windowSize, keyName, keyChanged, endRatio, keyVote)
     total_tension, diameters, centroid_diff, key_name, key_change_time, key_change_bar, key_change_name, new_output_folder, times = result
     #draw_tension(times[:len(total_tension)],total_tension)
-    return total_tension, times
\ No newline at end of file
+    return total_tension, diameters, centroid_diff, times
\ No newline at end of file
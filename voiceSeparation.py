@@ -0,0 +1,104 @@
+# Polyphonic voice separation by sweeping over note start/end events
+#
+# A more polyphonic alternative to noteObj.getMelodicLine (which takes the highest note of each onset): the notes'
+# start and end events are sorted once and swept in time order while the sounding pitches are kept in a sorted list.
+# After each time point the streams take their values from the sounding notes: the top voice is the highest sounding
+# pitch, the bass the lowest, and inner voice j the (j+1)-th highest.  So when a melody note ends while lower notes
+# are held, the top voice moves down to the highest held note.  A stream keeps its last value while there are not
+# enough sounding notes for it (e.g. in rests), and before its first note it has the value of that note (as
+# featureAnalysis.fillLeadingZeros does for the melodic contour).
+#
+# Sorting the events is O(n log n); each event then costs a binary search in the list of sounding notes.
+#
+# Example usage:
+#   streams = voiceSeparation.separateVoices(onsets, endTimes, pitches, numInner=1)
+#   topTimes, topPitches, topInitVal = streams["top"]
+
+import bisect
+import numpy as np
+
+TOP = "top"
+BASS = "bass"
+INNER_PREFIX = "inner"
+
+
+# Stream names from the highest voice to the lowest: top, inner1, ..., innerN, bass
+def voiceNames(numInner=1):
+    return [TOP] + [INNER_PREFIX + str(j + 1) for j in range(numInner)] + [BASS]
+
+
+# Number of inner voices needed to produce all of the given stream names
+def numInnerVoices(names):
+    inner = [int(name[len(INNER_PREFIX):]) for name in names if name.startswith(INNER_PREFIX)]
+    return max(inner) if inner else 0
+
+
+# Onset times, end times and pitches of all notes in onsetsAll (dict keyed by onset time with lists of noteObjs)
+def notesFromOnsets(onsetsAll):
+    notes = [note for noteList in onsetsAll.values() for note in noteList]
+    onsets = np.array([note.onset for note in notes], dtype=float)
+    endTimes = np.array([note.endTime for note in notes], dtype=float)
+    pitches = np.array([note.pitch for note in notes], dtype=int)
+    return onsets, endTimes, pitches
+
+
+# Returns a dict keyed by stream name (see voiceNames) with the events of each stream as
+# (event times, pitches, value before the first event), the same form as the featureAnalysis.get...Events functions.
+# overlapTolerance: notes ending less than this many seconds after a new onset are treated as having ended
+# (the same 10ms buffer as noteObj.getMelodicLine)
+def separateVoices(onsets, endTimes, pitches, numInner=1, overlapTolerance=.01):
+    onsets = np.asarray(onsets, dtype=float)
+    endTimes = np.asarray(endTimes, dtype=float)
+    # Notes shorter than the tolerance keep their own end time
+    endTimes = np.where(endTimes - overlapTolerance > onsets, endTimes - overlapTolerance, np.maximum(endTimes, onsets))
+    pitches = np.asarray(pitches, dtype=int)
+    names = voiceNames(numInner)
+    numVoices = len(names)
+
+    # All events sorted by time; at the same time, note ends come before note starts, except for the ends of notes
+    # with no duration (which have to come after their own starts)
+    times = np.concatenate((endTimes, onsets))
+    eventOrder = np.concatenate((np.where(endTimes > onsets, 0, 2), np.ones(len(onsets), dtype=int)))
+    eventPitches = np.concatenate((pitches, pitches))
+    order = np.lexsort((eventOrder, times))
+    times = times[order].tolist()
+    isStart = (eventOrder[order] == 1).tolist()
+    eventPitches = eventPitches[order].tolist()
+
+    sounding = [] # sorted pitches of the sounding notes (a pitch appears once per sounding note)
+    streamTimes = [[] for _ in range(numVoices)]
+    streamValues = [[] for _ in range(numVoices)]
+    numEvents = len(times)
+    for e in range(numEvents):
+        if isStart[e]:
+            bisect.insort(sounding, eventPitches[e])
+        else:
+            del sounding[bisect.bisect_left(sounding, eventPitches[e])]
+
+        # Record the streams once all events at this time have been applied
+        if e + 1 < numEvents and times[e + 1] == times[e]:
+            continue
+        numSounding = len(sounding)
+        for v in range(numVoices):
+            if v == numVoices - 1:
+                # The bass is the lowest sounding note (the same note as the top voice when only one sounds)
+                if numSounding == 0:
+                    continue
+                value = sounding[0]
+            elif v == 0 or numSounding >= v + 2:
+                # Inner voice v needs v notes above it and one below it for the bass
+                if numSounding == 0:
+                    continue
+                value = sounding[-1 - v]
+            else:
+                continue
+            if not streamValues[v] or streamValues[v][-1] != value:
+                streamTimes[v].append(times[e])
+                streamValues[v].append(value)
+
+    streams = {}
+    for v, name in enumerate(names):
+        values = np.array(streamValues[v], dtype=float)
+        initVal = values[0] if values.size > 0 else 0
+        streams[name] = (np.array(streamTimes[v], dtype=float), values, initVal)
+    return streams